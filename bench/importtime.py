@@ -0,0 +1,79 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Startup benchmark: time 'import betdaq' in a fresh interpreter and
+check it is within the import time budget.  Importing the library
+should not import SUDS or parse the WSDL; this only happens when an
+API function is first called.  Exits with status 1 if over budget.
+
+Usage: python bench/importtime.py [number of runs]
+"""
+
+import os
+import sys
+import subprocess
+
+# import time budget in seconds (median over all runs)
+BUDGET = 0.05
+
+# modules that should not be imported by 'import betdaq'
+_SLOWMODULES = ['suds', 'multiprocessing']
+
+_SCRIPT = ('import sys, time\n'
+           't = time.time()\n'
+           'import betdaq\n'
+           'print time.time() - t\n'
+           'print " ".join(m for m in {0} if m in sys.modules)\n'
+           .format(_SLOWMODULES))
+
+def time_import():
+    """Return (import time, slow modules imported) for a fresh process."""
+
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([root, env.get('PYTHONPATH', '')])
+    # -B so that writing .pyc files doesn't affect the timing.
+    out = subprocess.check_output([sys.executable, '-B', '-c', _SCRIPT],
+                                  env=env)
+    lines = out.splitlines()
+    slow = lines[1].split() if len(lines) > 1 else []
+    return float(lines[0]), slow
+
+def main(nruns):
+    times = []
+    slow = set()
+    for i in range(nruns):
+        (t, s) = time_import()
+        times.append(t)
+        slow.update(s)
+    times.sort()
+    median = times[len(times) // 2]
+    print 'import betdaq: median {0:.1f} ms, min {1:.1f} ms, max {2:.1f} ms'\
+          .format(median * 1000, times[0] * 1000, times[-1] * 1000)
+    print 'budget: {0:.1f} ms'.format(BUDGET * 1000)
+    ok = True
+    if slow:
+        print 'FAIL: import betdaq imported {0}'.format(' '.join(sorted(slow)))
+        ok = False
+    if median > BUDGET:
+        print 'FAIL: import time over budget'
+        ok = False
+    return ok
+
+if __name__ == '__main__':
+    nruns = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    sys.exit(0 if main(nruns) else 1)
@@ -0,0 +1,148 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark for the memory used by, and time taken to create,
+exchange.Selection and exchange.Order objects, against the previous
+implementation (a __dict__ per object, and prices as lists of
+tuples), which is reproduced here.
+
+Usage: python bench/objects.py [number of selections]
+"""
+
+import sys
+import timeit
+from array import array
+
+from betdaq import exchange
+
+class OldSelection(object):
+    """exchange.Selection before __slots__ and price arrays."""
+    def __init__(self, name, sid, marketid, mback, mlay, lastmatched,
+                 lastmatchedprice, lastmatchedamount, backprices,
+                 layprices, src, wsn, **kwargs):
+        self.name = name.encode('ascii', 'ignore')
+        self.id = sid
+        self.mid = marketid
+        self.matchedback = mback
+        self.matchedlay = mlay
+        self.lastmatched = lastmatched
+        self.lastmatchedprice = lastmatchedprice
+        self.lastmatchedamount = lastmatchedamount
+        self.src = src
+        self.wsn = wsn
+        self.properties = kwargs
+        self.backprices = backprices
+        self.layprices = layprices
+
+class OldOrder(object):
+    """exchange.Order before __slots__."""
+    def __init__(self, sid, stake, price, polarity, **kwargs):
+        self.sid = sid
+        self.stake = stake
+        self.price = price
+        self.polarity = polarity
+        self.status = exchange.O_NOTPLACED
+        self.cancelrunning = True
+        self.cancelreset = True
+        self.src = 0
+        self.wsn = 0
+        for kw in kwargs:
+            setattr(self, kw, kwargs[kw])
+
+def deepsize(obj, seen=None):
+    """Return approximate number of bytes used by obj and its contents."""
+
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deepsize(k, seen) + deepsize(v, seen)
+                    for (k, v) in obj.iteritems())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(deepsize(o, seen) for o in obj)
+    if hasattr(obj, '__dict__'):
+        size += deepsize(obj.__dict__, seen)
+    for a in getattr(type(obj), '__slots__', ()):
+        if hasattr(obj, a):
+            size += deepsize(object.__getattribute__(obj, a), seen)
+    return size
+
+def selection_args(i, arrays=False):
+    """
+    Arguments for the i'th selection, with the prices as lists of
+    (price, stake) as given by the SUDS parser, or if arrays is True
+    as flat arrays, as given by the XML parser.
+    """
+
+    back = [(3.0 - 0.05 * p, 10.0 + p + i) for p in range(3)]
+    lay = [(3.1 + 0.05 * p, 20.0 + p + i) for p in range(3)]
+    if arrays:
+        back = array('d', [x for ps in back for x in ps])
+        lay = array('d', [x for ps in lay for x in ps])
+    return ((u'Selection {0}'.format(i % 20), 1000000 + i, 100 + i // 20,
+             1234.5 + i, 987.6 + i, None, 3.05, 12.5, back, lay, 0, 1),
+            {'_Status': 1})
+
+def order_args(i):
+    return ((1000000 + i, 2.0 + i, 3.05, exchange.O_BACK),
+            {'oref': 5000000 + i, 'mid': 100 + i // 20, 'status': 1,
+             'matchedstake': 0.0, 'unmatchedstake': 2.0 + i})
+
+def create_time(cls, args):
+    """Return time in us to create an object of cls, for each of args."""
+
+    t = min(timeit.repeat(lambda: [cls(*a, **kw) for (a, kw) in args],
+                          number=1, repeat=5))
+    return t / len(args) * 1e6
+
+def compare(name, oldcls, newcls, args, newargs=None):
+    """
+    Compare objects of oldcls and newcls created from args, and the
+    time to create newcls objects from newargs, if given.
+    """
+
+    old = [oldcls(*a, **kw) for (a, kw) in args]
+    new = [newcls(*a, **kw) for (a, kw) in args]
+    # the interned names are shared, as are identical floats in the
+    # arguments, so count each object once across the whole list.
+    oldsize = deepsize(old)
+    newsize = deepsize(new)
+    n = len(args)
+    print '{0}: {1} objects'.format(name, n)
+    print '  memory  old {0:8.0f} bytes each, new {1:8.0f} bytes each'\
+          .format(float(oldsize) / n, float(newsize) / n)
+    print '  create  old {0:8.2f} us each,    new {1:8.2f} us each'\
+          .format(create_time(oldcls, args), create_time(newcls, args))
+    if newargs is not None:
+        print '  create  new {0:8.2f} us each from arrays'\
+              .format(create_time(newcls, newargs))
+
+def main(n):
+    # the old class is given lists, as both parsers used to make;
+    # the new one packs them into arrays, unless the XML parser has
+    # already done so.
+    compare('Selection', OldSelection, exchange.Selection,
+            [selection_args(i) for i in range(n)],
+            [selection_args(i, True) for i in range(n)])
+    compare('Order', OldOrder, exchange.Order,
+            [order_args(i) for i in range(n)])
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
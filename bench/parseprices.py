@@ -0,0 +1,111 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark for parsing GetPrices responses: the SUDS path (SUDS
+unmarshals the response, then apiparse.ParseGetPrices) against the
+direct XML parser (apiparse.ParseGetPricesXML), on a generated
+response for 50 markets.  The SUDS path is skipped if SUDS is not
+installed.  No requests are sent.
+
+Usage: python bench/parseprices.py [markets] [selections per market]
+"""
+
+import sys
+import timeit
+
+from betdaq import apiparse
+
+_NS = 'http://www.GlobalBettingExchange.com/ExternalAPI/'
+
+def make_response(nmarkets, nsel, nprices=5):
+    """Return (market ids, XML of GetPrices response)."""
+
+    mids = range(1000000, 1000000 + nmarkets)
+    parts = ['<?xml version="1.0" encoding="utf-8"?>'
+             '<soap:Envelope '
+             'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+             '<soap:Body><GetPricesResponse xmlns="{0}"><GetPricesResult>'
+             '<ReturnStatus Code="0" Description="Success" CallId="x"/>'
+             '<Timestamp>2013-08-04T14:30:00.123Z</Timestamp>'.format(_NS)]
+    for mid in mids:
+        parts.append('<MarketPrices Id="{0}" Name="Market {0}" Type="1" '
+                     'IsPlayMarket="false" Status="2" '
+                     'NumberOfWinningSelections="1" '
+                     'StartTime="2013-08-04T15:00:00Z" '
+                     'WithdrawalSequenceNumber="1" DisplayOrder="0" '
+                     'IsEnabledForMultiples="false" '
+                     'IsInRunningAllowed="true" '
+                     'IsManagedWhenInRunning="true" '
+                     'IsCurrentlyInRunning="false" '
+                     'InRunningDelaySeconds="5">'.format(mid))
+        for s in range(nsel):
+            parts.append('<Selections Id="{0}" Name="Selection {1}" '
+                         'Status="1" ResetCount="0" DeductionFactor="0" '
+                         'MatchedSelectionForStake="1234.5" '
+                         'MatchedSelectionAgainstStake="987.6" '
+                         'LastMatchedOccurredAt="2013-08-04T14:29:59.5Z" '
+                         'LastMatchedPrice="3.05" '
+                         'LastMatchedForSideAmount="12.5">'\
+                         .format(mid * 100 + s, s))
+            for p in range(nprices):
+                parts.append('<ForSidePrices Price="{0}" Stake="{1}"/>'\
+                             .format(3.0 - 0.05 * p, 10.0 + p))
+            for p in range(nprices):
+                parts.append('<AgainstSidePrices Price="{0}" Stake="{1}"/>'\
+                             .format(3.1 + 0.05 * p, 20.0 + p))
+            parts.append('</Selections>')
+        parts.append('</MarketPrices>')
+    parts.append('</GetPricesResult></GetPricesResponse>'
+                 '</soap:Body></soap:Envelope>')
+    return mids, ''.join(parts)
+
+def suds_parser(mids, xml):
+    """Return function parsing xml the SUDS way, or None."""
+
+    try:
+        import suds
+    except ImportError:
+        return None
+    from betdaq import api
+    service = api._rcl.client.service
+
+    def parse():
+        resp = service.GetPrices(__inject={'reply': xml})
+        return apiparse.ParseGetPrices(mids, resp)
+    return parse
+
+def main(nmarkets, nsel):
+    (mids, xml) = make_response(nmarkets, nsel)
+    print '{0} markets, {1} selections each, {2} kB of XML'\
+          .format(nmarkets, nsel, len(xml) // 1024)
+    funcs = [('xml (Selection)',
+              lambda: apiparse.ParseGetPricesXML(mids, xml)),
+             ('xml (tuples)',
+              lambda: apiparse.ParseGetPricesXML(mids, xml, True))]
+    sudsfn = suds_parser(mids, xml)
+    if sudsfn is None:
+        print 'SUDS not installed, skipping SUDS parser'
+    else:
+        funcs.insert(0, ('suds', sudsfn))
+    for (name, fn) in funcs:
+        t = min(timeit.repeat(fn, number=5, repeat=3)) / 5
+        print '{0:16s} {1:8.2f} ms per response'.format(name, t * 1000)
+
+if __name__ == '__main__':
+    nmarkets = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    nsel = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    main(nmarkets, nsel)
@@ -0,0 +1,78 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Benchmark for pricediff.PriceDiffer: time to diff successive polls of
+generated prices where a given fraction of the selections change.
+No requests are sent.
+
+Usage: python bench/pricediff.py [markets] [selections per market]
+                                 [fraction changed]
+"""
+
+import sys
+import time
+import random
+
+from betdaq import exchange
+from betdaq.pricediff import PriceDiffer
+
+def make_poll(nmarkets, nsel, changed, rng, bumps):
+    """
+    Return prices as api.GetPrices would, where the back stakes of a
+    fraction changed of the selections have moved since the last poll
+    (bumps is the amount each selection has moved by so far).
+    """
+
+    allselections = []
+    for m in range(nmarkets):
+        sels = []
+        for s in range(nsel):
+            key = (m, s)
+            if rng.random() < changed:
+                bumps[key] = bumps.get(key, 0.0) + 1.0
+            bump = bumps.get(key, 0.0)
+            back = [(3.0 - 0.05 * p, 10.0 + p + bump) for p in range(3)]
+            lay = [(3.1 + 0.05 * p, 20.0 + p) for p in range(3)]
+            sels.append(exchange.Selection('Selection', m * 100 + s, m,
+                                           1234.5, 987.6, None, 3.05, 12.5,
+                                           back, lay, 0, 1, _Status=1))
+        allselections.append(sels)
+    return allselections
+
+def main(nmarkets, nsel, changed):
+    rng = random.Random(1)
+    bumps = {}
+    polls = [make_poll(nmarkets, nsel, changed, rng, bumps)
+             for i in range(10)]
+    differ = PriceDiffer()
+    differ.diff(polls[0])
+    nchanges = 0
+    start = time.time()
+    for poll in polls[1:]:
+        nchanges += len(differ.diff(poll))
+    elapsed = time.time() - start
+    n = (len(polls) - 1) * nmarkets * nsel
+    print '{0} selections per poll, {1:.0%} changed'.format(nmarkets * nsel,
+                                                          changed)
+    print '{0:.2f} us per selection, {1:.1f} changes per poll'\
+          .format(elapsed / n * 1e6, float(nchanges) / (len(polls) - 1))
+
+if __name__ == '__main__':
+    nmarkets = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    nsel = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    changed = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+    main(nmarkets, nsel, changed)
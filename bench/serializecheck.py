@@ -0,0 +1,120 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Golden check for apiserialize.py: the SOAP envelopes we write
+ourselves must be equivalent XML (ignoring namespace prefixes and
+whitespace) to the envelopes SUDS produces for the same request (see
+also tests/test_apiserialize.py).  Also prints the time taken to
+produce each envelope both ways.  Exits with status 1 if any envelope
+differs.  No requests are sent.
+
+Usage: python bench/serializecheck.py
+"""
+
+import sys
+import timeit
+from xml.etree import cElementTree as ElementTree
+
+from betdaq import api, apimethod, apiserialize, exchange
+
+def canonical(xml):
+    """Return nested tuple representation of XML string."""
+
+    def canon(e):
+        return (e.tag, sorted(e.attrib.items()), (e.text or '').strip(),
+                [canon(c) for c in e])
+    return canon(ElementTree.fromstring(xml))
+
+def cases():
+    """
+    Return list of (name, suds function, our function), where the
+    functions return the envelope for the same request.
+    """
+
+    api.set_user('username', 'password')
+    rcl = api._rcl
+    scl = api._scl
+
+    mids = [1234567, 1234568, 1234569]
+    orders = [exchange.Order(100, 2.0, 3.05, exchange.O_BACK,
+                             src=1, wsn=2),
+              exchange.Order(101, 0.5, 990.0, exchange.O_LAY,
+                             cancelrunning=False)]
+    orders[0].oref = 5551
+    orders[1].oref = 5552
+
+    prices = apimethod.ApiGetPrices(rcl)
+    place = apimethod.ApiPlaceOrdersNoReceipt(scl)
+    update = apimethod.ApiUpdateOrdersNoReceipt(scl)
+    updates = [(orders[0], 3.1, 1.5), (orders[1], 980.0, -0.25)]
+    cancel = apimethod.ApiCancelOrders(scl)
+    changed = apimethod.ApiListOrdersChangedSince(scl)
+
+    # the envelopes SUDS would send (see ApiMethod.make_envelope).
+    def suds_prices():
+        prices.req.MarketIds = mids
+        return prices.make_envelope(rcl.client, prices.req)
+
+    def suds_place():
+        place.req.Orders.Order = place.makeorderlist(orders)
+        return place.make_envelope(scl.client, place.req)
+
+    def suds_update():
+        update.req.Orders.Order = update.makeorderlist(updates)
+        return update.make_envelope(scl.client, update.req)
+
+    def suds_cancel():
+        cancel.req.OrderHandle = [o.oref for o in orders]
+        return cancel.make_envelope(scl.client, cancel.req)
+
+    def suds_changed():
+        changed.req.SequenceNumber = 42
+        return changed.make_envelope(scl.client, changed.req)
+
+    return [('GetPrices', suds_prices,
+             lambda: apiserialize.SerializeGetPrices(rcl.headerattrs,
+                                                     mids)),
+            ('PlaceOrdersNoReceipt', suds_place,
+             lambda: apiserialize.SerializePlaceOrdersNoReceipt(
+                 scl.headerattrs, orders, True)),
+            ('UpdateOrdersNoReceipt', suds_update,
+             lambda: apiserialize.SerializeUpdateOrdersNoReceipt(
+                 scl.headerattrs, updates)),
+            ('CancelOrders', suds_cancel,
+             lambda: apiserialize.SerializeCancelOrders(
+                 scl.headerattrs, [o.oref for o in orders])),
+            ('ListOrdersChangedSince', suds_changed,
+             lambda: apiserialize.SerializeListOrdersChangedSince(
+                 scl.headerattrs, 42))]
+
+def main():
+    ok = True
+    for (name, sudsfn, ourfn) in cases():
+        same = canonical(sudsfn()) == canonical(ourfn())
+        tsuds = min(timeit.repeat(sudsfn, number=100, repeat=3)) / 100
+        tours = min(timeit.repeat(ourfn, number=100, repeat=3)) / 100
+        print '{0:24s} {1:4s} suds {2:8.1f} us  ours {3:8.1f} us'\
+              .format(name, 'OK' if same else 'FAIL', tsuds * 1e6,
+                      tours * 1e6)
+        if not same:
+            print sudsfn()
+            print ourfn()
+            ok = False
+    return ok
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,521 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Coroutine versions of the Betdaq API functions in api.py, for use
+with an asyncio event loop.  Since this library is written for Python
+2, we use trollius (the Python 2 port of asyncio), so the coroutines
+here should be called with 'yield From(...)', e.g.
+
+from trollius import From
+from betdaq import aio
+
+@trollius.coroutine
+def poll(mids):
+    selections = yield From(aio.GetPrices(mids))
+
+SUDS is used to build the SOAP envelope and to unmarshal the reply,
+but the HTTP request itself is sent without blocking, so that many
+API calls can be in flight at once on a single event loop.  The
+username and password are shared with api.py (see api.set_user), and
+the rate limits in ratelimit.py apply here too.
+"""
+
+import errno
+import urlparse
+from StringIO import StringIO
+
+try:
+    import trollius as asyncio
+    from trollius import From, Return
+except ImportError:
+    raise ImportError('betdaq.aio requires the trollius package')
+
+from suds.transport import TransportError
+
+import api
+import apimethod
+import apiparse
+import exchange
+import exchangedata
+import marketinfo
+import ratelimit
+import util
+from apilog import apilog
+
+# errors sending a request on a pooled connection which mean that the
+# server had closed the connection while it was idle (as in
+# transport.py).
+_STALEERRORS = (errno.ECONNRESET, errno.EPIPE)
+
+class _StaleConnection(Exception):
+    """
+    A pooled connection failed before any of the response arrived,
+    because the server had closed it, so the request was not acted
+    on.  error is the original exception.
+    """
+
+    def __init__(self, error):
+        Exception.__init__(self, str(error))
+        self.error = error
+
+class HttpConnectionPool(object):
+    """
+    Minimal non-blocking HTTP/1.1 client, which keeps connections
+    alive between requests so that we don't pay for a new TCP (and
+    TLS) connection on every API call.
+    """
+
+    def __init__(self, loop=None, maxidle=4):
+        self.loop = loop
+        # maximum number of idle connections kept per host
+        self.maxidle = maxidle
+        # (host, port, ssl) -> list of idle (reader, writer) pairs
+        self.idle = {}
+
+    @asyncio.coroutine
+    def post(self, url, body, headers, timeout=None):
+        """
+        POST body to url, return (status, reason, response body).
+        timeout is the time in seconds to wait for the connection,
+        for the status line, and for the rest of the response (by
+        default, without limit); asyncio.TimeoutError is raised if it
+        runs out.
+
+        As with transport.PooledTransport, the request is only sent
+        again (once, on a new connection) if a pooled connection
+        turns out to have been closed by the server before it got the
+        request: writing failed, or the connection closed without a
+        status line.  After the status line, any error is raised,
+        since the server may have acted on the request.
+        """
+
+        parts = urlparse.urlsplit(url)
+        ssl = (parts.scheme == 'https')
+        port = parts.port or (443 if ssl else 80)
+        key = (parts.hostname, port, ssl)
+        path = parts.path or '/'
+        if parts.query:
+            path = path + '?' + parts.query
+
+        lines = ['POST {0} HTTP/1.1'.format(path),
+                 'Host: {0}'.format(parts.netloc),
+                 'Content-Length: {0}'.format(len(body))]
+        lines.extend('{0}: {1}'.format(k, v) for (k, v) in headers.items())
+        request = '\r\n'.join(lines) + '\r\n\r\n' + body
+
+        idle = self.idle.setdefault(key, [])
+        writer = None
+        try:
+            if idle:
+                (reader, writer) = idle.pop()
+                try:
+                    line = yield From(self._send(reader, writer, request,
+                                                 timeout))
+                except _StaleConnection:
+                    # safe to send again, on a new connection (not on
+                    # another pooled one, which may be stale too).
+                    writer.close()
+                    writer = None
+            if writer is None:
+                (reader, writer) = yield From(asyncio.wait_for(
+                    asyncio.open_connection(parts.hostname, port, ssl=ssl,
+                                            loop=self.loop),
+                    timeout, loop=self.loop))
+                line = yield From(self._send(reader, writer, request,
+                                             timeout))
+            (status, reason, rheaders, rbody) = yield From(asyncio.wait_for(
+                self._read_response(reader, line), timeout, loop=self.loop))
+        except _StaleConnection, e:
+            writer.close()
+            raise e.error
+        except:
+            if writer is not None:
+                writer.close()
+            raise
+
+        if (rheaders.get('connection', '').lower() == 'close'
+            or len(idle) >= self.maxidle):
+            writer.close()
+        else:
+            idle.append((reader, writer))
+        raise Return((status, reason, rbody))
+
+    @asyncio.coroutine
+    def _send(self, reader, writer, request, timeout):
+        """
+        Write request, and return the status line of the response.
+        Raises _StaleConnection if the server had closed the
+        connection.
+        """
+
+        try:
+            writer.write(request)
+            yield From(writer.drain())
+            line = yield From(asyncio.wait_for(reader.readline(), timeout,
+                                               loop=self.loop))
+        except EnvironmentError, e:
+            if e.errno in _STALEERRORS:
+                raise _StaleConnection(e)
+            raise
+        if not line:
+            raise _StaleConnection(asyncio.IncompleteReadError(line, None))
+        raise Return(line)
+
+    @asyncio.coroutine
+    def _read_response(self, reader, line):
+        """
+        Return (status, reason, headers, body) read from reader,
+        given the status line.
+        """
+
+        (version, status, reason) = (line.rstrip('\r\n').split(' ', 2)
+                                     + [''])[:3]
+        headers = {}
+        while True:
+            line = yield From(reader.readline())
+            line = line.rstrip('\r\n')
+            if not line:
+                break
+            (k, v) = line.split(':', 1)
+            headers[k.strip().lower()] = v.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                line = yield From(reader.readline())
+                size = int(line.split(';')[0], 16)
+                if size == 0:
+                    # skip any trailers
+                    while (yield From(reader.readline())) not in ('\r\n',
+                                                                  ''):
+                        pass
+                    break
+                chunk = yield From(reader.readexactly(size))
+                chunks.append(chunk)
+                yield From(reader.readexactly(2))
+            body = ''.join(chunks)
+        elif 'content-length' in headers:
+            body = yield From(reader.readexactly(
+                int(headers['content-length'])))
+        else:
+            body = yield From(reader.read())
+            headers['connection'] = 'close'
+        raise Return((int(status), reason, headers, body))
+
+# the clients and method objects are created on first use, by cloning
+# the clients in api.py (so that the WSDL is only parsed once and the
+# SOAP headers set by api.set_user are used here too).  The SUDS
+# clients are only used to write envelopes and read replies (see
+# ApiMethod.make_envelope and unmarshal); we send the requests.
+_methods = {}
+_http = None
+
+def _method(cls, service):
+    """Return instance of ApiMethod subclass cls for service."""
+
+    if cls not in _methods:
+        cl = api._rcl if service == 'readonly' else api._scl
+        _methods[cls] = cls(cl.clone())
+    return _methods[cls]
+
+def set_http_pool(pool):
+    """Use HttpConnectionPool pool (e.g. for a particular loop)."""
+
+    global _http
+    _http = pool
+
+def _envelope(method, req=None):
+    """
+    Return the SOAP envelope for a call to the ApiMethod instance
+    method with request object req (None if the method takes no
+    request).
+    """
+
+    client = method.apiclient.client
+    if req is None:
+        return method.make_envelope(client)
+    return method.make_envelope(client, req)
+
+@asyncio.coroutine
+def _call(method, envelope):
+    """
+    Send SOAP envelope for the ApiMethod instance method without
+    blocking, and return the SUDS object from the reply.  The
+    envelope, and the request object it is written from, must be made
+    by the caller before it first yields, and not shared with other
+    calls: coroutines run in between, and the body of this one only
+    starts after they have.
+    """
+
+    global _http
+    if _http is None:
+        _http = HttpConnectionPool()
+    cl = method.apiclient
+    wait = ratelimit.limiter.reserve(method.name)
+    if wait > 0:
+        apilog.info('waited {0:.3f}s to call BDAQ Api {1}'\
+                    .format(wait, method.name))
+        yield From(asyncio.sleep(wait))
+    (status, reason, body) = yield From(_http.post(
+        cl.location(method.name), envelope,
+        cl.http_headers(method.name), cl.client.options.timeout))
+    if status in (202, 204):
+        raise Return(None)
+    if status == 500 and body:
+        # SUDS will raise a WebFault for a SOAP fault.
+        raise Return(method.unmarshal(cl.client, fault=body))
+    if status != 200:
+        raise TransportError(reason, status, StringIO(body))
+    raise Return(method.unmarshal(cl.client, body))
+
+# coroutine versions of the functions in api.py; see the ApiMethod
+# subclasses in apimethod.py for details.  Each call makes its own
+# request object (with ApiMethod.make_req), since calls to the same
+# function can be in progress at once.
+
+@asyncio.coroutine
+def ListTopLevelEvents():
+    m = _method(apimethod.ApiListTopLevelEvents, 'readonly')
+    envelope = _envelope(m, m.make_req(m.client))
+    apilog.info('calling BDAQ Api ListTopLevelEvents')
+    resp = yield From(_call(m, envelope))
+    raise Return(apiparse.ParseListTopLevelEvents(resp))
+
+@asyncio.coroutine
+def GetEventSubTreeNoSelections(ids, direct=False):
+    m = _method(apimethod.ApiGetEventSubTreeNoSelections, 'readonly')
+    req = m.make_req(m.client)
+    req.EventClassifierIds = ids
+    req._WantDirectDescendentsOnly = direct
+    envelope = _envelope(m, req)
+    apilog.info('calling BDAQ Api GetEventSubTreeNoSelections')
+    resp = yield From(_call(m, envelope))
+    raise Return(apiparse.ParseGetEventSubTreeNoSelections(resp))
+
+@asyncio.coroutine
+def _market_information_chunk(m, ids):
+    req = m.make_req(m.client)
+    req.MarketIds = ids
+    envelope = _envelope(m, req)
+    apilog.info('calling BDAQ Api GetMarketInformation')
+    resp = yield From(_call(m, envelope))
+    raise Return(apiparse.ParseGetMarketInformation(resp))
+
+@asyncio.coroutine
+def GetMarketInformation(ids):
+    m = _method(apimethod.ApiGetMarketInformation, 'readonly')
+    chunks = list(util.chunks(ids, m.MAXMIDS))
+    results = yield From(asyncio.gather(*[_market_information_chunk(m, c)
+                                          for c in chunks]))
+    allinfo = []
+    for info in results:
+        allinfo.extend(info)
+    raise Return(allinfo)
+
+@asyncio.coroutine
+def ListSelectionsChangedSince(seqnum):
+    m = _method(apimethod.ApiListSelectionsChangedSince, 'readonly')
+    req = m.make_req(m.client)
+    req._SelectionSequenceNumber = seqnum
+    envelope = _envelope(m, req)
+    apilog.info('calling BDAQ Api ListSelectionsChangedSince')
+    resp = yield From(_call(m, envelope))
+    raise Return(apiparse.ParseListSelectionsChangedSince(resp))
+
+@asyncio.coroutine
+def GetCurrentSelectionSequenceNumber():
+    m = _method(apimethod.ApiGetCurrentSelectionSequenceNumber, 'readonly')
+    envelope = _envelope(m)
+    apilog.info('calling BDAQ Api GetCurrentSelectionSequenceNumber')
+    resp = yield From(_call(m, envelope))
+    raise Return(apiparse.ParseGetCurrentSelectionSequenceNumber(resp))
+
+@asyncio.coroutine
+def _get_prices_chunk(m, ids):
+    req = m.make_req(m.client)
+    req.MarketIds = ids
+    envelope = _envelope(m, req)
+    apilog.info('calling BDAQ Api GetPrices')
+    resp = yield From(_call(m, envelope))
+    states = []
+    selections = apiparse.ParseGetPrices(ids, resp, states)
+    for st in states:
+        marketinfo.marketcache.check(st.id, st.status, st.inrunning, st.wsn)
+    raise Return(selections)
+
+@asyncio.coroutine
+def GetPrices(mids):
+    """
+    Return all selections for market ids in mids (see api.GetPrices).
+    The chunks of MAXMIDS market ids are all requested at once.
+    """
+
+    m = _method(apimethod.ApiGetPrices, 'readonly')
+    chunks = list(util.chunks(mids, apimethod.ApiGetPrices.MAXMIDS))
+    results = yield From(asyncio.gather(*[_get_prices_chunk(m, ids)
+                                          for ids in chunks]))
+    allselections = []
+    for selections in results:
+        allselections.extend(selections)
+    raise Return(allselections)
+
+@asyncio.coroutine
+def GetOddsLadder(refresh=False):
+    m = _method(apimethod.ApiGetOddsLadder, 'readonly')
+    if m.ladder is None or refresh:
+        envelope = _envelope(m, m.make_req(m.client))
+        apilog.info('calling BDAQ Api GetOddsLadder')
+        resp = yield From(_call(m, envelope))
+        m.ladder = apiparse.ParseGetOddsLadder(resp)
+        exchangedata.LADDER = m.ladder
+    raise Return(m.ladder)
+
+@asyncio.coroutine
+def GetAccountBalances():
+    m = _method(apimethod.ApiGetAccountBalances, 'secure')
+    envelope = _envelope(m)
+    apilog.info('calling BDAQ Api GetAccountBalances')
+    resp = yield From(_call(m, envelope))
+    raise Return(apiparse.ParseGetAccountBalances(resp))
+
+@asyncio.coroutine
+def ListOrdersChangedSince(seqnum=None):
+    m = _method(apimethod.ApiListOrdersChangedSince, 'secure')
+    store = m.apiclient.orders
+    req = m.make_req(m.client)
+    req.SequenceNumber = seqnum or store.seqnum
+    envelope = _envelope(m, req)
+    apilog.info(('Calling ListOrdersChangedSince with '
+                 'sequence number: {0}'.format(req.SequenceNumber)))
+    resp = yield From(_call(m, envelope))
+    data = apiparse.ParseListOrdersChangedSince(resp)
+    if not data:
+        raise Return(data)
+    (orders, snum) = data
+    with store.lock:
+        store.seqnum = max(store.seqnum, snum)
+        raise Return(store.update(orders))
+
+@asyncio.coroutine
+def ListBootstrapOrders(snum=None):
+    m = _method(apimethod.ApiListBootstrapOrders, 'secure')
+    store = m.apiclient.orders
+    req = m.make_req(m.client)
+    req.SequenceNumber = store.seqnum if snum is None else snum
+    envelope = _envelope(m, req)
+    apilog.info('calling BDAQ Api ListBootstrapOrders')
+    resp = yield From(_call(m, envelope))
+    orders = apiparse.ParseListBootstrapOrders(resp)
+    with store.lock:
+        store.seqnum = resp._MaximumSequenceNumber
+        raise Return(store.update(orders))
+
+@asyncio.coroutine
+def _place_chunk(m, ol, allornothing):
+    req = m.make_req(m.client)
+    req.Orders.Order = m.makeorderlist(ol)
+    req.WantAllOrNothingBehaviour = allornothing
+    envelope = _envelope(m, req)
+    apilog.info('calling BDAQ Api PlaceOrdersNoReceipt')
+    resp = yield From(_call(m, envelope))
+    raise Return(m.apiclient.orders.update(
+        apiparse.ParsePlaceOrdersNoReceipt(resp, ol)))
+
+@asyncio.coroutine
+def PlaceOrdersNoReceipt(orderlist, allornothing=True):
+    """
+    Place the orders in orderlist (see api.PlaceOrdersNoReceipt).  The
+    chunks of MAXORDERS orders are sent one at a time, and if one
+    fails, the later chunks are not sent.
+    """
+
+    m = _method(apimethod.ApiPlaceOrdersNoReceipt, 'secure')
+    orders = {}
+    for ol in util.chunks(orderlist, m.MAXORDERS):
+        ors = yield From(_place_chunk(m, ol, allornothing))
+        orders.update(ors)
+    raise Return(orders)
+
+@asyncio.coroutine
+def _update_chunk(m, ul):
+    req = m.make_req(m.client)
+    req.Orders.Order = m.makeorderlist(ul)
+    envelope = _envelope(m, req)
+    apilog.info('calling BDAQ Api UpdateOrdersNoReceipt')
+    resp = yield From(_call(m, envelope))
+    codes = apiparse.ParseUpdateOrdersNoReceipt(resp)
+    m.apply(ul, codes)
+    raise Return(codes)
+
+@asyncio.coroutine
+def UpdateOrdersNoReceipt(updates):
+    m = _method(apimethod.ApiUpdateOrdersNoReceipt, 'secure')
+    chunks = list(util.chunks(updates, m.MAXORDERS))
+    results = yield From(asyncio.gather(*[_update_chunk(m, ul)
+                                          for ul in chunks]))
+    codes = {}
+    for c in results:
+        codes.update(c)
+    raise Return(codes)
+
+@asyncio.coroutine
+def _cancel_chunk(m, ol):
+    req = m.make_req(m.client)
+    req.OrderHandle = [o.oref for o in ol]
+    envelope = _envelope(m, req)
+    apilog.info('calling BDAQ Api CancelOrders')
+    resp = yield From(_call(m, envelope))
+    ol = apiparse.ParseCancelOrders(resp, ol)
+    m.apiclient.orders.update([o for o in ol
+                               if o.oref in m.apiclient.orders])
+
+@asyncio.coroutine
+def CancelOrders(olist):
+    m = _method(apimethod.ApiCancelOrders, 'secure')
+    yield From(asyncio.gather(*[_cancel_chunk(m, ol)
+                                for ol in util.chunks(olist, m.MAXORDERS)]))
+    raise Return(olist)
+
+@asyncio.coroutine
+def CancelAllOrdersOnMarket(mids):
+    m = _method(apimethod.ApiCancelAllOrdersOnMarket, 'secure')
+    req = m.make_req(m.client)
+    req.MarketIds = mids
+    envelope = _envelope(m, req)
+    apilog.info('calling BDAQ Api CancelAllOrdersOnMarket')
+    resp = yield From(_call(m, envelope))
+    orefs = apiparse.ParseCancelAllOrdersOnMarket(resp)
+    m.apiclient.orders.set_status(orefs, exchange.O_CANCELLED)
+    raise Return(orefs)
+
+@asyncio.coroutine
+def CancelAllOrders():
+    m = _method(apimethod.ApiCancelAllOrders, 'secure')
+    envelope = _envelope(m)
+    apilog.info('calling BDAQ Api CancelAllOrders')
+    resp = yield From(_call(m, envelope))
+    orefs = apiparse.ParseCancelAllOrders(resp)
+    m.apiclient.orders.set_status(orefs, exchange.O_CANCELLED)
+    raise Return(orefs)
+
+@asyncio.coroutine
+def ListBlacklistInformation():
+    m = _method(apimethod.ApiListBlacklistInformation, 'secure')
+    envelope = _envelope(m)
+    apilog.info('calling BDAQ Api ListBlacklistInformation')
+    resp = yield From(_call(m, envelope))
+    raise Return(resp)
@@ -14,23 +14,78 @@
 # along with this program.  If not, see
 # <http://www.gnu.org/licenses/>.
 
-"""The Betdaq API methods."""
-
+"""
+The Betdaq API methods.
+
+All of the functions here can be called from any number of threads at
+once.  Each call uses a SUDS client and request object that no other
+call is using at the same time (see ApiMethod.checkout): these are
+kept in a pool per function, and a new pair (with a clone of the SUDS
+client, sharing the parsed WSDL and the HTTP connection pool) is only
+made when every pair is in use.  The order store (see orders()), the
+rate limiter and the response cache are shared by all threads and
+locked.  Note that:
+
+* set_user changes the SOAP headers of every call, so should be
+  called before starting threads;
+* ListBootstrapOrders is meant to be called repeatedly by one thread,
+  since each call carries on from the sequence number of the last;
+* ListOrdersChangedSince can be called from several threads, but
+  they will see overlapping changes;
+* attributes describing the last call of a function (e.g. the
+  rate limit wait in ApiMethod.waited, or the chunk timings of
+  PlaceOrdersNoReceipt) are for the last call from any thread.
+
+The coroutines in aio.py should only be used from the thread running
+their event loop.
+"""
+
+import threading
 import apimethod
 import apiclient
+import ratelimit
+from apiexception import ApiError
 
-# time in seconds to sleep between calling APIGetPrices (when called
-# with > 50 market ids).
-_PRICETHROTTLE = 10
-
-# create suds clients.  There is only 1 WSDL file, but this has two
+# create clients.  There is only 1 WSDL file, but this has two
 # 'services'.  The services are for 'readonly' methods and 'secure'
 # methods. Secure methods use an https:// url and require the user's
 # Betdaq username and password in the SOAP headers, read-only methods
-# use http:// and only require username.
+# use http:// and only require username.  Note that the suds clients
+# (and so the parsing of the WSDL) are only created when they are
+# first used, so that importing this module is fast.
 _rcl = apiclient.ApiClient('readonly')
 _scl = apiclient.ApiClient('secure')
 
+class _LazyMethod(object):
+    """
+    An Api function.  The ApiMethod instance (and with it the suds
+    client and request objects) is created the first time the
+    function is called.
+    """
+
+    def __init__(self, cls, client):
+        self.cls = cls
+        self.apiclient = client
+        self._method = None
+        self.lock = threading.Lock()
+        self.__doc__ = cls.call.__doc__
+
+    @property
+    def method(self):
+        """The ApiMethod instance."""
+
+        if self._method is None:
+            with self.lock:
+                if self._method is None:
+                    self._method = self.cls(self.apiclient)
+        return self._method
+
+    def __call__(self, *args, **kwargs):
+        return self.method.cached_call(*args, **kwargs)
+
+    def __repr__(self):
+        return '<Api function {0}>'.format(self.cls.name)
+
 def set_user(name, password):
     """
     Set username and password for SOAP headers.  Note that these are
@@ -42,39 +97,114 @@ def set_user(name, password):
     _rcl.set_headers(name, password)
     _scl.set_headers(name, password)
 
+def orders():
+    """
+    Return the order store of the session (see orderstore.py), which
+    is kept up to date by ListBootstrapOrders, ListOrdersChangedSince,
+    PlaceOrdersNoReceipt and CancelOrders.
+    """
+
+    return _scl.orders
+
+def set_rate_limit(name, calls, period):
+    """
+    Allow at most 'calls' calls to the Api method name (e.g.
+    'GetPrices') every 'period' seconds.  The defaults are given by
+    const.RATELIMITS.
+    """
+
+    ratelimit.limiter.set_limit(name, calls, period)
+
+def set_cache(name, ttl, maxentries=1000):
+    """
+    Cache the results of the read-only Api function name (e.g.
+    'ListTopLevelEvents') for ttl seconds, for up to maxentries
+    different sets of arguments (however large their results), or
+    switch caching off if ttl is None.  Calls made with the same arguments while a call is in
+    progress wait for its result.  Secure methods can't be cached.
+    The defaults are given by const.APICACHE.
+    """
+
+    func = globals().get(name)
+    if not isinstance(func, _LazyMethod):
+        raise ApiError('no Api function {0}'.format(name))
+    if ttl is not None and (not func.cls.cacheable
+                            or func.apiclient.service == 'secure'):
+        # don't create the method (and the suds client) just to refuse.
+        raise ApiError('cannot cache results of BDAQ Api {0}'.format(name))
+    func.method.set_cache(ttl, maxentries)
+
+def cache_stats():
+    """Return dict of cache statistics by name of Api function."""
+
+    stats = {}
+    for (name, func) in globals().items():
+        if isinstance(func, _LazyMethod) and func._method is not None:
+            fstats = func._method.cache_stats()
+            if fstats is not None:
+                stats[name] = fstats
+    return stats
+
 # the Api functions appear below, first 'readonly' methods, then
 # 'secure' methods, in the order that these appear in the Betdaq Api
 # docs (but note that not all of the Api methods are implemented
 # here).
 
 # get all the root events e.g. 'Horse Racing', 'Soccer' etc.
-ListTopLevelEvents = apimethod.ApiListTopLevelEvents(_rcl).call
+ListTopLevelEvents = _LazyMethod(apimethod.ApiListTopLevelEvents, _rcl)
 
 # get 'subtree' and parse it for markets
-GetEventSubTreeNoSelections = apimethod.\
-                              ApiGetEventSubTreeNoSelections(_rcl).call
+GetEventSubTreeNoSelections = _LazyMethod(apimethod.\
+                                          ApiGetEventSubTreeNoSelections,
+                                          _rcl)
 
 # get information for some market ids, e.g. starttime etc.
-GetMarketInformation = apimethod.ApiGetMarketInformation(_rcl).call
+GetMarketInformation = _LazyMethod(apimethod.ApiGetMarketInformation,
+                                   _rcl)
+
+# changes to selections since a selection sequence number, and the
+# current selection sequence number (see selectionstore.py)
+ListSelectionsChangedSince = _LazyMethod(apimethod.\
+                                         ApiListSelectionsChangedSince,
+                                         _rcl)
+GetCurrentSelectionSequenceNumber = _LazyMethod(apimethod.\
+                                    ApiGetCurrentSelectionSequenceNumber,
+                                    _rcl)
 
 # get prices for some market ids
-GetPrices = apimethod.ApiGetPrices(_rcl, _PRICETHROTTLE).call
+GetPrices = _LazyMethod(apimethod.ApiGetPrices, _rcl)
+
+# get the odds ladder (cached after the first call)
+GetOddsLadder = _LazyMethod(apimethod.ApiGetOddsLadder, _rcl)
 
 # get account information
-GetAccountBalances = apimethod.ApiGetAccountBalances(_scl).call
+GetAccountBalances = _LazyMethod(apimethod.ApiGetAccountBalances, _scl)
 
 # update order status
-ListOrdersChangedSince = apimethod.ApiListOrdersChangedSince(_scl).call
+ListOrdersChangedSince = _LazyMethod(apimethod.ApiListOrdersChangedSince,
+                                     _scl)
 
 # call ListBootstrapOrders repeatedly at startup
-ListBootstrapOrders = apimethod.ApiListBootstrapOrders(_scl).call
+ListBootstrapOrders = _LazyMethod(apimethod.ApiListBootstrapOrders,
+                                  _scl)
 
 # make order(s)
-PlaceOrdersNoReceipt = apimethod.ApiPlaceOrdersNoReceipt(_scl).call
+PlaceOrdersNoReceipt = _LazyMethod(apimethod.ApiPlaceOrdersNoReceipt,
+                                   _scl)
+
+# change price and/or stake of orders
+UpdateOrdersNoReceipt = _LazyMethod(apimethod.ApiUpdateOrdersNoReceipt,
+                                    _scl)
 
 # cancel orders
-CancelOrders = apimethod.ApiCancelOrders(_scl).call
+CancelOrders = _LazyMethod(apimethod.ApiCancelOrders, _scl)
+
+# cancel all orders on some markets, or all orders
+CancelAllOrdersOnMarket = _LazyMethod(apimethod.ApiCancelAllOrdersOnMarket,
+                                      _scl)
+CancelAllOrders = _LazyMethod(apimethod.ApiCancelAllOrders, _scl)
 
 # which Api services (hopefully none) am I currently blacklisted from?
-ListBlacklistInformation = apimethod.\
-                           ApiListBlacklistInformation(_scl).call
+ListBlacklistInformation = _LazyMethod(apimethod.\
+                                       ApiListBlacklistInformation,
+                                       _scl)
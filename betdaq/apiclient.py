@@ -16,9 +16,68 @@
 
 """BdaqApiClient class used in calling API functions for BDAQ."""
 
-from suds.client import Client
-from suds.sax.element import Element
+import os
+import sys
+import copy
+import hashlib
+import threading
 import const
+import orderstore
+from apilog import apilog
+
+# SUDS client for the WSDL file.  All ApiClient instances in the
+# process use clones of this, so that the WSDL is only parsed once (see
+# _wsdl_client).
+_WSDLCLIENT = None
+_WSDLLOCK = threading.Lock()
+
+def _wsdl_cache():
+    """
+    Return SUDS cache in which to store the parsed WSDL, or None if
+    const.WSDLCACHE is None or the cache directory can't be used.
+    """
+
+    if const.WSDLCACHE is None:
+        return None
+
+    import suds
+    from suds.cache import ObjectCache
+
+    # the cache is keyed on the hash of the WSDL file.  The parsed
+    # WSDL is pickled, so the versions of this library, of SUDS and of
+    # Python also go in the name of the cache directory.
+    with open(const.WSDLPATH, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    version = 'pybetdaq{0}-suds{1}-py{2}'.format(const.VERSION,
+                                                 suds.__version__,
+                                                 sys.version_info[0])
+    location = os.path.join(const.WSDLCACHE,
+                            '{0}-{1}'.format(digest, version))
+    try:
+        return ObjectCache(location)
+    except (IOError, OSError), e:
+        apilog.warning('not caching WSDL in {0}: {1}'.format(location, e))
+        return None
+
+def _wsdl_client():
+    """
+    Return SUDS client for the WSDL file, creating it if necessary.
+    This is read from the on-disk cache if possible.
+    """
+
+    global _WSDLCLIENT
+    with _WSDLLOCK:
+        if _WSDLCLIENT is None:
+            from suds.client import Client
+            cache = _wsdl_cache()
+            if cache is None:
+                _WSDLCLIENT = Client(const.WSDLLOCAL, cache=None)
+            else:
+                # cachingpolicy 1 means that the parsed WSDL object is
+                # cached, rather than the XML documents.
+                _WSDLCLIENT = Client(const.WSDLLOCAL, cache=cache,
+                                     cachingpolicy=1)
+    return _WSDLCLIENT
 
 class ApiClient(object):
     """
@@ -40,9 +99,9 @@ class ApiClient(object):
     
     def __init__(self, service):
         """
-        Create the SUDS client with the correct options and headers
-        for the chosen service, which can be either 'readonly' or
-        'secure'.
+        Set up a client for the chosen service, which can be either
+        'readonly' or 'secure'.  The SUDS client (which means parsing
+        the WSDL) is not created until it is first needed.
         """
         
         # allowed services
@@ -52,33 +111,110 @@ class ApiClient(object):
                           format(' '.join(aservices)))
         self.service = service
         self.snum = ApiClient._sdict[self.service][1]
-        # after this call, self.client will be a SUDS client object
-        self._create_suds_client()
-
-    def _create_suds_client(self):
-        """Return SUDS client for BDAQ API."""
-        
-        self.client = Client(const.WSDLLOCAL)
-        self.client.set_options(service = ApiClient._sdict[self.service][0],
-                                headers = {'user-agent': const.USERAGENT})
-
         # put username (and password if necessary) into the headers.
         # note that another way to do this is to call betdaq.set_user,
         # so the username and password in const.py do not need to be
         # specified.
+        self._client = None
+        # plugin that puts the SOAP header into requests (see
+        # set_headers).
+        self.plugin = None
+        self.lock = threading.Lock()
+        # the orders of this session, and the order sequence number
+        # (see orderstore.py).
+        self.orders = orderstore.OrderStore()
         self.set_headers(const.BDAQUSER, const.BDAQPASS)
 
+    @property
+    def client(self):
+        """The SUDS client object, created on first use."""
+
+        if self._client is None:
+            with self.lock:
+                if self._client is None:
+                    self._create_suds_client()
+        return self._client
+
+    def _create_suds_client(self):
+        """Create SUDS client for BDAQ API."""
+
+        # importing SUDS is slow, so we only do this when we need to.
+        import suds
+        import transport
+
+        useragent = '{0} suds/{1}'.format(const.USERAGENT, suds.__version__)
+        client = _wsdl_client().clone()
+        # the keep-alive connection pool is shared with any clones of
+        # this client.
+        client.set_options(service = ApiClient._sdict[self.service][0],
+                           headers = {'user-agent': useragent},
+                           transport = transport.PooledTransport())
+        self._client = client
+        self.set_headers(self.name, self.password)
+
+    def clone(self):
+        """
+        Return a copy of this client with its own SUDS client, so that
+        the copy can be used from another thread (SUDS clients are not
+        thread safe).  The parsed WSDL and the order store are shared
+        with this client, and so is the SOAP header, unless set_headers
+        is called on the copy.
+        """
+
+        cl = copy.copy(self)
+        cl._client = self.client.clone()
+        cl.plugin = None
+        cl.lock = threading.Lock()
+        return cl
+
+    def transport_stats(self):
+        """
+        Return dict of HTTP connection statistics: the number of
+        requests, the number of new connections made, the number of
+        requests that reused a connection, and the number of idle
+        connections currently in the pool.
+        """
+
+        return self.client.options.transport.stats()
+
     def method_names(self):
         """Return list of methods (API functions)"""
-        
+
         return self.client.wsdl.services[self.snum].ports[0].methods.keys()
 
+    def soap_method(self, name):
+        """Return the SUDS (WSDL) method object for API function name."""
+
+        return self.client.wsdl.services[self.snum].ports[0].methods[name]
+
+    def location(self, name):
+        """
+        Return the URL that requests for API function name go to.
+        As with SUDS, the 'location' option of the SUDS client, if
+        set, overrides the WSDL.
+        """
+
+        return (self.client.options.location or
+                self.soap_method(name).location)
+
+    def http_headers(self, name):
+        """
+        Return dict of the HTTP headers to send with a request for API
+        function name.  These are the same headers that SUDS sends.
+        """
+
+        headers = {'Content-Type': 'text/xml; charset=utf-8',
+                   'SOAPAction': self.soap_method(name).soap.action}
+        headers.update(self.client.options.headers)
+        return headers
+
     def set_headers(self, name, password):
         """Set the username and password that needs to go in the SOAP header."""
-           
+
+        self.name = name
+        self.password = password
+
         # this SOAP header is required by the API in this form
-        header = Element('ExternalApiHeader')
-        
         if self.service == ApiClient._READONLY:
             # we send the username only in the SOAP header
             astring = ('version="{0}" currency="GBP" languageCode="en" '
@@ -94,6 +230,18 @@ class ApiClient(object):
                        '.com/ExternalAPI/"'.format(const.BDAQAPIVERSION,
                                                    name,
                                                    password))
-        # set header
+        # the attributes of the header are also used when we write the
+        # SOAP envelope ourselves (see apiserialize.py).
+        self.headerattrs = astring
+        if self._client is None:
+            # the header is set when the SUDS client is created.
+            return
+
+        from suds.sax.element import Element
+        header = Element('ExternalApiHeader')
         header.attributes = [astring]
-        self.client.set_options(soapheaders = header)
+        if self.plugin is None:
+            import apiplugin
+            self.plugin = apiplugin.HeaderPlugin()
+            self.client.set_options(plugins = [self.plugin])
+        self.plugin.header = header
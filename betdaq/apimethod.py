@@ -20,23 +20,227 @@ be called from user applications directly; rather, use the interface
 in api.py by calling e.g. api.ListTopLevelEvents().
 """
 
-import datetime
+import sys
 import time
+import datetime
+import Queue
+from contextlib import contextmanager
 import const
 import apiparse
+import apiserialize
 import util
+import ratelimit
+import cache
+import exchange
+import exchangedata
 from apilog import apilog
+from apiexception import ApiError
+
+# marks a cache miss (None is a valid result).
+_MISSING = object()
+
+def _freeze(obj):
+    """Return hashable version of obj (e.g. a list of ids) for a cache key."""
+
+    if isinstance(obj, (list, tuple)):
+        return tuple(_freeze(o) for o in obj)
+    if isinstance(obj, dict):
+        return tuple(sorted((k, _freeze(v)) for (k, v) in obj.iteritems()))
+    if isinstance(obj, (set, frozenset)):
+        return frozenset(obj)
+    return obj
 
 class ApiMethod(object):
     """Base class for all Betdaq Api methods."""
 
+    # name of the method in the Betdaq Api, used for rate limiting.
+    name = None
+    # can the results be cached (see set_cache)?  Only read-only
+    # methods whose result depends on nothing but their arguments
+    # should set this.
+    cacheable = False
+
     def __init__(self, apiclient):
         """Set client, either read-only or secure."""
+        self.apiclient = apiclient
         self.client = apiclient.client
+        # time in seconds we waited for the rate limiter on the last
+        # call.
+        self.waited = 0.0
+        # results by arguments, if caching is switched on, and calls
+        # in progress by arguments.
+        self.cache = None
+        self.flights = cache.SingleFlight()
+        if self.name in const.APICACHE:
+            self.set_cache(*const.APICACHE[self.name])
+        # (client, request) pairs not in use by any call; see checkout.
+        self.spares = Queue.Queue()
+        self.create_req()
+
+    def set_cache(self, ttl, maxentries=1000):
+        """
+        Cache the results of calls for ttl seconds, keeping the
+        results of at most maxentries different sets of arguments
+        (see cache.py: this is a count, not a size).  If ttl is None,
+        switch caching off.
+        """
+
+        if ttl is None:
+            self.cache = None
+            return
+        if not self.cacheable or self.apiclient.service == 'secure':
+            raise ApiError('cannot cache results of BDAQ Api {0}'\
+                           .format(self.name))
+        self.cache = cache.TTLCache(maxentries, ttl)
+
+    def cache_stats(self):
+        """
+        Return dict of cache hits, misses, evictions, entries, and
+        number of calls that shared another thread's call in progress.
+        """
+
+        if self.cache is None:
+            return None
+        stats = self.cache.stats()
+        stats['shared'] = self.flights.shared
+        return stats
+
+    def cached_call(self, *args, **kwargs):
+        """
+        Return the result of call(*args, **kwargs), from the cache if
+        caching is switched on and we have a result for the same
+        arguments.  Results from the cache are shared between callers
+        and should not be modified.
+        """
+
+        store = self.cache
+        if store is None:
+            return self.call(*args, **kwargs)
+        try:
+            key = (_freeze(args), _freeze(kwargs))
+            hash(key)
+        except TypeError:
+            return self.call(*args, **kwargs)
+        result = store.get(key, _MISSING)
+        if result is _MISSING:
+            result = self.flights.do(key, self._call_and_store, store, key,
+                                     args, kwargs)
+        return result
+
+    def _call_and_store(self, store, key, args, kwargs):
+        result = self.call(*args, **kwargs)
+        store.put(key, result)
+        return result
+
+    def throttle(self):
+        """
+        Block until the rate limit for this method allows another
+        call (see ratelimit.py), and return the time waited.
+        """
+
+        # the wait is returned from a local, since another thread may
+        # set self.waited before we return.
+        waited = ratelimit.limiter.acquire(self.name)
+        self.waited = waited
+        if waited > 0:
+            apilog.info('waited {0:.3f}s to call BDAQ Api {1}'\
+                        .format(waited, self.name))
+        return waited
+
+    def make_req(self, client):
+        """
+        Return a new request object for the Api call from SUDS client
+        client, or None if the Api call takes no request.
+        """
+        return None
 
     def create_req(self):
-        """Create the request object for the Api call."""
-        pass
+        """
+        Create the request object for the Api call, self.req, which
+        (with self.client) is the first (client, request) pair used by
+        checkout.
+        """
+
+        self.req = self.make_req(self.client)
+        self.spares.put((self.client, self.req))
+
+    @contextmanager
+    def checkout(self):
+        """
+        Context manager giving a (SUDS client, request) pair that no
+        other thread is using, so that calls can be made from several
+        threads at once (SUDS clients, and our requests, which we
+        change on every call, are not thread safe).  Pairs are reused
+        by later calls; a new one (with a clone of the client) is only
+        made when all of them are in use.
+        """
+
+        try:
+            (client, req) = self.spares.get_nowait()
+        except Queue.Empty:
+            client = self.apiclient.clone().client
+            req = self.make_req(client)
+        try:
+            yield (client, req)
+        finally:
+            self.spares.put((client, req))
+
+    def make_envelope(self, client, *args):
+        """
+        Return the SOAP envelope (a string) that calling the method
+        with args on SUDS client client would send, without sending
+        it.  This is what SUDS does before handing the envelope to the
+        transport.
+        """
+
+        from suds.plugin import PluginContainer
+
+        method = getattr(client.service, self.name).method
+        soapenv = method.binding.input.get_message(method, args, {})
+        # the plugins put in the ExternalApiHeader (see apiplugin.py).
+        PluginContainer(client.options.plugins).message.marshalled(
+            envelope=soapenv.root())
+        return soapenv.plain().encode('utf-8')
+
+    def unmarshal(self, client, reply=None, fault=None):
+        """
+        Return the result of the method for the XML of a reply, as
+        SUDS client client would return it, or, given the XML of a
+        SOAP fault instead, raise the WebFault that SUDS would raise.
+        """
+
+        method = getattr(client.service, self.name)
+        if fault is not None:
+            return method(**{'__inject': {'fault': fault}})
+        return method(**{'__inject': {'reply': reply}})
+
+    def send_xml(self, envelope, client=None, raw=False):
+        """
+        Send a SOAP envelope we have written ourselves (see
+        apiserialize.py) and return the reply unmarshalled by SUDS,
+        i.e. the same result as calling the SUDS method.  client is
+        the SUDS client to use, by default self.client.  If raw is
+        True, return the XML of the reply instead.
+        """
+
+        from suds.transport import Request, TransportError
+
+        client = client or self.client
+        request = Request(self.apiclient.location(self.name), envelope)
+        request.headers = self.apiclient.http_headers(self.name)
+        try:
+            reply = client.options.transport.send(request)
+        except TransportError, e:
+            if e.httpcode in (202, 204):
+                return None
+            if e.httpcode == 500 and e.fp is not None:
+                return self.unmarshal(client, fault=e.fp.read())
+            raise
+        if reply is None:
+            return None
+        if raw:
+            return reply.message
+        return self.unmarshal(client, reply.message)
 
     def call(self):
         """Call the Api function and return the appropriate data."""
@@ -46,35 +250,40 @@ class ApiMethod(object):
 # appear in the Betdaq documentation 'NewExternalApispec.doc'.
 
 class ApiListTopLevelEvents(ApiMethod):
+    name = 'ListTopLevelEvents'
+    cacheable = True
     def __init__(self, apiclient):
         super(ApiListTopLevelEvents, self).__init__(apiclient)
-        self.create_req()
 
-    def create_req(self):
-        self.req = self.client.factory.\
-                   create('ListTopLevelEventsRequest')
+    def make_req(self, client):
+        req = client.factory.create('ListTopLevelEventsRequest')
         # this is the default, and I don't exactly know why we would
         # want True anyway, but lets set it just in case.
-        self.req._WantPlayMarkets = False
+        req._WantPlayMarkets = False
+        return req
         
     def call(self):
         """Return list of events."""
         apilog.info('calling BDAQ Api ListTopLevelEvents')
-        response = self.client.service.ListTopLevelEvents(self.req)
+        self.throttle()
+        with self.checkout() as (client, req):
+            response = client.service.ListTopLevelEvents(req)
         events = apiparse.ParseListTopLevelEvents(response)
         return events
                 
 class ApiGetEventSubTreeNoSelections(ApiMethod):
+    name = 'GetEventSubTreeNoSelections'
+    cacheable = True
     def __init__(self, apiclient):
         super(ApiGetEventSubTreeNoSelections,
               self).__init__(apiclient)
-        self.create_req()
 
-    def create_req(self):
-        self.req = self.client.factory.create(('GetEventSubTreeNoSele'
-                                               'ctionsRequest'))
+    def make_req(self, client):
+        req = client.factory.create(('GetEventSubTreeNoSele'
+                                     'ctionsRequest'))
         # may want to change this sometime (?)
-        self.req._WantPlayMarkets = False
+        req._WantPlayMarkets = False
+        return req
 
     def call(self, ids, direct = False):
         """
@@ -83,160 +292,301 @@ class ApiGetEventSubTreeNoSelections(ApiMethod):
         all markets for 'Horse Racing' and 'Tennis'.
         """
         
-        self.req.EventClassifierIds = ids
-        self.req._WantDirectDescendentsOnly = direct
-        self.req._WantPlayMarkets = False
         apilog.info('calling BDAQ Api GetEventSubTreeNoSelections')        
-        response = self.client.service.\
-                   GetEventSubTreeNoSelections(self.req)
+        self.throttle()
+        with self.checkout() as (client, req):
+            req.EventClassifierIds = ids
+            req._WantDirectDescendentsOnly = direct
+            req._WantPlayMarkets = False
+            response = client.service.GetEventSubTreeNoSelections(req)
         allmarkets = apiparse.ParseGetEventSubTreeNoSelections(response)
         return allmarkets
 
 # not fully implemented (do not use)
 class ApiGetEventSubTreeWithSelections(ApiMethod):
+    name = 'GetEventSubTreeWithSelections'
+    cacheable = True
     def __init__(self, apiclient):
         super(ApiGetEventSubTreeWithSelections,
               self).__init__(apiclient)
-        
-        self.create_req()
 
-    def create_req(self):
-        self.req = self.client.factory.\
-                   create('GetEventSubTreeWithSelectionsRequest')
+    def make_req(self, client):
+        req = client.factory.create('GetEventSubTreeWithSelectionsRequest')
         # note that for this function (unlike NoSelections), can only
         # go down one level i.e. can only get 'direct descendants'
-        self.req._WantPlayMarkets = False
+        req._WantPlayMarkets = False
+        return req
 
     def call(self, ids):
-        self.req.EventClassifierIds = ids
-        result = self.client.service.\
-                 GetEventSubTreeWithSelections(self.req)
+        self.throttle()
+        with self.checkout() as (client, req):
+            req.EventClassifierIds = ids
+            result = client.service.GetEventSubTreeWithSelections(req)
         return result
 
 class ApiGetMarketInformation(ApiMethod):
+    name = 'GetMarketInformation'
+    cacheable = True
+    # maximum number of market ids we ask for in a single API call.
+    MAXMIDS = 50
     def __init__(self, apiclient):
         super(ApiGetMarketInformation, self).__init__(apiclient)
-        self.create_req()
 
-    def create_req(self):
-        self.req = self.client.factory.\
-                   create('GetMarketInformationRequest')
+    def make_req(self, client):
+        return client.factory.create('GetMarketInformationRequest')
 
     def call(self, ids):
         """
-        Return raw data of all market information.  Note that at the
-        moment there is no 'MarketInfo' type class that contains this
-        information.  Part of the reason for this is that this API
-        function should not be required frequently.
+        Return list of exchange.MarketInfo objects for the market ids
+        ids, with start time, in running flags, withdrawal sequence
+        number and selections.  Markets that BDAQ does not know about
+        are missing from the list.  See marketinfo.py for a cache of
+        these.
         """
 
-        self.req.MarketIds = ids
-        result = self.client.service.GetMarketInformation(self.req)
-        # note the raw data is returned here
-        return result
+        allinfo = []
+        for chunk in util.chunks(ids, ApiGetMarketInformation.MAXMIDS):
+            apilog.info('calling BDAQ Api GetMarketInformation')
+            self.throttle()
+            with self.checkout() as (client, req):
+                req.MarketIds = chunk
+                result = client.service.GetMarketInformation(req)
+            allinfo.extend(apiparse.ParseGetMarketInformation(result))
+        return allinfo
 
-# not fully implemented (do not use)
 class ApiListSelectionsChangedSince(ApiMethod):
+    name = 'ListSelectionsChangedSince'
     def __init__(self, apiclient):
         super(ApiListSelectionsChangedSince, self).__init__(apiclient)
-        
-        self.create_req()
 
-    def create_req(self):
-        self.req = self.client.factory.\
-                   create('ListSelectionsChangedSinceRequest')
+    def make_req(self, client):
+        return client.factory.create('ListSelectionsChangedSinceRequest')
 
     def call(self, seqnum):
-        self.req._SelectionSequenceNumber = seqnum
-        result = self.client.service.\
-                 ListSelectionsChangedSince(self.req)
-        return result
+        """
+        Return list of exchange.SelectionChange objects for all the
+        changes to selections with selection sequence number greater
+        than seqnum, in order of sequence number.  See
+        selectionstore.py for keeping selections up to date with this.
+        """
+
+        apilog.info('calling BDAQ Api ListSelectionsChangedSince')
+        self.throttle()
+        with self.checkout() as (client, req):
+            req._SelectionSequenceNumber = seqnum
+            result = client.service.ListSelectionsChangedSince(req)
+        return apiparse.ParseListSelectionsChangedSince(result)
 
 # not fully implemented (do not use)
 class ApiListMarketWithdrawalHistory(ApiMethod):
+    name = 'ListMarketWithdrawalHistory'
+    cacheable = True
     def __init__(self, apiclient):
         super(ApiListMarketWithdrawalHistory, self).__init__(apiclient)        
-        self.create_req()
 
-    def create_req(self):
-        self.req = self.client.factory.create(('ListMarketWithdrawal'
-                                               'HistoryRequest'))
+    def make_req(self, client):
+        return client.factory.create(('ListMarketWithdrawal'
+                                      'HistoryRequest'))
 
     def call(self, ids):
-        self.req.MarketId = ids
-        result = self.client.service.\
-                 ListMarketWithdrawalHistory(self.req)
+        self.throttle()
+        with self.checkout() as (client, req):
+            req.MarketId = ids
+            result = client.service.ListMarketWithdrawalHistory(req)
         return result
 
 class ApiGetPrices(ApiMethod):
+    name = 'GetPrices'
     # maximum number of market ids we get get selection prices for in
     # a single API call (Set to 50 according to the API docs).
     MAXMIDS = 50 
-    def __init__(self, apiclient, throttl = 0):
+    def __init__(self, apiclient):
         super(ApiGetPrices, self).__init__(apiclient) 
-        # time to wait between consecutive calls when calling multiple
-        # times.
-        self.throttl = throttl
-        self.create_req()
 
-    def create_req(self):
-        self.req = self.client.factory.create('GetPricesRequest')
-        self.req._ThresholdAmount = 0.0
+    def make_req(self, client):
+        """Return a new GetPrices request object from client."""
+        
+        req = client.factory.create('GetPricesRequest')
+        req._ThresholdAmount = 0.0
         # set this to -1 for all prices, 0 for no prices, or a
         # positive number for a maximum number of prices.
-        self.req._NumberForPricesRequired = const.NUMPRICES
-        self.req._NumberAgainstPricesRequired = const.NUMPRICES
-        self.req._WantMarketMatchedAmount = True
-        self.req._WantSelectionsMatchedAmounts = True
-        self.req._WantSelectionMatchedDetails = True
+        req._NumberForPricesRequired = const.NUMPRICES
+        req._NumberAgainstPricesRequired = const.NUMPRICES
+        req._WantMarketMatchedAmount = True
+        req._WantSelectionsMatchedAmounts = True
+        req._WantSelectionMatchedDetails = True
+        return req
+
+    def get_chunk(self, client, req, ids, output='selections',
+                  states=None):
+        """
+        Call the Api for at most MAXMIDS market ids, appending the
+        exchange.MarketState of each market to states (if a list).
+        """
 
-    def call(self, mids):
+        apilog.info('calling BDAQ Api GetPrices')        
+        self.throttle()
+        if output == 'columns':
+            envelope = apiserialize.SerializeGetPrices(
+                self.apiclient.headerattrs, ids)
+            xml = self.send_xml(envelope, client, raw=True)
+            return apiparse.ParseGetPricesColumns(ids, xml, states)
+        if output == 'tuples' or const.PRICEPARSER == 'xml':
+            # parse the XML of the reply directly, without SUDS.
+            envelope = apiserialize.SerializeGetPrices(
+                self.apiclient.headerattrs, ids)
+            xml = self.send_xml(envelope, client, raw=True)
+            return apiparse.ParseGetPricesXML(ids, xml,
+                                              output == 'tuples', states)
+        if const.FASTSERIALIZE:
+            envelope = apiserialize.SerializeGetPrices(
+                self.apiclient.headerattrs, ids)
+            result = self.send_xml(envelope, client)
+        else:
+            req.MarketIds = ids
+            result = client.service.GetPrices(req)
+        return apiparse.ParseGetPrices(ids, result, states)
+
+    def call(self, mids, workers=1, partial=False, output='selections',
+             states=None):
         """
         Return all selections for Market ids in mids, where mids is a
-        list of market ids.
+        list of market ids.  The returned list has one item (a list of
+        selections) per market id, in the same order as mids.  If
+        output is 'tuples', each selection is an
+        exchange.SelectionTuple rather than a Selection object.  If
+        output is 'columns', return a snapshot.PriceSnapshot of all of
+        the selections instead (this needs numpy).
+
+        mids is split into chunks of MAXMIDS market ids.  If workers
+        is greater than one, up to that many chunks are fetched at
+        once by a pool of threads, subject to the rate limit.  If
+        partial is True, a chunk that fails does not raise an
+        exception; instead the items for the markets in that chunk
+        are None.
+
+        If states is a dict, the exchange.MarketState of each market
+        fetched is stored in it by market id.  Market information
+        cached by marketinfo.py that no longer matches these states
+        is invalidated.
         """
 
-        allselections = []
-        # split up mids into groups of size MAXMIDS
-        for (callnum, ids) in \
-            enumerate(util.chunks(mids, ApiGetPrices.MAXMIDS)):
-            self.req.MarketIds = ids
-            if callnum > 0:
-                # sleep for some time before calling Api again
-                time.sleep(self.throttl)
-                
-            apilog.info('calling BDAQ Api GetPrices')        
-            result = self.client.service.GetPrices(self.req)
-            selections =  apiparse.ParseGetPrices(ids, result)
-            allselections = allselections + selections
+        if output == 'columns':
+            # imported here since numpy is optional.
+            import snapshot
+        # imported here since marketinfo imports api, which imports us.
+        import marketinfo
+        chunks = list(util.chunks(mids, ApiGetPrices.MAXMIDS))
+        allselections = [None] * len(mids)
+        # columns of each chunk, for output 'columns'.
+        allcolumns = [None] * len(chunks)
+        threaded = workers > 1 and len(chunks) > 1
+
+        def fetch(cnum):
+            ids = chunks[cnum]
+            chunkstates = []
+            try:
+                with self.checkout() as (client, req):
+                    selections = self.get_chunk(client, req, ids, output,
+                                                chunkstates)
+            except Exception, e:
+                if not partial:
+                    raise
+                apilog.error('GetPrices failed for market ids {0}: {1}'\
+                             .format(ids, e))
+                return
+            for st in chunkstates:
+                marketinfo.marketcache.check(st.id, st.status,
+                                             st.inrunning, st.wsn)
+                if states is not None:
+                    states[st.id] = st
+            if output == 'columns':
+                allcolumns[cnum] = selections
+                return
+            start = cnum * ApiGetPrices.MAXMIDS
+            for (i, sels) in enumerate(selections):
+                allselections[start + i] = sels
+
+        if threaded:
+            # imported here since multiprocessing is slow to import.
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(workers, len(chunks)))
+            try:
+                pool.map(fetch, range(len(chunks)))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for cnum in range(len(chunks)):
+                fetch(cnum)
 
+        if output == 'columns':
+            # markets in chunks that failed are left out.
+            return snapshot.PriceSnapshot([c for c in allcolumns
+                                           if c is not None])
         return allselections
 
-# not fully implemented (do not use)
 class ApiGetOddsLadder(ApiMethod):
-    pass
+    name = 'GetOddsLadder'
+    # PriceFormat for decimal odds in the request.
+    DECIMAL = 1
+    def __init__(self, apiclient):
+        # the odds ladder from the last call; this rarely changes, so
+        # we only call the Api again when asked to.
+        self.ladder = None
+        super(ApiGetOddsLadder, self).__init__(apiclient)
+
+    def make_req(self, client):
+        req = client.factory.create('GetOddsLadderRequest')
+        req._PriceFormat = ApiGetOddsLadder.DECIMAL
+        return req
+
+    def call(self, refresh=False):
+        """
+        Return the odds ladder as an exchangedata.OddsLadder object.
+        This also replaces exchangedata.LADDER, which is used by
+        exchangedata.next_shorter_odds and next_longer_odds.  The
+        ladder is only fetched from the Api on the first call, or if
+        refresh is True.
+        """
+
+        if self.ladder is None or refresh:
+            apilog.info('calling BDAQ Api GetOddsLadder')
+            self.throttle()
+            with self.checkout() as (client, req):
+                response = client.service.GetOddsLadder(req)
+            self.ladder = apiparse.ParseGetOddsLadder(response)
+            exchangedata.LADDER = self.ladder
+        return self.ladder
 
-# not fully implemented (do not use)
 class ApiGetCurrentSelectionSequenceNumber(ApiMethod):
+    name = 'GetCurrentSelectionSequenceNumber'
     def __init__(self, apiclient):
         super(ApiGetCurrentSelectionSequenceNumber,
               self).__init__(apiclient)         
 
     def call(self):
-        result = self.client.service.\
-                 GetCurrentSelectionSequenceNumber()
-        return result
+        """Return the current selection sequence number."""
+
+        apilog.info('calling BDAQ Api GetCurrentSelectionSequenceNumber')
+        self.throttle()
+        with self.checkout() as (client, req):
+            result = client.service.GetCurrentSelectionSequenceNumber()
+        return apiparse.ParseGetCurrentSelectionSequenceNumber(result)
 
 # classes that implement the secure methods, in the order that they
 # appear in the Betdaq documentation 'NewExternalApispec.doc'.
 
 class ApiGetAccountBalances(ApiMethod):
+    name = 'GetAccountBalances'
     def __init__(self, apiclient):
         super(ApiGetAccountBalances, self).__init__(apiclient)         
 
     def call(self):
         apilog.info('calling BDAQ Api GetAccountBalances')        
-        result = self.client.service.GetAccountBalances()
+        self.throttle()
+        with self.checkout() as (client, req):
+            result = client.service.GetAccountBalances()
         # accinfo is a dictionary of (_AvailableFunds, _Balance,
         # _Credit, _Exposure).
         accinfo = apiparse.ParseGetAccountBalances(result)
@@ -245,31 +595,33 @@ class ApiGetAccountBalances(ApiMethod):
 # not fully implemented (do not use). This lists extra details about
 # account, mainly orders settled between two dates.
 class ApiListAccountPostings(ApiMethod):
+    name = 'ListAccountPostings'
     def __init__(self, apiclient):
         super(ApiListAccountPostings, self).__init__(apiclient)
-        self.create_req()
 
-    def create_req(self):
-        self.req = self.client.factory.\
-                   create('ListAccountPostingsRequest')
+    def make_req(self, client):
+        return client.factory.create('ListAccountPostingsRequest')
 
     def call(self, *args):
         # should be able to pass two datetime objects here(?)
         # year month day hour minute second microsecond
         nargs = len(args)
         if nargs > 0:
-            self.req._StartTime = args[0]
+            start = args[0]
             if nargs > 1:
-                self.req._EndTime = args[1]
+                end = args[1]
             else:
-                self.req._Endtime = datetime.datetime.now()
+                end = datetime.datetime.now()
         else:
             # no args supplied, default starttime to 7 days ago,
             # endtime to now
-            self.req._EndTime = datetime.datetime.now()
-            self.req._StartTime = (self.req._EndTime -
-                                  datetime.timedelta(days=7))
-        result = self.client.service.ListAccountPostings(self.req)
+            end = datetime.datetime.now()
+            start = end - datetime.timedelta(days=7)
+        self.throttle()
+        with self.checkout() as (client, req):
+            req._StartTime = start
+            req._EndTime = end
+            result = client.service.ListAccountPostings(req)
         return result
 
 # class ApiListAccountPostingsById(ApiMethod):
@@ -277,28 +629,40 @@ class ApiListAccountPostings(ApiMethod):
 # class ApiChangePassword(ApiMethod):
 
 class ApiListOrdersChangedSince(ApiMethod):
+    name = 'ListOrdersChangedSince'
     def __init__(self, apiclient):
         super(ApiListOrdersChangedSince, self).__init__(apiclient)
-        self.create_req()
 
-    def create_req(self):
-        self.req = self.client.factory.\
-                   create('ListOrdersChangedSinceRequest')
+    def make_req(self, client):
+        return client.factory.create('ListOrdersChangedSinceRequest')
 
     def call(self, seqnum=None):
-        global ORDER_SEQUENCE_NUMBER
+        """
+        Return dict (by order ref) of the orders that have changed
+        since the order sequence number of the session (or since
+        seqnum, if given).  The changes are applied to the order store
+        of the session (apiclient.orders), and the orders returned are
+        the (updated) ones in the store.
+        """
+
+        store = self.apiclient.orders
         # the sequence number should come in the first instance from
         # the bootstrap, see class ApiListBootstrapOrders
-        if seqnum:
-            self.req.SequenceNumber = seqnum
-        else:
-            self.req.SequenceNumber = ORDER_SEQUENCE_NUMBER
+        if not seqnum:
+            seqnum = store.seqnum
 
         apilog.info(('Calling ListOrdersChangedSince with '
-                     'sequence number: {0}'\
-                     .format(self.req.SequenceNumber)))
+                     'sequence number: {0}'.format(seqnum)))
         
-        resp = self.client.service.ListOrdersChangedSince(self.req)
+        self.throttle()
+        with self.checkout() as (client, req):
+            if const.FASTSERIALIZE:
+                envelope = apiserialize.SerializeListOrdersChangedSince(
+                    self.apiclient.headerattrs, seqnum)
+                resp = self.send_xml(envelope, client)
+            else:
+                req.SequenceNumber = seqnum
+                resp = client.service.ListOrdersChangedSince(req)
 
         data = apiparse.ParseListOrdersChangedSince(resp)
 
@@ -310,73 +674,90 @@ class ApiListOrdersChangedSince(ApiMethod):
         # if we did get some orders changed, the data consists of the
         # order information and the new max sequence number.
         orders, snum = data
-        # set order sequence number to the maximum one returned by Api
-        ORDER_SEQUENCE_NUMBER = snum        
-
-        #apilog.debug('Setting sequence number to: {0}'\
-        #             .format(snum))
-
-        return orders
-
-# this sequence number is updated by both ApiListOrdersChangedSince
-# (above) and ApiListBootstrapOrders (below).
-ORDER_SEQUENCE_NUMBER = -1
+        with store.lock:
+            # set order sequence number to the maximum one returned by
+            # Api
+            store.seqnum = max(store.seqnum, snum)
+            return store.update(orders)
 
 class ApiListBootstrapOrders(ApiMethod):
+    name = 'ListBootstrapOrders'
     def __init__(self, apiclient):
         super(ApiListBootstrapOrders, self).__init__(apiclient)
-        self.create_req()
 
-    def create_req(self):
-        self.req = self.client.factory.\
-                   create('ListBootstrapOrdersRequest')
+    def make_req(self, client):
+        req = client.factory.create('ListBootstrapOrdersRequest')
         # this is probably the best default here (see BDAQ
         # documentation).
-        self.req.wantSettledOrdersOnUnsettledMarkets = False
+        req.wantSettledOrdersOnUnsettledMarkets = False
+        return req
 
-    def call(self, snum=-1):
-        # the sequence number should come in the first instance from
-        # the bootstrap which is next class
-        global ORDER_SEQUENCE_NUMBER
-        self.req.SequenceNumber = ORDER_SEQUENCE_NUMBER
+    def call(self, snum=None):
+        """
+        Return dict (by order ref) of the next batch of orders for
+        the session; this should be called repeatedly at startup until
+        it returns an empty dict.  The orders are added to the order
+        store of the session (apiclient.orders).  The batch starts
+        after the sequence number of the store, or after snum if
+        given.
+        """
+
+        store = self.apiclient.orders
+        if snum is None:
+            snum = store.seqnum
         apilog.info('calling BDAQ Api ListBootstrapOrders')        
-        result = self.client.service.ListBootstrapOrders(self.req)
-        # assign sequence number we get back to ORDER_SEQUENCE_NUMBER
-        ORDER_SEQUENCE_NUMBER = result._MaximumSequenceNumber
+        self.throttle()
+        with self.checkout() as (client, req):
+            req.SequenceNumber = snum
+            result = client.service.ListBootstrapOrders(req)
         allorders = apiparse.ParseListBootstrapOrders(result)
-        return allorders
+        with store.lock:
+            # assign sequence number we get back to the store
+            store.seqnum = result._MaximumSequenceNumber
+            return store.update(allorders)
 
 # not fully implemented (do not use)
 class ApiGetOrderDetails(ApiMethod):
+    name = 'GetOrderDetails'
     def __init__(self, apiclient):
-        self.client = apiclient.client
-        self.create_req()
+        super(ApiGetOrderDetails, self).__init__(apiclient)
 
-    def create_req(self):
-        self.req = self.client.factory.create('GetOrderDetailsRequest')
+    def make_req(self, client):
+        return client.factory.create('GetOrderDetailsRequest')
 
     def call(self, oid):
-        self.req._OrderId = oid
-        result = self.client.service.GetOrderDetails(self.req)
+        self.throttle()
+        with self.checkout() as (client, req):
+            req._OrderId = oid
+            result = client.service.GetOrderDetails(req)
         return result
 
 class ApiPlaceOrdersNoReceipt(ApiMethod):
+    name = 'PlaceOrdersNoReceipt'
+    # maximum number of orders we can place in a single API call.
+    MAXORDERS = 50
     def __init__(self, apiclient):
         super(ApiPlaceOrdersNoReceipt, self).__init__(apiclient)
-        self.create_req()
+        # (number of orders, time waited for rate limit, total time
+        # taken) in seconds, for each chunk of the last call (None for
+        # a chunk that failed or was not sent).
+        self.timings = []
 
-    def create_req(self):
-        self.req = self.client.factory.\
-                   create('PlaceOrdersNoReceiptRequest')
+    def make_req(self, client):
+        """Return a new PlaceOrdersNoReceipt request object from client."""
+
+        req = client.factory.create('PlaceOrdersNoReceiptRequest')
         # if one fails, none will be placed
-        self.req.WantAllOrNothingBehaviour = True
+        req.WantAllOrNothingBehaviour = True
+        return req
 
-    def makeorderlist(self, orderlist):
+    def makeorderlist(self, orderlist, client=None):
+        client = client or self.client
         olist = []
 
         for o in orderlist:
             # make a single order object
-            order = self.client.factory.create('SimpleOrderRequest')
+            order = client.factory.create('SimpleOrderRequest')
 
             order._SelectionId = o.sid
             order._Stake = o.stake
@@ -385,90 +766,294 @@ class ApiPlaceOrdersNoReceipt(ApiMethod):
             # we probably need to look at the market information to put
             # this stuff in correctly
             order._ExpectedSelectionResetCount = o.src
-            order. _ExpectedWithdrawalSequenceNumber = o.wsn,         
+            order._ExpectedWithdrawalSequenceNumber = o.wsn
             order._CancelOnInRunning = o.cancelrunning
             order._CancelIfSelectionReset = o.cancelreset
 
             olist.append(order)
         return olist
 
-    def call(self, orderlist):
-        assert isinstance(orderlist, list)
-        orders = {}
-        MAXORDERS = 50
-        for ol in util.chunks(orderlist, MAXORDERS):        
-            # make BDAQ representation of orders from orderlist past
-            self.req.Orders.Order = self.makeorderlist(ol)
-            apilog.info('calling BDAQ Api PlaceOrdersNoReceipt')
-            result = self.client.service.PlaceOrdersNoReceipt(self.req)
-            ors = apiparse.ParsePlaceOrdersNoReceipt(result, orderlist)
-            orders.update(ors)
+    def place_chunk(self, client, req, ol, allornothing):
+        """
+        Place at most MAXORDERS orders, and return dict of the placed
+        orders by order ref and the timing of the chunk.
+        """
 
+        start = time.time()
+        apilog.info('calling BDAQ Api PlaceOrdersNoReceipt')
+        waited = self.throttle()
+        if const.FASTSERIALIZE:
+            envelope = apiserialize.SerializePlaceOrdersNoReceipt(
+                self.apiclient.headerattrs, ol, allornothing)
+            result = self.send_xml(envelope, client)
+        else:
+            # make BDAQ representation of orders from orderlist past
+            req.Orders.Order = self.makeorderlist(ol, client)
+            req.WantAllOrNothingBehaviour = allornothing
+            result = client.service.PlaceOrdersNoReceipt(req)
+        # the order refs in the result are for the orders in this
+        # chunk only.
+        ors = apiparse.ParsePlaceOrdersNoReceipt(result, ol)
         # note: could put result.Timestamp in order object so that we
         # are saving the BDAQ time.
+        return (self.apiclient.orders.update(ors),
+                (len(ol), waited, time.time() - start))
+
+    def call(self, orderlist, workers=1, allornothing=True):
+        """
+        Place the orders in orderlist, and return dict of the placed
+        orders by order ref.  The orders are sent in chunks of
+        MAXORDERS orders; if workers is greater than one, up to that
+        many chunks are sent at once by a pool of threads, subject to
+        the rate limit.  allornothing applies to each chunk: if True,
+        either all of the orders in a chunk are placed or none are.
+        If a chunk fails, the exception is raised once all chunks have
+        finished; orders placed by the other chunks are in the order
+        store of the session.  The timing of each chunk is in
+        self.timings.
+        """
+
+        assert isinstance(orderlist, list)
+        chunks = list(util.chunks(orderlist,
+                                  ApiPlaceOrdersNoReceipt.MAXORDERS))
+        results = [None] * len(chunks)
+        errors = []
+        threaded = workers > 1 and len(chunks) > 1
+
+        def place(cnum):
+            try:
+                with self.checkout() as (client, req):
+                    results[cnum] = self.place_chunk(client, req,
+                                                     chunks[cnum],
+                                                     allornothing)
+            except Exception, e:
+                apilog.error('PlaceOrdersNoReceipt failed for chunk {0}: '
+                             '{1}'.format(cnum, e))
+                errors.append(sys.exc_info())
+
+        if threaded:
+            # imported here since multiprocessing is slow to import.
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(workers, len(chunks)))
+            try:
+                pool.map(place, range(len(chunks)))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for cnum in range(len(chunks)):
+                place(cnum)
+                if errors:
+                    # don't carry on placing orders after a failure.
+                    break
+
+        self.timings = [r[1] if r is not None else None for r in results]
+        if errors:
+            (etype, evalue, tb) = errors[0]
+            raise etype, evalue, tb
+
+        orders = {}
+        for (ors, timing) in results:
+            orders.update(ors)
         return orders
 
 # not fully implemented (do not use)
 class ApiPlaceOrdersWithReceipt(ApiMethod):
+    name = 'PlaceOrdersWithReceipt'
     def __init__(self, apiclient, dbman):
-        self.client = apiclient.client
+        super(ApiPlaceOrdersWithReceipt, self).__init__(apiclient)
         self.dbman = dbman
-        self.create_req()
 
-    def create_req(self):
-        self.req = self.client.factory.create('PlaceOrdersWithReceiptRequest')
-        # lets just do a single order at a time at the moment
-        self.order = self.client.factory.create('SimpleOrderRequest')
+    def make_req(self, client):
+        return client.factory.create('PlaceOrdersWithReceiptRequest')
 
-    def makeorder(self, order):
-        self.order._SelectionId = order.sid
-        self.order._Stake = order.stake
-        self.order._Price = order.price
-        self.order._Polarity = order.polarity
+    def makeorder(self, order, client):
+        # lets just do a single order at a time at the moment
+        o = client.factory.create('SimpleOrderRequest')
+        o._SelectionId = order.sid
+        o._Stake = order.stake
+        o._Price = order.price
+        o._Polarity = order.polarity
         # we probably need to look at the market information to put
         # this stuff in correctly
-        self.order._ExpectedSelectionResetCount = 1
-        self.order. _ExpectedWithdrawalSequenceNumber = 0,         
-        self.order._CancelOnInRunning = True
-        self.order._CancelIfSelectionReset = True        
+        o._ExpectedSelectionResetCount = 1
+        o._ExpectedWithdrawalSequenceNumber = 0
+        o._CancelOnInRunning = True
+        o._CancelIfSelectionReset = True        
+        return o
 
     def call(self, order):
         # order passed should be a dict with keys
         # see 'ordertest.py' for what the dict should contain
-        self.makeorder(order)
-        self.req.Orders.Order = [self.order]
         apilog.info('calling BDAQ Api PlaceOrdersWithReceipt')        
-        result = self.client.service.PlaceOrdersWithReceipt(self.req)
+        self.throttle()
+        with self.checkout() as (client, req):
+            req.Orders.Order = [self.makeorder(order, client)]
+            result = client.service.PlaceOrdersWithReceipt(req)
         return result
 
-#class ApiUpdateOrdersNoReceipt(ApiMethod):
+class ApiUpdateOrdersNoReceipt(ApiMethod):
+    name = 'UpdateOrdersNoReceipt'
+    # maximum number of orders we can update in a single API call.
+    MAXORDERS = 50
+    def __init__(self, apiclient):
+        super(ApiUpdateOrdersNoReceipt, self).__init__(apiclient)
+
+    def make_req(self, client):
+        return client.factory.create('UpdateOrdersNoReceiptRequest')
+
+    def makeorderlist(self, updates, client=None):
+        client = client or self.client
+        olist = []
+        for (o, price, delta, src, wsn) in map(util.update_fields, updates):
+            order = client.factory.\
+                    create('UpdateOrdersNoReceiptRequestItem')
+            order._BetId = o.oref
+            order._DeltaStake = delta
+            order._Price = price
+            order._ExpectedSelectionResetCount = src
+            order._ExpectedWithdrawalSequenceNumber = wsn
+            order._CancelOnInRunning = o.cancelrunning
+            order._CancelIfSelectionReset = o.cancelreset
+            olist.append(order)
+        return olist
+
+    def call(self, updates):
+        """
+        Change the price and/or stake of unmatched orders, without
+        cancelling them.  updates is a list of (order, new price,
+        change in stake), where order is the (placed) Order object,
+        optionally followed by the expected selection reset count and
+        withdrawal sequence number (by default, those of the order).
+        Returns dict of the BDAQ return code for each order by order
+        ref, which is 0 if the order was updated.  Updated orders are
+        changed in place, and in the order store of the session.
+        """
+
+        codes = {}
+        for ul in util.chunks(updates, ApiUpdateOrdersNoReceipt.MAXORDERS):
+            apilog.info('calling BDAQ Api UpdateOrdersNoReceipt')
+            self.throttle()
+            with self.checkout() as (client, req):
+                if const.FASTSERIALIZE:
+                    envelope = apiserialize.SerializeUpdateOrdersNoReceipt(
+                        self.apiclient.headerattrs, ul)
+                    result = self.send_xml(envelope, client)
+                else:
+                    req.Orders.Order = self.makeorderlist(ul, client)
+                    result = client.service.UpdateOrdersNoReceipt(req)
+            ucodes = apiparse.ParseUpdateOrdersNoReceipt(result)
+            self.apply(ul, ucodes)
+            codes.update(ucodes)
+        return codes
+
+    def apply(self, updates, codes):
+        """
+        Change the orders in updates that were updated according to
+        the return codes, and the order store of the session.
+        """
+
+        store = self.apiclient.orders
+        updated = []
+        for (o, price, delta, src, wsn) in map(util.update_fields, updates):
+            if codes.get(o.oref) == 0:
+                ustake = getattr(o, 'unmatchedstake', o.stake)
+                o.price = price
+                o.stake += delta
+                o.unmatchedstake = ustake + delta
+                o.src = src
+                o.wsn = wsn
+                updated.append(o)
+        store.update([o for o in updated if o.oref in store])
 
 class ApiCancelOrders(ApiMethod):
+    name = 'CancelOrders'
+    # maximum number of orders we can cancel in a single API call.
+    MAXORDERS = 50
     def __init__(self, apiclient):
         super(ApiCancelOrders, self).__init__(apiclient)
-        self.create_req()
 
-    def create_req(self):
-        self.req = self.client.factory.create('CancelOrdersRequest')
+    def make_req(self, client):
+        return client.factory.create('CancelOrdersRequest')
 
     def call(self, olist):
-        self.req.OrderHandle = [o.oref for o in olist]
-        apilog.info('calling BDAQ Api CancelOrders')
-        result = self.client.service.CancelOrders(self.req)
-        ol = apiparse.ParseCancelOrders(result, olist)
-        return ol
+        """
+        Cancel the orders in olist, in chunks of MAXORDERS orders.
+        Returns olist, with the cancelled orders marked as cancelled
+        (as they are in the order store of the session).
+        """
 
-#class ApiCancelAllOrdersOnMarket(ApiMethod):
+        for ol in util.chunks(olist, ApiCancelOrders.MAXORDERS):
+            apilog.info('calling BDAQ Api CancelOrders')
+            self.throttle()
+            with self.checkout() as (client, req):
+                if const.FASTSERIALIZE:
+                    envelope = apiserialize.SerializeCancelOrders(
+                        self.apiclient.headerattrs, [o.oref for o in ol])
+                    result = self.send_xml(envelope, client)
+                else:
+                    req.OrderHandle = [o.oref for o in ol]
+                    result = client.service.CancelOrders(req)
+            ol = apiparse.ParseCancelOrders(result, ol)
+            self.apiclient.orders.update([o for o in ol
+                                          if o.oref in self.apiclient.orders])
+        return olist
+
+class ApiCancelAllOrdersOnMarket(ApiMethod):
+    name = 'CancelAllOrdersOnMarket'
+    def __init__(self, apiclient):
+        super(ApiCancelAllOrdersOnMarket, self).__init__(apiclient)
 
-#class ApiCancelAllOrders(ApiMethod):
+    def make_req(self, client):
+        return client.factory.create('CancelAllOrdersOnMarketRequest')
+
+    def call(self, mids):
+        """
+        Cancel all unmatched orders on the markets with ids mids, in a
+        single call.  Returns list of the order refs cancelled; these
+        orders are marked as cancelled in the order store of the
+        session.
+        """
+
+        apilog.info('calling BDAQ Api CancelAllOrdersOnMarket')
+        self.throttle()
+        with self.checkout() as (client, req):
+            req.MarketIds = mids
+            result = client.service.CancelAllOrdersOnMarket(req)
+        orefs = apiparse.ParseCancelAllOrdersOnMarket(result)
+        self.apiclient.orders.set_status(orefs, exchange.O_CANCELLED)
+        return orefs
+
+class ApiCancelAllOrders(ApiMethod):
+    name = 'CancelAllOrders'
+    def __init__(self, apiclient):
+        super(ApiCancelAllOrders, self).__init__(apiclient)
+
+    def call(self):
+        """
+        Cancel all unmatched orders of the account, in a single call.
+        Returns list of the order refs cancelled; these orders are
+        marked as cancelled in the order store of the session.
+        """
+
+        apilog.info('calling BDAQ Api CancelAllOrders')
+        self.throttle()
+        with self.checkout() as (client, req):
+            result = client.service.CancelAllOrders()
+        orefs = apiparse.ParseCancelAllOrders(result)
+        self.apiclient.orders.set_status(orefs, exchange.O_CANCELLED)
+        return orefs
 
 class ApiListBlacklistInformation(ApiMethod):
+    name = 'ListBlacklistInformation'
     def __init__(self, apiclient):
-        self.client = apiclient.client
+        super(ApiListBlacklistInformation, self).__init__(apiclient)
 
     def call(self):
         apilog.info('calling BDAQ Api ListBlacklistInformation')
-        result = self.client.service.ListBlacklistInformation()
+        self.throttle()
+        with self.checkout() as (client, req):
+            result = client.service.ListBlacklistInformation()
         return result
 
 # TODO - Suspending orders
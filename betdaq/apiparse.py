@@ -20,8 +20,13 @@ library has done most of the work for us here, we just need to extract
 the data we want.
 """
 
-import const
-import util
+import re
+import datetime
+from array import array
+from StringIO import StringIO
+from xml.etree import cElementTree as ElementTree
+import exchangedata
+from util import suds_utc
 from exchange import *
 from apiexception import ApiError
 
@@ -51,7 +56,6 @@ def ParseGetEventSubTreeNoSelections(resp):
 
     _check_errors(resp)
     
-    allmarkets = []
     markets = []
     # go through each event class in turn, an event class is
     # e.g. 'Rugby Union','Formula 1', etc.
@@ -63,19 +67,24 @@ def ParseGetEventSubTreeNoSelections(resp):
     else:
         data = [resp[2]]
     for evclass in data:
-        _ParseEventClassifier(evclass,'', markets)
-        allmarkets = allmarkets + markets
-    # hack: currently markets are duplicated multiple times (is this
-    # an API error?); we want only unique markets here
-    umarkets = util.unique(allmarkets)
+        _ParseEventClassifier(evclass, '', markets)
+    # a market can appear more than once if we asked for an event and
+    # one of its descendants; we want only unique markets here.
+    seen = set()
+    umarkets = []
+    for m in markets:
+        if m.id not in seen:
+            seen.add(m.id)
+            umarkets.append(m)
     return umarkets
 
-def _ParseEventClassifier(eclass, name='', markets=[]):
+def _ParseEventClassifier(eclass, name, markets):
     """
-    Get Markets from a Top Level Event, e.g. 'Rugby Union'.
-    Note that we skip a level here, e.g. We would go Rugby ->
-    Lions Tour -> market, but here we will just find all rugby
-    union markets, regardless of their direct ancester.
+    Get Markets from a Top Level Event, e.g. 'Rugby Union', and
+    append them to the list markets.  Note that we skip a level here,
+    e.g. We would go Rugby -> Lions Tour -> market, but here we will
+    just find all rugby union markets, regardless of their direct
+    ancester.
     """
 
     name = name + '|' + eclass._Name
@@ -94,7 +103,54 @@ def _ParseEventClassifier(eclass, name='', markets=[]):
                                       mtype._IsCurrentlyInRunning,
                                       **dict(mtype)))
 
-def ParseGetPrices(marketids, resp):
+def ParseGetMarketInformation(resp):
+    """Return list of MarketInfo objects."""
+
+    _check_errors(resp)
+
+    if not hasattr(resp, 'Markets'):
+        return []
+    if isinstance(resp.Markets, list):
+        data = resp.Markets
+    else:
+        data = [resp.Markets]
+
+    allinfo = []
+    for m in data:
+        sels = getattr(m, 'Selections', [])
+        if not isinstance(sels, list):
+            sels = [sels]
+        sinfo = tuple(SelectionInfo(s._Id, s._Name, s._Status,
+                                    s._ResetCount, s._DeductionFactor,
+                                    s._DisplayOrder) for s in sels)
+        allinfo.append(MarketInfo(m._Id, m._Name, m._Type, m._Status,
+                                  suds_utc(m._StartTime),
+                                  m._IsCurrentlyInRunning,
+                                  m._IsInRunningAllowed,
+                                  m._InRunningDelaySeconds,
+                                  m._WithdrawalSequenceNumber,
+                                  m._NumberOfWinningSelections,
+                                  getattr(m, '_EventClassifierId', None),
+                                  sinfo))
+    return allinfo
+
+def _suds_ladder(prices):
+    """
+    Return flat array of the prices and stakes of the SUDS price
+    objects prices.
+    """
+
+    if not isinstance(prices, list):
+        # if we only have one price on offer there is no list
+        prices = [prices]
+    return array('d', [x for p in prices for x in (p._Price, p._Stake)])
+
+def ParseGetPrices(marketids, resp, states=None):
+    """
+    Return list of lists of Selection objects, one list per market id
+    in marketids.  If states is a list, an exchange.MarketState for
+    each market is appended to it.
+    """
 
     _check_errors(resp)
 
@@ -109,14 +165,19 @@ def ParseGetPrices(marketids, resp):
     for (mid, mprice) in zip(marketids, resp.MarketPrices):
         # list of selections for this marketid
         allselections.append([])
+        if states is not None:
+            states.append(MarketState(mid, mprice._Status,
+                                      mprice._IsCurrentlyInRunning,
+                                      mprice._WithdrawalSequenceNumber))
         # go through each selection for the market.  For some reason
         # the Api is returning every selection twice, although this
         # could be an error with the SOAP library (?).
 
         # are there any selections?
         if not hasattr(mprice,'Selections'):
-            # can reach here if market suspended
-            break
+            # can reach here if market suspended; we leave the list of
+            # selections for this market empty.
+            continue
 
         nsel = len(mprice.Selections)
 
@@ -130,32 +191,17 @@ def ParseGetPrices(marketids, resp):
         wsn = mprice._WithdrawalSequenceNumber
 
         for sel in mprice.Selections[:nsel]:
-            # lists of back and lay prices
+            # back and lay prices, as the flat arrays Selection stores
             # note the response object may not have these attributes
             # if no odds are on offer
             if hasattr(sel, 'ForSidePrices'):
-                # if we only have one price on offer
-                # there is no array
-                if (isinstance(sel.ForSidePrices,list)):
-                    bprices = [(p._Price, p._Stake) for p in
-                               sel.ForSidePrices]                    
-                else:
-                    bprices = [(sel.ForSidePrices._Price,
-                                sel.ForSidePrices._Stake)]                    
+                bprices = _suds_ladder(sel.ForSidePrices)
             else:
-                bprices = []
+                bprices = array('d')
             if hasattr(sel, 'AgainstSidePrices'):
-                # if we only have one price on offer
-                # there is no array
-                if (isinstance(sel.AgainstSidePrices,list)):
-                    lprices = [(p._Price, p._Stake) for p in
-                               sel.AgainstSidePrices]                    
-                else:
-                    # only one price
-                    lprices = [(sel.AgainstSidePrices._Price,
-                                sel.AgainstSidePrices._Stake)]
+                lprices = _suds_ladder(sel.AgainstSidePrices)
             else:
-                lprices = []
+                lprices = array('d')
             # create selection object using given data
             # we need to handle the case of no matches yet, since in
             # this case the response is missing certain fields.
@@ -165,12 +211,13 @@ def ParseGetPrices(marketids, resp):
                 lastmatchprice = None
                 lastmatchamount = None
             else:
-                lastmatchoccur = sel._LastMatchedOccurredAt
+                lastmatchoccur = suds_utc(sel._LastMatchedOccurredAt)
                 lastmatchprice = sel._LastMatchedPrice
                 lastmatchamount = sel._LastMatchedForSideAmount
             # the only data directly concerning the selection that we
             # are not storing in the selection instance is the
-            # 'deduction factor'.
+            # 'deduction factor' (which is in its properties, if
+            # const.SELECTIONPROPERTIES is True).
             allselections[-1].append(Selection(sel._Name, sel._Id, mid,
                                                sel._MatchedSelectionForStake,
                                                sel._MatchedSelectionAgainstStake,
@@ -182,6 +229,273 @@ def ParseGetPrices(marketids, resp):
                                                **dict(sel)))
     return allselections
 
+# tags of the elements in the XML of the GetPrices response that we
+# need for ParseGetPricesXML.
+_NS = '{http://www.GlobalBettingExchange.com/ExternalAPI/}'
+_RETURNSTATUS = _NS + 'ReturnStatus'
+_MARKETPRICES = _NS + 'MarketPrices'
+_SELECTIONS = _NS + 'Selections'
+_FORPRICES = _NS + 'ForSidePrices'
+_AGAINSTPRICES = _NS + 'AgainstSidePrices'
+
+_DATETIME = re.compile(r'(\d+)-(\d+)-(\d+)T(\d+):(\d+):(\d+)(?:\.(\d+))?'
+                       r'(Z|[+-]\d\d:\d\d)?$')
+
+def _xml_float(value):
+    """Convert xs:decimal attribute (or None) to float."""
+
+    return None if value is None else float(value)
+
+def _xml_bool(value):
+    """Convert xs:boolean attribute (or None) to bool."""
+
+    return None if value is None else value in ('true', '1')
+
+def _xml_datetime(value):
+    """Convert xs:dateTime attribute (or None) to naive UTC datetime."""
+
+    if value is None:
+        return None
+    (y, mo, d, h, mi, sec, frac, tz) = _DATETIME.match(value).groups()
+    micro = int((frac or '0')[:6].ljust(6, '0'))
+    dt = datetime.datetime(int(y), int(mo), int(d), int(h), int(mi),
+                           int(sec), micro)
+    if tz and tz != 'Z':
+        offset = datetime.timedelta(hours=int(tz[1:3]),
+                                    minutes=int(tz[4:6]))
+        dt = dt - offset if tz[0] == '+' else dt + offset
+    return dt
+
+def ParseGetPricesXML(marketids, xml, tuples=False, states=None):
+    """
+    As ParseGetPrices, but parse the XML of the response directly in
+    a single pass, rather than going through the SUDS object tree.
+    If tuples is True, each selection is returned as a (compact)
+    SelectionTuple rather than a Selection object.  Note that here
+    the selection objects do not store the raw data from the API in
+    their 'properties' dict, apart from the selection status.  If
+    states is a list, an exchange.MarketState for each market is
+    appended to it.
+    """
+
+    cls = SelectionTuple if tuples else Selection
+    # prices are lists of (price, stake) for SelectionTuples, and flat
+    # arrays of doubles (the form Selection stores them in) otherwise.
+    ladder = list if tuples else lambda: array('d')
+    allselections = []
+    nmarkets = 0
+    bprices = ladder()
+    lprices = ladder()
+    for (event, elem) in ElementTree.iterparse(StringIO(xml),
+                                               ('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            if tag == _MARKETPRICES:
+                # the market attributes are available at the start of
+                # the element, before any of its selections.
+                mid = marketids[nmarkets]
+                nmarkets += 1
+                wsn = int(elem.get('WithdrawalSequenceNumber'))
+                selections = []
+                allselections.append(selections)
+                if states is not None:
+                    states.append(_xml_market_state(mid, elem, wsn))
+        elif tag == _FORPRICES:
+            price = (float(elem.get('Price')), float(elem.get('Stake')))
+            if tuples:
+                bprices.append(price)
+            else:
+                bprices.extend(price)
+        elif tag == _AGAINSTPRICES:
+            price = (float(elem.get('Price')), float(elem.get('Stake')))
+            if tuples:
+                lprices.append(price)
+            else:
+                lprices.extend(price)
+        elif tag == _SELECTIONS:
+            get = elem.get
+            mback = _xml_float(get('MatchedSelectionForStake'))
+            mlay = _xml_float(get('MatchedSelectionAgainstStake'))
+            # as in ParseGetPrices, no last match details if there
+            # have been no matches yet.
+            if mback or mlay:
+                lastmatchoccur = _xml_datetime(get('LastMatchedOccurredAt'))
+                lastmatchprice = _xml_float(get('LastMatchedPrice'))
+                lastmatchamount = _xml_float(get('LastMatchedForSideAmount'))
+            else:
+                lastmatchoccur = None
+                lastmatchprice = None
+                lastmatchamount = None
+            sel = cls(get('Name'), int(get('Id')), mid, mback, mlay,
+                      lastmatchoccur, lastmatchprice, lastmatchamount,
+                      bprices, lprices, int(get('ResetCount')), wsn)
+            if not tuples:
+                sel.status = int(get('Status'))
+            selections.append(sel)
+            bprices = ladder()
+            lprices = ladder()
+            elem.clear()
+        elif tag == _MARKETPRICES:
+            elem.clear()
+        elif tag == _RETURNSTATUS:
+            retcode = int(elem.get('Code'))
+            if retcode != 0:
+                raise ApiError, '{0} {1}'.format(retcode,
+                                                 elem.get('Description'))
+
+    # check market prices is right length
+    assert nmarkets == len(marketids)
+
+    return allselections
+
+def _pad_ladders(ladders, depth):
+    """
+    Return (prices, stakes), flat arrays of depth items for each list
+    of (price, stake) in ladders, padded with NaN prices and zero
+    stakes.
+    """
+
+    nan = float('nan')
+    prices = array('d')
+    stakes = array('d')
+    for lad in ladders:
+        pad = depth - len(lad)
+        prices.extend([p for (p, st) in lad])
+        prices.extend([nan] * pad)
+        stakes.extend([st for (p, st) in lad])
+        stakes.extend([0.0] * pad)
+    return (prices, stakes)
+
+def _xml_market_state(mid, elem, wsn):
+    """Return MarketState from the MarketPrices element elem."""
+
+    return MarketState(mid, int(elem.get('Status')),
+                       _xml_bool(elem.get('IsCurrentlyInRunning')), wsn)
+
+def ParseGetPricesColumns(marketids, xml, states=None):
+    """
+    As ParseGetPricesXML, but return the prices as columns, i.e. a
+    dict of arrays with one item per selection (in the order
+    ParseGetPricesXML would return them): 'mid', 'sid', 'status',
+    'src', 'wsn', 'matchedback', 'matchedlay' and 'lastmatchedprice'
+    (NaN if none).  'backprice', 'backstake', 'layprice' and
+    'laystake' have 'depth' items per selection, best price first,
+    padded with NaN prices and zero stakes.  'markets' is the list of
+    market ids and 'nsel' the number of selections in each.  See
+    snapshot.py.  states is as for ParseGetPricesXML.
+    """
+
+    cols = dict((k, array('l')) for k in
+                ('mid', 'sid', 'status', 'src', 'wsn', 'nsel'))
+    for k in ('matchedback', 'matchedlay', 'lastmatchedprice'):
+        cols[k] = array('d')
+    nan = float('nan')
+    backs = []
+    lays = []
+    bprices = []
+    lprices = []
+    nmarkets = 0
+    for (event, elem) in ElementTree.iterparse(StringIO(xml),
+                                               ('start', 'end')):
+        tag = elem.tag
+        if event == 'start':
+            if tag == _MARKETPRICES:
+                mid = marketids[nmarkets]
+                nmarkets += 1
+                wsn = int(elem.get('WithdrawalSequenceNumber'))
+                cols['nsel'].append(0)
+                if states is not None:
+                    states.append(_xml_market_state(mid, elem, wsn))
+        elif tag == _FORPRICES:
+            bprices.append((float(elem.get('Price')),
+                            float(elem.get('Stake'))))
+        elif tag == _AGAINSTPRICES:
+            lprices.append((float(elem.get('Price')),
+                            float(elem.get('Stake'))))
+        elif tag == _SELECTIONS:
+            get = elem.get
+            mback = _xml_float(get('MatchedSelectionForStake')) or 0.0
+            mlay = _xml_float(get('MatchedSelectionAgainstStake')) or 0.0
+            cols['mid'].append(mid)
+            cols['sid'].append(int(get('Id')))
+            cols['status'].append(int(get('Status')))
+            cols['src'].append(int(get('ResetCount')))
+            cols['wsn'].append(wsn)
+            cols['matchedback'].append(mback)
+            cols['matchedlay'].append(mlay)
+            cols['lastmatchedprice'].append(
+                (mback or mlay) and _xml_float(get('LastMatchedPrice'))
+                or nan)
+            cols['nsel'][-1] += 1
+            backs.append(bprices)
+            lays.append(lprices)
+            bprices = []
+            lprices = []
+            elem.clear()
+        elif tag == _MARKETPRICES:
+            elem.clear()
+        elif tag == _RETURNSTATUS:
+            retcode = int(elem.get('Code'))
+            if retcode != 0:
+                raise ApiError, '{0} {1}'.format(retcode,
+                                                 elem.get('Description'))
+
+    assert nmarkets == len(marketids)
+
+    depth = max([len(l) for l in backs + lays] or [0])
+    (cols['backprice'], cols['backstake']) = _pad_ladders(backs, depth)
+    (cols['layprice'], cols['laystake']) = _pad_ladders(lays, depth)
+    cols['depth'] = depth
+    cols['markets'] = list(marketids)
+    return cols
+
+def ParseListSelectionsChangedSince(resp):
+    """
+    Return list of SelectionChange objects, in order of selection
+    sequence number.
+    """
+
+    _check_errors(resp)
+
+    if not hasattr(resp, 'Selections'):
+        # no selections have changed
+        return []
+    if isinstance(resp.Selections, list):
+        data = resp.Selections
+    else:
+        data = [resp.Selections]
+
+    changes = [SelectionChange(s._Id, s._MarketId, s._Name, s._Status,
+                               s._ResetCount, s._WithdrawalFactor,
+                               s._DisplayOrder, s._IsHidden,
+                               s._SelectionSequenceNumber)
+               for s in data]
+    changes.sort(key=lambda c: c.seqnum)
+    return changes
+
+def ParseGetCurrentSelectionSequenceNumber(resp):
+    """Return the current selection sequence number."""
+
+    _check_errors(resp)
+
+    return resp._SelectionSequenceNumber
+
+def ParseGetOddsLadder(resp):
+    """Return odds ladder (see exchangedata.py) from GetOddsLadder."""
+
+    _check_errors(resp)
+
+    return exchangedata.OddsLadder([l._price for l in resp.Ladder])
+
+def _order_items(orders):
+    """Return list of the Order items of the SUDS Orders object orders."""
+
+    items = orders.Order
+    if not isinstance(items, list):
+        # a single order, which SUDS does not put in a list
+        items = [items]
+    return items
+
 def ParseListBootstrapOrders(resp):
     """
     Parse a single order, return order object.  Note there are a few
@@ -196,7 +510,7 @@ def ParseListBootstrapOrders(resp):
 
     # create and return list of order objects.    
     allorders = {}
-    for o in resp.Orders.Order:
+    for o in _order_items(resp.Orders):
         sid = o._SelectionId
         ustake = o._UnmatchedStake
         mstake = o._MatchedStake
@@ -210,6 +524,7 @@ def ParseListBootstrapOrders(resp):
         
         allorders[oref] = Order(sid, stake, price,
                                 pol, **{'oref': oref,
+                                        'mid': o._MarketId,
                                         'status': status,
                                         'matchedstake': mstake,
                                         'unmatchedstake': ustake})
@@ -224,32 +539,85 @@ def ParsePlaceOrdersNoReceipt(resp, olist):
     # list of order refs - I am presuming BDAQ returns them in the order
     # the orders were given!
     orefs = resp.OrderHandles.OrderHandle
+    if not isinstance(orefs, list):
+        # a single order was placed
+        orefs = [orefs]
+    assert len(orefs) == len(olist)
 
     # create and return order object.  Note we set status to UNMATCHED,
     # and unmatched stake and matched stake accordingly.
     allorders = {}
     for (o, ref) in zip(olist, orefs):
+        odict = {'oref': ref,
+                 'status': O_UNMATCHED,
+                 'matchedstake': 0.0,
+                 'unmatchedstake': o.stake,
+                 'src': o.src,
+                 'wsn': o.wsn,
+                 'cancelrunning': o.cancelrunning,
+                 'cancelreset': o.cancelreset}
+        if hasattr(o, 'mid'):
+            odict['mid'] = o.mid
         allorders[ref] = Order(o.sid, o.stake, o.price, o.polarity,
-                               **{'oref': ref,
-                                  'status': O_UNMATCHED,
-                                  'matchedstake': 0.0,
-                                  'unmatchedstake': o.stake})
+                               **odict)
     return allorders
 
+def ParseUpdateOrdersNoReceipt(resp):
+    """Return dict of the return code for each order, by order ref."""
+
+    _check_errors(resp)
+
+    if not hasattr(resp, 'Orders'):
+        return {}
+    items = resp.Orders.Order
+    if not isinstance(items, list):
+        # a single order was updated
+        items = [items]
+    return dict((o._BetId, o._ReturnCode) for o in items)
+
+def _cancelled_handles(items):
+    """Return list of order refs from the cancelled orders items."""
+
+    if not isinstance(items, list):
+        # a single order was cancelled
+        items = [items]
+    return [o._OrderHandle for o in items]
+
 def ParseCancelOrders(resp, olist):
     """Return list of order objects."""
 
     _check_errors(resp)
 
-    for o in resp.Orders.Order:
-        oref = o._OrderHandle
-        # find the order ref in the list of orders
-        for myo in olist:
-            if myo.oref == oref:
-                myo.status = O_CANCELLED
-                break
+    if not hasattr(resp, 'Orders'):
+        # no orders were cancelled
+        return olist
+
+    # orders by order ref, so we don't search the list for each order
+    # cancelled.
+    byref = dict((myo.oref, myo) for myo in olist)
+    for oref in _cancelled_handles(resp.Orders.Order):
+        if oref in byref:
+            byref[oref].status = O_CANCELLED
     return olist
 
+def ParseCancelAllOrdersOnMarket(resp):
+    """Return list of order refs of the orders cancelled."""
+
+    _check_errors(resp)
+
+    if not hasattr(resp, 'Order'):
+        return []
+    return _cancelled_handles(resp.Order)
+
+def ParseCancelAllOrders(resp):
+    """Return list of order refs of the orders cancelled."""
+
+    _check_errors(resp)
+
+    if not hasattr(resp, 'Orders'):
+        return []
+    return _cancelled_handles(resp.Orders.Order)
+
 def ParseGetAccountBalances(resp):
     """
     Returns account balance information by parsing output from BDAQ
@@ -278,7 +646,7 @@ def ParseListOrdersChangedSince(resp):
     seqnums = []
 
     allorders = {}
-    for o in resp.Orders.Order:
+    for o in _order_items(resp.Orders):
 
         # From API docs, order _Status can be
         # 1 - Unmatched.  Order has SOME amount available for matching.
@@ -292,6 +660,7 @@ def ParseListOrdersChangedSince(resp):
         # comes from the BDAQ API function, only the information that
         # seems useful...
         odict = {'oref': o._Id,
+                 'mid': o._MarketId,
                  'status': o._Status,
                  'matchedstake' : o._MatchedStake,
                  'unmatchedstake': o._UnmatchedStake}
@@ -0,0 +1,44 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+SUDS plugins used by the API clients.  This module imports SUDS, so
+should only be imported once a SUDS client is needed.
+"""
+
+from copy import deepcopy
+from suds.plugin import MessagePlugin
+
+class HeaderPlugin(MessagePlugin):
+    """
+    Put the ExternalApiHeader into the SOAP envelope of each request.
+    We do this here rather than with the SUDS 'soapheaders' option,
+    since all of our SUDS clients share one parsed WSDL, and SUDS
+    reads 'soapheaders' from the options of the client that parsed
+    it; the readonly and secure clients need different headers.
+    """
+
+    def __init__(self, header=None):
+        self.header = header
+
+    def __deepcopy__(self, memo):
+        # clones of a SUDS client (see ApiClient.clone) share the
+        # plugin, and so follow any change to the header.
+        return self
+
+    def marshalled(self, context):
+        if self.header is not None:
+            context.envelope.getChild('Header').append(deepcopy(self.header))
@@ -0,0 +1,193 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+A board of prices in shared memory, written by one process per
+market and read by any number of processes without copying the
+prices through pipes or pickling Selection objects (see shard.py).
+
+The board has a fixed layout: each market (in the list given when
+the board is created) has a block of maxsel slots, and each slot
+holds one selection as a row of doubles (see FIELDS, followed by the
+back and then lay ladders, as price, stake pairs, padded with zeros).
+Each slot has a sequence counter, which the writer makes odd while it
+writes the slot and even again afterwards, so a reader can tell if
+it read the slot during a write and should read it again.  Each slot
+is consistent; a market read slot by slot may mix selections from
+two consecutive writes.  A reader gives up (raising RuntimeError) if
+a slot stays mid-write for longer than the board's timeout, as it
+would if its writer died during a write.
+"""
+
+import time
+from collections import namedtuple
+from multiprocessing.sharedctypes import RawArray
+import util
+from apilog import apilog
+
+# values stored for each selection, before the ladders.  updated is
+# the time (time.time()) the slot was written.
+FIELDS = ('mid', 'sid', 'src', 'wsn', 'matchedback', 'matchedlay',
+          'lastmatchedprice', 'updated')
+
+# a selection read from the board; backprices and layprices are lists
+# of (price, stake), best price first.
+BoardSelection = namedtuple('BoardSelection',
+                            list(FIELDS) + ['backprices', 'layprices'])
+
+# best back and lay price and stake of a selection (0.0 if none).
+TopOfBook = namedtuple('TopOfBook', ['sid', 'backprice', 'backstake',
+                                     'layprice', 'laystake'])
+
+def _ladder(prices, depth):
+    """Return flat list of the first depth (price, stake), zero padded."""
+
+    flat = [x for ps in prices[:depth] for x in ps]
+    return flat + [0.0] * (2 * depth - len(flat))
+
+class PriceBoard(object):
+    """Prices of the selections of a fixed list of markets."""
+
+    def __init__(self, mids, maxsel=40, depth=3, timeout=1.0):
+        """
+        mids is the list of market ids (duplicates are ignored), maxsel
+        the maximum number of selections stored for each market, depth
+        the number of prices stored on each side, and timeout the time
+        in seconds a read waits for a write to finish.  Create the
+        board before starting the processes that use it, so that they
+        share its memory.
+        """
+
+        self.mids = util.unique(mids)
+        self.maxsel = maxsel
+        self.depth = depth
+        self.timeout = timeout
+        self.nfields = len(FIELDS)
+        self.width = self.nfields + 4 * depth
+        # first slot of each market.
+        self.blocks = dict((mid, i * maxsel) for (i, mid)
+                           in enumerate(self.mids))
+        nslots = len(self.mids) * maxsel
+        self.data = RawArray('d', nslots * self.width)
+        self.seqs = RawArray('L', nslots)
+
+    def write_slot(self, slot, values):
+        """Write row values (of length self.width) to slot."""
+
+        seqs = self.seqs
+        start = slot * self.width
+        # odd while we write, even if a writer died during a write
+        # and left it odd.
+        seq = seqs[slot] | 1
+        seqs[slot] = seq
+        self.data[start:start + self.width] = values
+        seqs[slot] = seq + 1
+
+    def read_slot(self, slot):
+        """
+        Return row of slot, read while no write was in progress.
+        Raises RuntimeError if the slot is still being written after
+        self.timeout seconds.
+        """
+
+        seqs = self.seqs
+        start = slot * self.width
+        deadline = None
+        while True:
+            seq = seqs[slot]
+            if seq % 2 == 0:
+                row = self.data[start:start + self.width]
+                if seqs[slot] == seq:
+                    return row
+            if deadline is None:
+                deadline = time.time() + self.timeout
+            elif time.time() > deadline:
+                raise RuntimeError('slot {0} of the price board has been '
+                                   'written for over {1}s; did its writer '
+                                   'die?'.format(slot, self.timeout))
+            time.sleep(0)
+
+    def write_market(self, mid, selections):
+        """
+        Write the prices of market id mid, given as a list of
+        Selection objects or SelectionTuples (e.g. from
+        api.GetPrices).  Selections beyond maxsel are left out (with a
+        warning), and unused slots of the market are cleared.
+        """
+
+        if len(selections) > self.maxsel:
+            apilog.warning('market {0} has {1} selections, only the first '
+                           '{2} are on the price board'
+                           .format(mid, len(selections), self.maxsel))
+        first = self.blocks[mid]
+        depth = self.depth
+        now = time.time()
+        for (i, sel) in enumerate(selections[:self.maxsel]):
+            row = [mid, sel.id, sel.src, sel.wsn, sel.matchedback or 0.0,
+                   sel.matchedlay or 0.0, sel.lastmatchedprice or 0.0, now]
+            row += _ladder(sel.backprices, depth)
+            row += _ladder(sel.layprices, depth)
+            self.write_slot(first + i, row)
+        empty = [0.0] * self.width
+        for slot in range(first + len(selections), first + self.maxsel):
+            if self.data[slot * self.width + 1] != 0.0:
+                self.write_slot(slot, empty)
+
+    def _rows(self, mid):
+        """Return rows of the occupied slots of market id mid."""
+
+        first = self.blocks[mid]
+        rows = []
+        for slot in range(first, first + self.maxsel):
+            row = self.read_slot(slot)
+            if row[1] == 0.0:
+                # selections are written from the first slot on.
+                break
+            rows.append(row)
+        return rows
+
+    def market(self, mid):
+        """Return list of BoardSelection for market id mid."""
+
+        n = self.nfields
+        d = 2 * self.depth
+        result = []
+        for row in self._rows(mid):
+            back = [(p, s) for (p, s) in zip(row[n:n + d:2],
+                                            row[n + 1:n + d:2]) if p]
+            lay = [(p, s) for (p, s) in zip(row[n + d::2],
+                                           row[n + d + 1::2]) if p]
+            vals = row[:n]
+            vals[0] = int(vals[0])
+            vals[1] = int(vals[1])
+            vals[2] = int(vals[2])
+            vals[3] = int(vals[3])
+            result.append(BoardSelection(*(vals + [back, lay])))
+        return result
+
+    def top(self, mid):
+        """Return list of TopOfBook for the selections of market id mid."""
+
+        n = self.nfields
+        d = 2 * self.depth
+        return [TopOfBook(int(row[1]), row[n], row[n + 1], row[n + d],
+                          row[n + d + 1]) for row in self._rows(mid)]
+
+    def updated(self, mid):
+        """Return time market id mid was last written (0.0 if never)."""
+
+        row = self.read_slot(self.blocks[mid])
+        return row[FIELDS.index('updated')]
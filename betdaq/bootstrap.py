@@ -0,0 +1,182 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Bootstrapping the orders of a session at startup, with a checkpoint
+file so that a restarted process can carry on where it left off.
+
+ListBootstrapOrders returns the orders of the account a batch at a
+time, and has to be called until it returns no orders.  For accounts
+with many orders this is slow, so bootstrap_orders is a generator
+that yields the orders of each batch as they arrive (they are also
+added to the order store of the session, see orderstore.py).
+
+If a checkpoint file is given, after each batch the orders and the
+order sequence number are written to it (atomically, so a crash while
+writing leaves the previous checkpoint intact).  When the process is
+restarted, the orders are read back from the checkpoint and:
+
+* if the bootstrap had finished, we only need the changes since the
+  checkpoint, which we get from ListOrdersChangedSince;
+* otherwise we carry on calling ListBootstrapOrders from the sequence
+  number in the checkpoint.
+
+Call save_checkpoint after later calls to ListOrdersChangedSince to
+keep the checkpoint current.
+"""
+
+import os
+import cPickle as pickle
+import tempfile
+import api
+import apimethod
+from exchange import Order
+from apilog import apilog
+
+# version of the checkpoint file format.
+_VERSION = 1
+
+# attributes of Order objects saved in the checkpoint, other than
+# sid, stake, price and polarity.
+_ATTRS = ('oref', 'mid', 'status', 'matchedstake', 'unmatchedstake',
+          'cancelrunning', 'cancelreset', 'src', 'wsn')
+
+def _dump_order(o):
+    return (o.sid, o.stake, o.price, o.polarity,
+            dict((a, getattr(o, a)) for a in _ATTRS if hasattr(o, a)))
+
+def _load_order(data):
+    (sid, stake, price, polarity, kwargs) = data
+    return Order(sid, stake, price, polarity, **kwargs)
+
+def save_checkpoint(path, apiclient=None, complete=True):
+    """
+    Write the orders and order sequence number of the session of
+    apiclient (by default that of the api module) to file path.
+    complete says whether the bootstrap has finished.  The file is
+    replaced atomically.
+    """
+
+    apiclient = apiclient or api._scl
+    store = apiclient.orders
+    with store.lock:
+        data = {'version': _VERSION,
+                'username': apiclient.name,
+                'seqnum': store.seqnum,
+                'complete': complete,
+                'orders': [_dump_order(o) for o in store]}
+    dirname = os.path.dirname(os.path.abspath(path))
+    (fd, tmppath) = tempfile.mkstemp(dir=dirname, prefix='.bootstrap')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        # rename is atomic on POSIX (on Windows, the old file has to
+        # be removed first).
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmppath, path)
+    except:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+        raise
+
+def load_checkpoint(path, apiclient=None):
+    """
+    Read orders and order sequence number from checkpoint file path
+    into the order store of the session of apiclient.  Return True
+    if the checkpoint was for a finished bootstrap, False if not, or
+    None if there is no usable checkpoint (the store is then not
+    changed).
+    """
+
+    apiclient = apiclient or api._scl
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+    except Exception, e:
+        apilog.warning('ignoring order checkpoint {0}: {1}'.format(path, e))
+        return None
+    if data.get('version') != _VERSION:
+        apilog.warning('ignoring order checkpoint {0}: wrong version'\
+                       .format(path))
+        return None
+    if data['username'] != apiclient.name:
+        apilog.warning('ignoring order checkpoint {0}: for user {1}'\
+                       .format(path, data['username']))
+        return None
+    store = apiclient.orders
+    with store.lock:
+        store.clear()
+        store.update([_load_order(d) for d in data['orders']])
+        store.seqnum = data['seqnum']
+    return data['complete']
+
+def bootstrap_orders(apiclient=None, checkpoint=None):
+    """
+    Generator that bootstraps the orders of the session of apiclient
+    (by default that of the api module), yielding a dict (by order
+    ref) of orders for each batch that arrives.  The orders are also
+    in the order store of the session.  If checkpoint is the path of
+    a checkpoint file, we resume from it if it exists, and write it
+    after each batch.
+    """
+
+    if apiclient is None:
+        apiclient = api._scl
+        bootfn = api.ListBootstrapOrders
+        changedfn = api.ListOrdersChangedSince
+    else:
+        bootfn = apimethod.ApiListBootstrapOrders(apiclient).call
+        changedfn = apimethod.ApiListOrdersChangedSince(apiclient).call
+
+    complete = None
+    if checkpoint is not None:
+        complete = load_checkpoint(checkpoint, apiclient)
+    if complete is None:
+        # full bootstrap from the start.
+        apiclient.orders.clear()
+        apiclient.orders.seqnum = -1
+    else:
+        apilog.info('resuming orders from checkpoint {0}, sequence '
+                    'number {1}'.format(checkpoint,
+                                        apiclient.orders.seqnum))
+        yield dict((o.oref, o) for o in apiclient.orders)
+
+    if not complete:
+        while True:
+            orders = bootfn()
+            if not orders:
+                break
+            if checkpoint is not None:
+                save_checkpoint(checkpoint, apiclient, False)
+            yield orders
+
+    if complete:
+        # catch up with the changes since the checkpoint.
+        while True:
+            seqnum = apiclient.orders.seqnum
+            orders = changedfn()
+            if orders:
+                yield orders
+            if not orders or apiclient.orders.seqnum == seqnum:
+                break
+
+    if checkpoint is not None:
+        save_checkpoint(checkpoint, apiclient, True)
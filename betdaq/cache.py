@@ -0,0 +1,152 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+A thread safe cache with a time to live for each entry and a maximum
+number of entries, beyond which the least recently used entries are
+evicted, and a way of sharing one call between threads that make it
+at the same time.
+
+The cache is bounded by the number of entries, not by their size in
+memory: a value is kept however large it is, so choose maxentries
+with the size of the values in mind (e.g. a few whole event trees
+take far more memory than many MarketInfo objects).
+"""
+
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+class TTLCache(object):
+    """Mapping with entries that expire, and LRU eviction by count."""
+
+    def __init__(self, maxentries=1000, ttl=60.0):
+        """
+        maxentries is the maximum number of entries (whatever their
+        size), and ttl the time in seconds for which an entry is
+        valid.
+        """
+
+        self.maxentries = maxentries
+        self.ttl = ttl
+        # (expiry time, value) by key, least recently used first.
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            return item is not None and item[0] > time.time()
+
+    def get(self, key, default=None):
+        """Return the value for key, or default if missing or expired."""
+
+        with self.lock:
+            item = self.data.pop(key, None)
+            if item is None or item[0] <= time.time():
+                self.misses += 1
+                return default
+            # put the entry back at the most recently used end.
+            self.data[key] = item
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, value, ttl=None):
+        """Store value for key, valid for ttl seconds (default self.ttl)."""
+
+        ttl = self.ttl if ttl is None else ttl
+        with self.lock:
+            self.data.pop(key, None)
+            self.data[key] = (time.time() + ttl, value)
+            while len(self.data) > self.maxentries:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, keys):
+        """Remove the entries for keys."""
+
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+
+    def clear(self):
+        """Remove all entries."""
+
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        """Return dict of hits, misses, evictions and number of entries."""
+
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self.data)}
+
+class _Flight(object):
+    """A call in progress, and its result or exception once done."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight(object):
+    """
+    Runs at most one call at a time per key: threads asking for a key
+    whose call is already in progress wait for it, and get its result
+    (or exception) rather than making the call again.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+        # number of calls that waited for another thread's call.
+        self.shared = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Return fn(*args, **kwargs), shared with any call for key."""
+
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self.flights[key] = flight
+            else:
+                self.shared += 1
+        if leader:
+            try:
+                flight.result = fn(*args, **kwargs)
+            except Exception:
+                flight.error = sys.exc_info()
+            finally:
+                with self.lock:
+                    del self.flights[key]
+                flight.done.set()
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error[0], flight.error[1], flight.error[2]
+        return flight.result
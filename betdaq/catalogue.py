@@ -0,0 +1,207 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+A catalogue of the markets under some events, indexed by event id,
+market id and name, and refreshed event by event once its data is
+older than a time to live.
+
+The events tracked can be any event classifier ids, not just the top
+level events: tracking e.g. the id of a single race meeting rather
+than 'Horse Racing' means only that part of the tree is downloaded
+and parsed on each refresh.  Each refresh returns the markets that
+have appeared and disappeared since the last one.
+"""
+
+import time
+import threading
+import api
+
+class Catalogue(object):
+    """Markets under the tracked event ids, refreshed on a TTL."""
+
+    def __init__(self, eids=None, ttl=300.0):
+        """
+        eids is the list of event classifier ids to track, and ttl
+        the time in seconds after which the markets of an event are
+        fetched again.
+        """
+
+        self.ttl = ttl
+        # market ids by event id, and time each event was fetched.
+        self.events = {}
+        self.fetched = {}
+        # Market objects by market id, and the tracked event ids each
+        # market is under.
+        self.markets = {}
+        self.parents = {}
+        # market id by market name (the full path, e.g.
+        # '|Horse Racing|...|Win Market'), and event id by event name
+        # (for the top level events, see load_events).
+        self.names = {}
+        self.eventnames = {}
+        self.lock = threading.RLock()
+        self.add_events(eids or [])
+
+    def __len__(self):
+        return len(self.markets)
+
+    def __contains__(self, mid):
+        return mid in self.markets
+
+    def __getitem__(self, mid):
+        return self.markets[mid]
+
+    def add_events(self, eids):
+        """Track event ids eids; these are fetched on the next refresh."""
+
+        with self.lock:
+            for eid in eids:
+                if eid not in self.events:
+                    self.events[eid] = []
+                    self.fetched[eid] = None
+
+    def remove_events(self, eids):
+        """
+        Stop tracking event ids eids.  Returns list of the markets
+        removed from the catalogue.
+        """
+
+        removed = []
+        with self.lock:
+            for eid in eids:
+                if eid in self.events:
+                    removed.extend(self._set_markets(eid, [])[1])
+                    del self.events[eid]
+                    del self.fetched[eid]
+        return removed
+
+    def load_events(self):
+        """Fetch the top level events, so that they can be found by name."""
+
+        events = api.ListTopLevelEvents()
+        with self.lock:
+            self.eventnames = dict((e.name, e.id) for e in events)
+        return events
+
+    def event_id(self, name):
+        """Return id of top level event called name (see load_events)."""
+
+        return self.eventnames[name]
+
+    def market_id(self, name):
+        """Return id of market with (full path) name."""
+
+        return self.names[name]
+
+    def event_markets(self, eid):
+        """Return list of the Market objects under event id eid."""
+
+        with self.lock:
+            return [self.markets[mid] for mid in self.events.get(eid, [])]
+
+    def due(self, now=None):
+        """Return list of the event ids whose markets are out of date."""
+
+        now = time.time() if now is None else now
+        with self.lock:
+            return [eid for (eid, t) in self.fetched.iteritems()
+                    if t is None or now - t >= self.ttl]
+
+    def refresh(self, eids=None, force=False):
+        """
+        Fetch the markets of the event ids eids (by default, all of
+        the tracked events) whose markets are older than the TTL, or
+        all of them if force is True.  Returns (list of markets added,
+        list of markets removed).
+
+        The Api is called without holding the lock, so the catalogue
+        can be read (or refreshed by another thread) meanwhile; an
+        event being fetched is not due, so is only fetched once.
+        """
+
+        now = time.time()
+        with self.lock:
+            if eids is None:
+                eids = self.events.keys()
+            if not force:
+                due = set(self.due(now))
+                eids = [e for e in eids if e in due]
+            # the time each event was fetched before, should the fetch
+            # fail.
+            before = {}
+            for eid in eids:
+                before[eid] = self.fetched.get(eid)
+                self.fetched[eid] = now
+        added = []
+        removed = []
+        for (n, eid) in enumerate(eids):
+            try:
+                markets = api.GetEventSubTreeNoSelections([eid])
+            except:
+                with self.lock:
+                    # this and the events not yet fetched are due.
+                    for e in eids[n:]:
+                        if self.fetched.get(e) == now:
+                            self.fetched[e] = before[e]
+                raise
+            (a, r) = self._set_markets(eid, markets)
+            added.extend(a)
+            removed.extend(r)
+        return (added, removed)
+
+    def _set_markets(self, eid, markets):
+        """
+        Set the markets under event id eid, and return (list of
+        markets added, list of markets removed) from the catalogue.
+        Nothing is changed if eid is no longer tracked.
+        """
+
+        with self.lock:
+            if eid not in self.events:
+                return ([], [])
+            return self._update(eid, markets)
+
+    def _update(self, eid, markets):
+        """As _set_markets, with the lock held."""
+
+        added = []
+        removed = []
+        old = set(self.events.get(eid, []))
+        new = set(m.id for m in markets)
+        for m in markets:
+            oldm = self.markets.get(m.id)
+            if oldm is None:
+                added.append(m)
+            elif oldm.name != m.name and self.names.get(oldm.name) == m.id:
+                del self.names[oldm.name]
+            # replace the market object, since its details (e.g. the
+            # in running flag) may have changed.
+            self.markets[m.id] = m
+            self.names[m.name] = m.id
+            self.parents.setdefault(m.id, set()).add(eid)
+        for mid in old - new:
+            parents = self.parents[mid]
+            parents.discard(eid)
+            if not parents:
+                # no longer under any tracked event.
+                m = self.markets.pop(mid)
+                del self.parents[mid]
+                if self.names.get(m.name) == mid:
+                    del self.names[m.name]
+                removed.append(m)
+        self.events[eid] = [m.id for m in markets]
+        return (added, removed)
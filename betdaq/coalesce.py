@@ -0,0 +1,179 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Combining the GetPrices calls of several threads into as few Api
+calls as possible.
+
+A thread asking for prices becomes the fetching thread if no other
+thread is fetching.  It waits for a short window to collect the
+market ids asked for by other threads, then fetches all of them
+(each market id once, in chunks of 50) with a single call to
+api.GetPrices, and gives each thread the selections for its own
+market ids.  Threads that ask while a fetch is in progress are
+served by the next fetch, which is made by the first of them: the
+fetching thread returns as soon as its own prices are fetched.
+
+e.g. ten threads each asking for the same 20 markets at the same time
+need one GetPrices Api call rather than ten.
+"""
+
+import time
+import threading
+import api
+from apiexception import ApiError
+from apilog import apilog
+
+class _Request(object):
+    """Market ids a thread is waiting for, and the result."""
+
+    def __init__(self, mids, output, partial):
+        self.mids = mids
+        self.output = output
+        self.partial = partial
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        # True if this thread is to fetch the next batch.
+        self.lead = False
+
+class PriceCoalescer(object):
+    """Coalesces concurrent calls to api.GetPrices."""
+
+    def __init__(self, window=0.01, workers=1):
+        """
+        window is the time in seconds the fetching thread waits for
+        other threads before calling the Api, and workers the number
+        of threads api.GetPrices uses to fetch the chunks.
+        """
+
+        self.window = window
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.queue = []
+        self.fetching = False
+        # statistics: number of GetPrices calls, and number of market
+        # ids asked for and actually fetched.
+        self.calls = 0
+        self.requested = 0
+        self.fetched = 0
+
+    def get(self, mids, partial=False, output='selections'):
+        """
+        As api.GetPrices(mids, partial=partial, output=output), but
+        shared with any other thread asking for prices at the same
+        time.  Selection objects are shared between the threads, so
+        should not be modified.  output 'columns' is not supported,
+        since the result of each thread is a list of its markets.
+        """
+
+        if output == 'columns':
+            raise ValueError("output 'columns' can't be coalesced, use "
+                             "'selections' or 'tuples'")
+        req = _Request(list(mids), output, partial)
+        with self.lock:
+            self.queue.append(req)
+            if not self.fetching:
+                self.fetching = True
+                req.lead = True
+        if not req.lead:
+            # woken with the result, or to fetch the next batch.
+            req.done.wait()
+        if req.lead:
+            req.done.clear()
+            self._fetch()
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def _fetch(self):
+        """
+        Fetch the queued requests (which include the fetching
+        thread's own), then hand fetching over to the first thread
+        left waiting, if any.
+        """
+
+        reqs = []
+        try:
+            if self.window > 0:
+                time.sleep(self.window)
+            with self.lock:
+                reqs = self.queue
+                self.queue = []
+            for output in set(r.output for r in reqs):
+                self._fetch_requests([r for r in reqs if r.output == output],
+                                     output)
+        except Exception, e:
+            # don't leave any thread waiting for a result.
+            for r in reqs:
+                if not r.done.is_set():
+                    r.error = e
+                    r.done.set()
+        finally:
+            with self.lock:
+                if self.queue:
+                    self.queue[0].lead = True
+                    self.queue[0].done.set()
+                else:
+                    self.fetching = False
+
+    def _fetch_requests(self, reqs, output):
+        """Fetch the market ids of reqs with one call to api.GetPrices."""
+
+        mids = []
+        seen = set()
+        nrequested = sum(len(r.mids) for r in reqs)
+        self.requested += nrequested
+        for r in reqs:
+            for mid in r.mids:
+                if mid not in seen:
+                    seen.add(mid)
+                    mids.append(mid)
+        apilog.info('coalesced GetPrices for {0} callers: {1} of {2} '
+                    'market ids fetched'.format(len(reqs), len(mids),
+                                                nrequested))
+        try:
+            self.calls += 1
+            self.fetched += len(mids)
+            prices = dict(zip(mids, api.GetPrices(mids, self.workers, True,
+                                                  output)))
+        except Exception, e:
+            for r in reqs:
+                r.error = e
+                r.done.set()
+            return
+        for r in reqs:
+            r.result = [prices[mid] for mid in r.mids]
+            failed = [m for (m, s) in zip(r.mids, r.result) if s is None]
+            if failed and not r.partial:
+                r.error = ApiError('GetPrices failed for market ids {0}'\
+                                   .format(failed))
+            r.done.set()
+
+    def stats(self):
+        """Return dict of number of calls, market ids asked for and fetched."""
+
+        return {'calls': self.calls,
+                'requested': self.requested,
+                'fetched': self.fetched}
+
+# coalescer used by GetPrices.
+coalescer = PriceCoalescer()
+
+def GetPrices(mids, partial=False, output='selections'):
+    """As api.GetPrices, coalesced with other threads (see above)."""
+
+    return coalescer.get(mids, partial, output)
@@ -18,7 +18,6 @@
 Some constants that are useful globally.
 """
 
-import suds
 import sys
 import os
 
@@ -33,14 +32,74 @@ LOGGING = True
 # maximum number of prices to get from API
 NUMPRICES = 5
 
-# send as 'user-agent' header for all SOAP requests
-USERAGENT = 'pybetman/{0} python/{1} suds/{2}'.\
-            format(VERSION, sys.version.split()[0], suds.__version__)
+# rate limits for the API methods, as a mapping from method name to
+# (number of calls, period in seconds).  Calls go out immediately in
+# bursts of up to 'number of calls', and after that at an average
+# rate of 'number of calls' per period.  Betdaq will blacklist us if
+# we exceed the limits in the API docs, so keep these in line with
+# them.  Methods not listed here are not rate limited (see
+# ratelimit.py).
+RATELIMITS = {'GetPrices': (60, 60.0),
+              'GetMarketInformation': (60, 60.0),
+              'ListSelectionsChangedSince': (60, 60.0),
+              'GetEventSubTreeNoSelections': (10, 60.0),
+              'ListOrdersChangedSince': (60, 60.0),
+              'ListBootstrapOrders': (60, 60.0),
+              'PlaceOrdersNoReceipt': (60, 60.0),
+              'UpdateOrdersNoReceipt': (60, 60.0),
+              'CancelOrders': (60, 60.0),
+              'CancelAllOrdersOnMarket': (60, 60.0),
+              'CancelAllOrders': (60, 60.0)}
+
+# keep all of the data from the API for each selection in its
+# 'properties' dict?  This roughly doubles the memory used by each
+# Selection object, so is off by default.
+SELECTIONPROPERTIES = False
+
+# cache the results of these read-only Api methods: (time to live in
+# seconds, maximum number of different sets of arguments) by method
+# name, e.g. {'ListTopLevelEvents': (300.0, 10)}.  Only methods that
+# are marked cacheable in apimethod.py can be cached; see also
+# api.set_cache.
+APICACHE = {}
+
+# send as 'user-agent' header for all SOAP requests (the SUDS version
+# is added to this when the SUDS client is created, see apiclient.py).
+USERAGENT = 'pybetman/{0} python/{1}'.format(VERSION,
+                                             sys.version.split()[0])
+
+# write the SOAP envelopes for GetPrices, PlaceOrdersNoReceipt,
+# UpdateOrdersNoReceipt, CancelOrders and ListOrdersChangedSince
+# ourselves, rather than having SUDS marshal request objects (see
+# apiserialize.py, and tests/test_apiserialize.py, which checks that
+# the envelopes are the same as those SUDS writes).
+FASTSERIALIZE = True
+
+# parser for GetPrices responses: 'suds' to have SUDS unmarshal the
+# response and then extract the prices (apiparse.ParseGetPrices), or
+# 'xml' to parse the XML of the response directly in a single pass
+# (apiparse.ParseGetPricesXML), which is much faster.
+PRICEPARSER = 'suds'
+
+# HTTP connection pooling (see transport.py): maximum number of idle
+# connections to keep per host, time in seconds after which an idle
+# connection is not reused, whether to set TCP_NODELAY on sockets
+# (so that small requests are sent straight away), and any other
+# socket options as a list of (level, option, value).
+HTTPPOOLSIZE = 4
+HTTPIDLETIMEOUT = 30.0
+TCPNODELAY = True
+SOCKOPTS = []
 
 # path to local copy of WSDL file
 _mypath = os.path.dirname(os.path.join(os.getcwd(), __file__))
-_wsdlpath = os.path.join(_mypath, 'wsdl', 'API.wsdl')
-WSDLLOCAL = 'file://{0}'.format(_wsdlpath)
+WSDLPATH = os.path.join(_mypath, 'wsdl', 'API.wsdl')
+WSDLLOCAL = 'file://{0}'.format(WSDLPATH)
+
+# directory in which to cache the parsed WSDL file, so that new
+# processes don't need to parse it again.  Set to None to switch off
+# the cache.
+WSDLCACHE = os.path.join(os.path.expanduser('~'), '.pybetdaq', 'wsdlcache')
 
 # BDAQ API version sent in SOAP headers
 BDAQAPIVERSION = '2'
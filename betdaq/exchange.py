@@ -19,6 +19,8 @@ Event, Market, Selection and Order objects.  Also contained here are
 constants for order status, such as O_UNMATCHED.
 """
 
+from array import array
+from collections import namedtuple
 import const
 import exchangedata
 
@@ -62,15 +64,66 @@ class Market(object):
     def __str__(self):
         return self.__repr__()
 
+def _ladder(prices):
+    """
+    Return list of (price, stake) as a flat array of doubles, or
+    prices if this is already such an array.
+    """
+
+    if type(prices) is array:
+        return prices
+    # quicker than chain.from_iterable for the few levels we get.
+    return array('d', [x for ps in prices for x in ps])
+
+# selection names as ascii strings, by the name from the Api.  We see
+# the same names every time we poll a market, so this is quicker than
+# encoding each one, and the objects share the strings.  Names come
+# and go with the markets, so the dict is emptied when it reaches
+# _MAXNAMES names (the strings are interned, so they are still shared
+# after that).
+_names = {}
+_MAXNAMES = 100000
+
+def _name(name):
+    """Return (shared) ascii string of name."""
+
+    ascii = _names.get(name)
+    if ascii is None:
+        if len(_names) >= _MAXNAMES:
+            _names.clear()
+        ascii = _names[name] = intern(name.encode('ascii', 'ignore'))
+    return ascii
+
+def _unladder(ladder):
+    """Return flat array of doubles as list of (price, stake)."""
+
+    return zip(ladder[0::2], ladder[1::2])
+
 class Selection(object):
-    """A selection."""
+    """
+    A selection.  Since we may hold prices for tens of thousands of
+    selections, these are kept small: the attributes are slots, the
+    prices are stored in flat arrays (backprices and layprices are
+    converted to and from lists of (price, stake) on access), and the
+    raw data from the API is only kept in properties if
+    const.SELECTIONPROPERTIES is True.
+
+    Since backprices and layprices build a new list each time, changes
+    made to that list (e.g. sel.backprices.append(...)) are lost; to
+    change the prices, assign a new list to the attribute.
+    """
+
+    __slots__ = ('name', 'id', 'mid', 'matchedback', 'matchedlay',
+                 'lastmatched', 'lastmatchedprice', 'lastmatchedamount',
+                 'src', 'wsn', 'status', '_back', '_lay', '_properties')
+
     def __init__(self, name, sid, marketid, mback, mlay, lastmatched,
                  lastmatchedprice, lastmatchedamount, backprices,
                  layprices, src, wsn, **kwargs):
 
         # convert name to ascii string, i.e. ignore any funky unicode
-        # characters.
-        self.name = name.encode('ascii', 'ignore')        
+        # characters (see _name).
+        self.name = _names.get(name) or _name(name)
         self.id = sid       # selection id
         self.mid = marketid # market id I belong to
         self.matchedback = mback        
@@ -82,13 +135,54 @@ class Selection(object):
         # selection reset count and withdrawal selection number
         self.src = src
         self.wsn = wsn
+        # BDAQ selection status (1 active, 2 inactive, 3 withdrawn,
+        # ...), if known.
+        self.status = kwargs.get('_Status')
 
-        # store all data from API
-        self.properties = kwargs
+        # store all data from API, if asked to.
+        self._properties = kwargs if const.SELECTIONPROPERTIES else None
+
+        # prices and stakes [p1, s1, p2, s2, ...]; backprices and
+        # layprices can be given in this form too.
+        self._back = _ladder(backprices)
+        self._lay = _ladder(layprices)
+
+    @property
+    def backprices(self):
+        """new list of back prices and stakes [(p1,s1), (p2,s2) ...,]"""
+        return _unladder(self._back)
+
+    @backprices.setter
+    def backprices(self, prices):
+        self._back = _ladder(prices)
 
-        # list of prices and stakes [(p1,s1), (p2,s2) ...,]
-        self.backprices = backprices
-        self.layprices = layprices
+    @property
+    def layprices(self):
+        """new list of lay prices and stakes [(p1,s1), (p2,s2) ...,]"""
+        return _unladder(self._lay)
+
+    @layprices.setter
+    def layprices(self, prices):
+        self._lay = _ladder(prices)
+
+    @property
+    def properties(self):
+        """
+        Data from the API (only the status, unless
+        const.SELECTIONPROPERTIES is True).
+        """
+        if self._properties is None:
+            self._properties = ({} if self.status is None
+                                else {'_Status': self.status})
+        return self._properties
+
+    def __getstate__(self):
+        return dict((a, getattr(self, a)) for a in self.__slots__
+                    if hasattr(self, a))
+
+    def __setstate__(self, state):
+        for (a, v) in state.iteritems():
+            setattr(self, a, v)
 
     def __repr__(self):
         return ' '.join([self.name, str(self.id)])
@@ -96,6 +190,55 @@ class Selection(object):
     def __str__(self):
         return self.__repr__()
     
+# compact representation of a selection, with the same fields (in the
+# same order) as the arguments of Selection.  These are returned by
+# api.GetPrices(mids, output='tuples').
+SelectionTuple = namedtuple('SelectionTuple',
+                            ['name', 'id', 'mid', 'matchedback',
+                             'matchedlay', 'lastmatched',
+                             'lastmatchedprice', 'lastmatchedamount',
+                             'backprices', 'layprices', 'src', 'wsn'])
+
+# market information, as returned by api.GetMarketInformation.
+# starttime is a naive UTC datetime, status the BDAQ market status (1
+# inactive, 2 active, 3 suspended, 4 withdrawn, 5 voided, 6 completed,
+# 8 settled, 9 balloted out), wsn the withdrawal sequence number and
+# selections a tuple of SelectionInfo.
+MarketInfo = namedtuple('MarketInfo',
+                        ['id', 'name', 'type', 'status', 'starttime',
+                         'inrunning', 'inrunningallowed',
+                         'inrunningdelay', 'wsn', 'nwinners', 'eid',
+                         'selections'])
+# the state of a market given in a GetPrices response (status and
+# inrunning as in MarketInfo), see api.GetPrices(mids, states=...).
+MarketState = namedtuple('MarketState',
+                         ['id', 'status', 'inrunning', 'wsn'])
+SelectionInfo = namedtuple('SelectionInfo',
+                           ['id', 'name', 'status', 'src',
+                            'deductionfactor', 'displayorder'])
+
+# a change to a selection, as returned by
+# api.ListSelectionsChangedSince.  status is the BDAQ selection status,
+# src the selection reset count, and seqnum the selection sequence
+# number of the change.
+SelectionChange = namedtuple('SelectionChange',
+                             ['id', 'mid', 'name', 'status', 'src',
+                              'withdrawalfactor', 'displayorder',
+                              'hidden', 'seqnum'])
+
+# changes between two polls of the prices of a selection (see
+# pricediff.py).  A LevelChange is a change of the stake available at
+# a price on side 'back' or 'lay': oldstake is 0.0 if the price is new,
+# and newstake 0.0 if the price has gone.  A MatchedChange is a change
+# of the amounts matched on the selection, and of the last match.
+LevelChange = namedtuple('LevelChange',
+                         ['sid', 'mid', 'side', 'price', 'oldstake',
+                          'newstake'])
+MatchedChange = namedtuple('MatchedChange',
+                           ['sid', 'mid', 'matchedback', 'matchedlay',
+                            'lastmatched', 'lastmatchedprice',
+                            'lastmatchedamount'])
+
 # BDAQ order _Status can be
 # 1 - Unmatched.  Order has SOME amount available for matching.
 # 2 - Matched (but not settled).
@@ -118,13 +261,27 @@ O_LAY = 2
 
 class Order(object):
     """Used to place an order, and returned after an order is placed."""
+
+    __slots__ = ('sid', 'stake', 'price', 'polarity', 'status',
+                 'cancelrunning', 'cancelreset', 'src', 'wsn', 'oref',
+                 'mid', 'matchedstake', 'unmatchedstake')
+    # the keyword arguments we accept (see below).
+    KWARGS = __slots__[4:]
+    _kwargs = frozenset(KWARGS)
     
     def __init__(self, sid, stake, price, polarity, **kwargs):
         """
         Create order from selection id, stake (in GBP), price (odds),
-        polarity (O_BACK or O_LAY).
+        polarity (O_BACK or O_LAY).  Since orders have no __dict__,
+        any other keyword argument must be one of Order.KWARGS.
         """
         
+        if not Order._kwargs.issuperset(kwargs):
+            raise TypeError('Order got unexpected keyword argument(s) {0}, '
+                            'allowed are {1}'.format(
+                                ', '.join(sorted(set(kwargs)
+                                                 - Order._kwargs)),
+                                ', '.join(Order.KWARGS)))
         self.sid = sid
         self.stake = stake
         self.price = price
@@ -153,9 +310,18 @@ class Order(object):
             # cancelreset    - default is True
             # src            - selection reset count
             # wsn            - withdrawal sequence number
+            # mid            - market id
             
             setattr(self, kw, kwargs[kw])
 
+    def __getstate__(self):
+        return dict((a, getattr(self, a)) for a in self.__slots__
+                    if hasattr(self, a))
+
+    def __setstate__(self, state):
+        for (a, v) in state.iteritems():
+            setattr(self, a, v)
+
     def __repr__(self):
         """Note we use dollar symbol rather than GBP symbol here."""
         return '{0} {1} ${2} {3}'.format('BACK' if self.polarity == 1
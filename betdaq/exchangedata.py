@@ -17,10 +17,10 @@
 """
 Odds ladder and some useful functions for these.  Note in principle
 the odds ladder can change and so this should be obtained from the
-Betdaq API (see the API docs).
+Betdaq API (see the API docs, and api.GetOddsLadder).
 """
 
-import math
+import bisect
 import const
 
 MINODDS = 1.0
@@ -42,40 +42,228 @@ MINODDSPLUS1 = 1.01
 # 52    200   2
 # 200   1000  5
 
+# the same increments, as (up to odds, increment), with everything in
+# hundredths so that the ladder is built with integer arithmetic.
+_INCREMENTS = [(300, 1), (400, 5), (600, 10), (1000, 20), (2000, 50),
+               (5000, 100), (20000, 200), (100000, 500)]
+
+def _key(price):
+    """
+    Return price in hundredths as an integer.  All odds on the
+    ladder have at most two decimal places, so this is exact for
+    prices on the ladder, and is safe to use as a dict key.
+    """
+
+    return int(round(price * 100))
+
+class OddsLadder(object):
+    """
+    The odds ladder, i.e. the sorted list of prices at which orders
+    may be placed.  Each price on the ladder has an integer tick
+    index, 0 for the shortest odds, so that the distance between two
+    prices in ticks, and the price n ticks away from a price, are
+    found by integer arithmetic rather than by stepping through the
+    ladder one tick at a time.
+
+    Prices returned are always exactly the floats of the ladder
+    (e.g. 3.05, never 3.0499999), so can be compared with == and used
+    as dict keys.
+    """
+
+    def __init__(self, prices):
+        """prices is a sequence of the prices on the ladder."""
+
+        self.keys = sorted(set(_key(p) for p in prices))
+        if not self.keys:
+            raise ValueError('odds ladder must have at least one price')
+        self.prices = [k / 100.0 for k in self.keys]
+        # tick index of each price, by key.
+        self.index = dict((k, i) for (i, k) in enumerate(self.keys))
+        # numpy array of keys, created if vectorized conversion is
+        # used (see ticks).
+        self._keyarray = None
+
+    @classmethod
+    def from_increments(cls, increments=_INCREMENTS, start=101):
+        """
+        Return ladder built from a list of (up to odds, increment),
+        in hundredths, starting from odds start (in hundredths).
+        """
+
+        keys = [start]
+        for (upto, inc) in increments:
+            while keys[-1] + inc <= upto:
+                keys.append(keys[-1] + inc)
+        return cls([k / 100.0 for k in keys])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, price):
+        return _key(price) in self.index
+
+    def __repr__(self):
+        return '<OddsLadder {0} ticks {1}-{2}>'.format(len(self.keys),
+                                                       self.prices[0],
+                                                       self.prices[-1])
+
+    @property
+    def minprice(self):
+        return self.prices[0]
+
+    @property
+    def maxprice(self):
+        return self.prices[-1]
+
+    def tick(self, price, rounding=None):
+        """
+        Return the tick index of price.  If price is not on the
+        ladder, rounding says what to do: None raises ValueError,
+        'down' gives the tick of the next shorter price on the
+        ladder, 'up' the next longer price and 'nearest' the nearest
+        price.  Prices off either end of the ladder give the tick of
+        the end of the ladder, unless rounding is None.
+        """
+
+        key = _key(price)
+        try:
+            return self.index[key]
+        except KeyError:
+            pass
+        if rounding is None:
+            raise ValueError('{0} is not on the odds ladder'.format(price))
+        i = bisect.bisect_left(self.keys, key)
+        # key is between self.keys[i - 1] and self.keys[i].
+        if i == 0:
+            return 0
+        if i == len(self.keys):
+            return i - 1
+        if rounding == 'down':
+            return i - 1
+        if rounding == 'up':
+            return i
+        if rounding == 'nearest':
+            if key - self.keys[i - 1] <= self.keys[i] - key:
+                return i - 1
+            return i
+        raise ValueError('rounding must be one of None, down, up, nearest')
+
+    def price(self, tick):
+        """
+        Return the price for tick index tick.  Raises IndexError if
+        tick is not on the ladder.
+        """
+
+        if tick < 0:
+            raise IndexError('tick {0} is not on the odds ladder'\
+                             .format(tick))
+        return self.prices[tick]
+
+    def round(self, price, rounding='nearest'):
+        """Return price rounded to the ladder (see tick)."""
+
+        return self.prices[self.tick(price, rounding)]
+
+    def distance(self, price1, price2):
+        """
+        Return the number of ticks from price1 to price2, which is
+        negative if price2 is shorter than price1.
+        """
+
+        return self.tick(price2) - self.tick(price1)
+
+    def offset(self, price, nticks):
+        """
+        Return the price nticks longer than price (shorter, if nticks
+        is negative), or None if this is off the end of the ladder.
+        If price is not on the ladder, we count from the next price on
+        the ladder in the direction we are moving.
+        """
+
+        key = _key(price)
+        if nticks > 0:
+            # tick of the longest price on the ladder <= price.
+            tick = bisect.bisect_right(self.keys, key) - 1 + nticks
+        elif nticks < 0:
+            # tick of the shortest price on the ladder >= price.
+            tick = bisect.bisect_left(self.keys, key) + nticks
+        else:
+            tick = self.tick(price)
+        if 0 <= tick < len(self.keys):
+            return self.prices[tick]
+        return None
+
+    def ticks(self, prices, rounding=None):
+        """
+        Return the tick indices of a sequence of prices (see tick).
+        If prices is a numpy array, the result is a numpy array of
+        integers, computed with a single vectorized search.
+        """
+
+        if type(prices).__module__ != 'numpy':
+            return [self.tick(p, rounding) for p in prices]
+
+        import numpy
+        if self._keyarray is None:
+            self._keyarray = numpy.array(self.keys, dtype=numpy.int64)
+        karr = self._keyarray
+        keys = numpy.rint(numpy.asarray(prices, dtype=float) * 100)\
+               .astype(numpy.int64)
+        i = numpy.searchsorted(karr, keys)
+        hi = numpy.minimum(i, len(karr) - 1)
+        exact = karr[hi] == keys
+        if rounding is None:
+            if not exact.all():
+                bad = numpy.asarray(prices)[~exact]
+                raise ValueError('{0} is not on the odds ladder'\
+                                 .format(bad[0]))
+            return hi
+        lo = numpy.maximum(i - 1, 0)
+        if rounding == 'down':
+            res = lo
+        elif rounding == 'up':
+            res = hi
+        elif rounding == 'nearest':
+            res = numpy.where(keys - karr[lo] <= karr[hi] - keys, lo, hi)
+        else:
+            raise ValueError('rounding must be one of None, down, up, '
+                             'nearest')
+        # prices off the ends of the ladder, and prices on it.
+        res = numpy.where(i == 0, 0, res)
+        res = numpy.where(i == len(karr), len(karr) - 1, res)
+        return numpy.where(exact, hi, res)
+
+    def prices_of(self, ticks):
+        """
+        Return the prices for a sequence of tick indices.  If ticks
+        is a numpy array, the result is a numpy array of floats.
+        """
+
+        if type(ticks).__module__ != 'numpy':
+            return [self.price(t) for t in ticks]
+
+        import numpy
+        return numpy.asarray(self.prices)[ticks]
+
+# the odds ladder as given above.  This is replaced by the ladder from
+# the Api when api.GetOddsLadder is called.
+LADDER = OddsLadder.from_increments()
+
 def next_shorter_odds(odds):
-    """Return odds one shorter (i.e. less in decimal) than odds."""
-    if odds <= 3:
-        return odds - 0.01
-    elif odds <= 4:
-        return odds - 0.05
-    elif odds <= 6:
-        return odds - 0.1
-    elif odds <= 10:
-        return odds - 0.2
-    elif odds <= 20:
-        return odds - 0.5
-    elif odds <= 50:
-        return odds - 1
-    elif odds <= 200:
-        return odds - 2
-    elif odds <= 1000:
-        return odds - 5
+    """
+    Return odds one shorter (i.e. less in decimal) than odds, or
+    MINODDS if odds is at the bottom of the ladder.
+    """
+
+    shorter = LADDER.offset(odds, -1)
+    if shorter is None:
+        return MINODDS
+    return shorter
 
 def next_longer_odds(odds):
-    """Return odds one longer (i.e. greater in decimal) than odds."""
-    if odds < 3 :
-        return odds + 0.01
-    elif odds < 4:
-        return odds + 0.05
-    elif odds < 6:
-        return odds + 0.1
-    elif odds < 10:
-        return odds + 0.2
-    elif odds < 20:
-        return odds + 0.5
-    elif odds < 50:
-        return odds + 1
-    elif odds < 200:
-        return odds + 2
-    elif odds < 1000:
-        return odds + 5
+    """
+    Return odds one longer (i.e. greater in decimal) than odds, or
+    None if odds is at the top of the ladder.
+    """
+
+    return LADDER.offset(odds, 1)
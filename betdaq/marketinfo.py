@@ -0,0 +1,169 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Read-through cache of market information (exchange.MarketInfo
+objects) by market id.
+
+Market ids that are not in the cache are fetched with
+GetMarketInformation.  Lookups from several threads at once are
+combined: one thread fetches all the market ids that are missing at
+the time, in batches of up to 50, while the other threads wait for
+it, and a market id that is already being fetched is never asked for
+twice.
+
+Entries expire after a time to live, and are invalidated when a
+market changes state (see check), e.g. when the selection store sees
+a withdrawal, or GetPrices returns a different market status.  Market
+ids that BDAQ does not know about are also cached (as not found) for
+the time to live, so that they are not asked for on every lookup.
+"""
+
+import time
+import threading
+import api
+import cache
+from apilog import apilog
+
+# cached for market ids that GetMarketInformation did not return.
+_NOTFOUND = object()
+
+class MarketInfoCache(object):
+    """MarketInfo objects by market id, fetched on demand."""
+
+    def __init__(self, ttl=60.0, maxentries=10000, window=0.0):
+        """
+        ttl is the time in seconds for which market information is
+        valid, maxentries the maximum number of markets to keep, and
+        window the time in seconds that the fetching thread waits to
+        collect market ids from other threads before sending a batch.
+        """
+
+        self.cache = cache.TTLCache(maxentries, ttl)
+        self.window = window
+        self.lock = threading.Lock()
+        # market ids waiting to be fetched, and an event (set when the
+        # market id has been fetched) for each market id waiting or
+        # being fetched.
+        self.queue = []
+        self.inflight = {}
+        # is a thread fetching the queue?
+        self.fetching = False
+        # number of GetMarketInformation calls made.
+        self.calls = 0
+
+    def get(self, mids):
+        """
+        Return list of MarketInfo objects for market ids mids, with
+        None for any market BDAQ does not know about.
+        """
+
+        infos = [self.cache.get(mid) for mid in mids]
+        missing = [mid for (mid, info) in zip(mids, infos) if info is None]
+        if not missing:
+            return [_found(info) for info in infos]
+
+        events = []
+        with self.lock:
+            for mid in missing:
+                ev = self.inflight.get(mid)
+                if ev is None:
+                    ev = threading.Event()
+                    self.inflight[mid] = ev
+                    self.queue.append(mid)
+                events.append(ev)
+            leader = not self.fetching
+            if leader:
+                self.fetching = True
+        if leader:
+            self._fetch()
+        for ev in events:
+            ev.wait()
+
+        return [_found(info if info is not None else self.cache.get(mid))
+                for (mid, info) in zip(mids, infos)]
+
+    def _fetch(self):
+        """Fetch queued market ids until the queue is empty."""
+
+        if self.window > 0:
+            time.sleep(self.window)
+        while True:
+            with self.lock:
+                mids = self.queue
+                self.queue = []
+                if not mids:
+                    self.fetching = False
+                    return
+            try:
+                self.calls += 1
+                found = set()
+                for info in api.GetMarketInformation(mids):
+                    self.cache.put(info.id, info)
+                    found.add(info.id)
+                for mid in mids:
+                    if mid not in found:
+                        self.cache.put(mid, _NOTFOUND)
+            except Exception, e:
+                # waiting threads get None for these markets.
+                apilog.error('GetMarketInformation failed for market ids '
+                             '{0}: {1}'.format(mids, e))
+            finally:
+                with self.lock:
+                    for mid in mids:
+                        self.inflight.pop(mid).set()
+
+    def invalidate(self, mids):
+        """Remove the market information for market ids mids."""
+
+        self.cache.invalidate(mids)
+
+    def check(self, mid, status=None, inrunning=None, wsn=None):
+        """
+        Invalidate the market information for market id mid if it
+        does not match the status, in running flag or withdrawal
+        sequence number given (e.g. from a GetPrices response).
+        """
+
+        info = self.cache.get(mid)
+        if info is None:
+            return
+        # a market we cached as not found has since been seen.
+        if (info is _NOTFOUND or
+            (status is not None and status != info.status) or
+            (inrunning is not None and inrunning != info.inrunning) or
+            (wsn is not None and wsn != info.wsn)):
+            self.cache.invalidate([mid])
+
+    def stats(self):
+        """Return dict of cache statistics and number of Api calls."""
+
+        stats = self.cache.stats()
+        stats['calls'] = self.calls
+        return stats
+
+def _found(info):
+    """Return info, or None if it is the not found marker."""
+
+    return None if info is _NOTFOUND else info
+
+# cache used by get (and invalidated by the selection store).
+marketcache = MarketInfoCache()
+
+def get(mids):
+    """Return list of MarketInfo objects for market ids mids (cached)."""
+
+    return marketcache.get(mids)
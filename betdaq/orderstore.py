@@ -0,0 +1,181 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+The orders of a session (i.e. of one ApiClient, and so one Betdaq
+account), kept up to date in place by ListBootstrapOrders,
+ListOrdersChangedSince, PlaceOrdersNoReceipt and CancelOrders.  Each
+ApiClient has its own OrderStore (ApiClient.orders), which also holds
+the order sequence number used by ListBootstrapOrders and
+ListOrdersChangedSince.
+
+Orders are indexed by order ref, selection id, market id and status,
+and the unmatched stake is totalled by selection and polarity, so all
+of these are lookups rather than scans through the orders.
+"""
+
+import threading
+from exchange import O_UNMATCHED
+
+class OrderStore(object):
+    """Orders of a session, indexed by oref, sid, mid and status."""
+
+    # attributes of an Order that are updated by a newer copy of the
+    # order from the Api.
+    _FIELDS = ('sid', 'mid', 'stake', 'price', 'polarity', 'status',
+               'matchedstake', 'unmatchedstake')
+
+    def __init__(self):
+        # order sequence number from ListBootstrapOrders or
+        # ListOrdersChangedSince; -1 until we have bootstrapped.
+        self.seqnum = -1
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Remove all orders (but keep the sequence number)."""
+
+        with self.lock:
+            # order by oref, and dicts from oref to order by selection
+            # id, market id and status.
+            self.orders = {}
+            self.bysid = {}
+            self.bymid = {}
+            self.bystatus = {}
+            # total unmatched stake of unmatched orders by (selection
+            # id, polarity).
+            self.unmatched = {}
+            # keys each order is indexed under, by oref.
+            self.keys = {}
+
+    def __len__(self):
+        return len(self.orders)
+
+    def __contains__(self, oref):
+        return oref in self.orders
+
+    def __getitem__(self, oref):
+        return self.orders[oref]
+
+    def __iter__(self):
+        return iter(self.orders.values())
+
+    def _index(self, o):
+        oref = o.oref
+        key = (o.sid, getattr(o, 'mid', None), o.status, o.polarity,
+               getattr(o, 'unmatchedstake', o.stake))
+        self.keys[oref] = key
+        (sid, mid, status, polarity, ustake) = key
+        self.bysid.setdefault(sid, {})[oref] = o
+        self.bymid.setdefault(mid, {})[oref] = o
+        self.bystatus.setdefault(status, {})[oref] = o
+        if status == O_UNMATCHED:
+            self.unmatched[(sid, polarity)] = \
+                self.unmatched.get((sid, polarity), 0.0) + ustake
+
+    def _unindex(self, oref):
+        # we use the keys the order was indexed with, since the order
+        # may since have been changed (e.g. ParseCancelOrders sets the
+        # status of the orders passed to it).
+        (sid, mid, status, polarity, ustake) = self.keys.pop(oref)
+        for (index, key) in ((self.bysid, sid), (self.bymid, mid),
+                             (self.bystatus, status)):
+            orders = index[key]
+            del orders[oref]
+            if not orders:
+                del index[key]
+        if status == O_UNMATCHED:
+            total = self.unmatched[(sid, polarity)] - ustake
+            if abs(total) < 1e-9:
+                del self.unmatched[(sid, polarity)]
+            else:
+                self.unmatched[(sid, polarity)] = total
+
+    def update(self, orders):
+        """
+        Add or update orders from a list (or dict by oref) of Order
+        objects, all of which must have an oref.  An order we already
+        have is updated in place, so that references to it held
+        elsewhere stay current.  Returns dict of the stored orders by
+        oref.
+        """
+
+        if isinstance(orders, dict):
+            orders = orders.values()
+        updated = {}
+        with self.lock:
+            for o in orders:
+                mine = self.orders.get(o.oref)
+                if mine is None:
+                    mine = o
+                    self.orders[o.oref] = o
+                else:
+                    self._unindex(o.oref)
+                    if mine is not o:
+                        for attr in OrderStore._FIELDS:
+                            if hasattr(o, attr):
+                                setattr(mine, attr, getattr(o, attr))
+                self._index(mine)
+                updated[o.oref] = mine
+        return updated
+
+    def set_status(self, orefs, status):
+        """
+        Set the status of the orders with order refs orefs (those we
+        don't have are ignored), and return list of these orders.
+        """
+
+        orders = []
+        with self.lock:
+            for oref in orefs:
+                o = self.orders.get(oref)
+                if o is not None:
+                    self._unindex(oref)
+                    o.status = status
+                    self._index(o)
+                    orders.append(o)
+        return orders
+
+    def remove(self, orefs):
+        """Remove the orders with order refs orefs."""
+
+        with self.lock:
+            for oref in orefs:
+                if self.orders.pop(oref, None) is not None:
+                    self._unindex(oref)
+
+    def by_selection(self, sid):
+        """Return list of orders on selection id sid."""
+
+        return self.bysid.get(sid, {}).values()
+
+    def by_market(self, mid):
+        """Return list of orders on market id mid."""
+
+        return self.bymid.get(mid, {}).values()
+
+    def by_status(self, status):
+        """Return list of orders with status (e.g. O_UNMATCHED)."""
+
+        return self.bystatus.get(status, {}).values()
+
+    def unmatched_stake(self, sid, polarity):
+        """
+        Return the total unmatched stake of unmatched orders on
+        selection id sid with polarity (O_BACK or O_LAY).
+        """
+
+        return self.unmatched.get((sid, polarity), 0.0)
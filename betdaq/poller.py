@@ -0,0 +1,353 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Polling the prices of many markets, each as often as it needs.
+
+Each market is polled at an interval given by a policy function (by
+default, every second for markets in running or about to start, down
+to every five minutes for markets more than a day away).  The poller
+keeps the time each market is next due; whenever some are due it
+fetches the most overdue of them with a call to api.GetPrices, and
+fills up the last chunk of 50 with markets that are nearly due, so
+that no Api call is wasted on a half empty chunk.  Each call only
+takes as many chunks as the GetPrices rate limit (see ratelimit.py)
+allows straight away (at least one, and at most one per worker), and
+the rest are picked again from the markets due after the call.  So
+when more markets are due than the rate limit allows, e.g. at
+startup, no single call waits for the whole backlog, and markets
+that fall due meanwhile (such as markets in running) take their
+turn by how overdue they are.
+
+The state of each market (in running, status and withdrawal sequence
+number) is refreshed from every GetPrices response, so a market that
+goes in running is polled at the in running interval from its next
+poll on.
+
+The prices of each market are published to subscribers, either by
+calling a function or by putting them on a queue.
+"""
+
+import time
+import heapq
+import datetime
+import threading
+import Queue
+import api
+import marketinfo
+import ratelimit
+from exchange import MarketInfo
+from util import suds_utc
+from apilog import apilog
+
+# polling interval (seconds) for markets in running, for markets
+# starting within the given number of seconds, and for all others.
+INRUNNING_INTERVAL = 1.0
+INTERVALS = [(600, 1.0), (3600, 5.0), (86400, 30.0)]
+DEFAULT_INTERVAL = 300.0
+
+def _starttime(market):
+    """Return start time of Market or MarketInfo as naive UTC, or None."""
+
+    start = getattr(market, 'starttime', None)
+    if start is not None:
+        # MarketInfo start times are UTC already.
+        return start
+    # the properties of a Market are as SUDS unmarshalled them.
+    return suds_utc(getattr(market, 'properties', {}).get('_StartTime'))
+
+def default_policy(market, now):
+    """
+    Return the time in seconds between polls of market (a Market or
+    MarketInfo object), now being the current (naive UTC) datetime.
+    """
+
+    if market.inrunning:
+        return INRUNNING_INTERVAL
+    start = _starttime(market)
+    if start is None:
+        return DEFAULT_INTERVAL
+    secs = (start - now).total_seconds()
+    for (before, interval) in INTERVALS:
+        if secs < before:
+            return interval
+    return DEFAULT_INTERVAL
+
+class Poller(object):
+    """Polls markets at intervals, and publishes their prices."""
+
+    # maximum number of market ids in a GetPrices Api call.
+    CHUNK = 50
+
+    def __init__(self, policy=default_policy, prefetch=0.5, workers=1,
+                 output='selections'):
+        """
+        policy(market, now) gives the polling interval of a market,
+        prefetch is the fraction of its interval that a market may be
+        polled early to fill up a chunk, and workers and output are
+        passed to api.GetPrices.  output can't be 'columns', since
+        the prices are given to the subscribers market by market.
+        """
+
+        if output == 'columns':
+            raise ValueError("the poller can't use output 'columns', use "
+                             "'selections' or 'tuples'")
+        self.policy = policy
+        self.prefetch = prefetch
+        self.workers = workers
+        self.output = output
+        # market objects, polling interval and time next due, by
+        # market id, and heap of (time due, market id).  Entries in
+        # the heap that don't match self.due are stale and skipped.
+        self.markets = {}
+        self.intervals = {}
+        self.overrides = {}
+        self.due = {}
+        self.heap = []
+        # (callback or queue, set of market ids or None for all).
+        self.subscribers = []
+        self.lock = threading.RLock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        # statistics: number of GetPrices calls and markets polled.
+        self.calls = 0
+        self.polled = 0
+
+    def __len__(self):
+        return len(self.markets)
+
+    def add_markets(self, markets):
+        """
+        Poll markets, which can be Market or MarketInfo objects, or
+        market ids (whose MarketInfo is looked up, see marketinfo.py).
+        They are first polled straight away.
+        """
+
+        mids = [m for m in markets if isinstance(m, (int, long))]
+        if mids:
+            infos = dict(zip(mids, marketinfo.get(mids)))
+            markets = [infos.get(m, m) if isinstance(m, (int, long)) else m
+                       for m in markets]
+        now = time.time()
+        with self.lock:
+            for m in markets:
+                if isinstance(m, (int, long)):
+                    apilog.warning('no market information for market id {0}'
+                                   .format(m))
+                    continue
+                self.markets[m.id] = m
+                self._schedule(m.id, now)
+        self.wake.set()
+
+    def remove_markets(self, mids):
+        """Stop polling market ids mids."""
+
+        with self.lock:
+            for mid in mids:
+                self.markets.pop(mid, None)
+                self.intervals.pop(mid, None)
+                self.overrides.pop(mid, None)
+                self.due.pop(mid, None)
+
+    def set_interval(self, mid, interval):
+        """
+        Poll market id mid every interval seconds, rather than as
+        given by the policy (or by the policy again, if None).
+        """
+
+        with self.lock:
+            if interval is None:
+                self.overrides.pop(mid, None)
+            else:
+                self.overrides[mid] = interval
+            if mid in self.markets:
+                self._schedule(mid, time.time())
+        self.wake.set()
+
+    def interval(self, mid):
+        """Return the polling interval of market id mid."""
+
+        if mid in self.overrides:
+            return self.overrides[mid]
+        return self.policy(self.markets[mid], datetime.datetime.utcnow())
+
+    def _schedule(self, mid, due, interval=None):
+        if interval is None:
+            interval = self.interval(mid)
+        self.intervals[mid] = interval
+        self.due[mid] = due
+        heapq.heappush(self.heap, (due, mid))
+
+    def _update_market(self, state):
+        """Refresh a market from its exchange.MarketState."""
+
+        market = self.markets.get(state.id)
+        if isinstance(market, MarketInfo):
+            self.markets[state.id] = market._replace(
+                status=state.status, inrunning=state.inrunning,
+                wsn=state.wsn)
+        elif market is not None:
+            market.inrunning = state.inrunning
+
+    def subscribe(self, callback=None, mids=None):
+        """
+        Publish the prices of market ids mids (by default, all
+        markets) as (market id, prices): by calling callback(mid,
+        prices), or if callback is None, by putting them on a queue,
+        which is returned.
+        """
+
+        target = callback if callback is not None else Queue.Queue()
+        with self.lock:
+            self.subscribers.append((target, None if mids is None
+                                     else set(mids)))
+        return target
+
+    def unsubscribe(self, target):
+        """Stop publishing to callback or queue target."""
+
+        with self.lock:
+            self.subscribers = [(t, m) for (t, m) in self.subscribers
+                                if t is not target]
+
+    def next_due(self):
+        """Return time at which the next market is due, or None."""
+
+        with self.lock:
+            while self.heap:
+                (due, mid) = self.heap[0]
+                if self.due.get(mid) == due:
+                    return due
+                heapq.heappop(self.heap)
+        return None
+
+    def maxchunks(self):
+        """
+        Return the number of chunks of CHUNK markets to fetch in the
+        next call: those the GetPrices rate limit allows now, but at
+        least one and at most one per worker.
+        """
+
+        free = ratelimit.limiter.available('GetPrices')
+        if free is None:
+            return self.workers
+        return max(1, min(free, self.workers))
+
+    def take_due(self, now=None, maxchunks=None):
+        """
+        Return list of the market ids due at time now, most overdue
+        first, topped up to a multiple of CHUNK with markets due
+        within prefetch of their interval.  At most maxchunks chunks
+        are taken (by default, all of the markets due).
+        """
+
+        now = time.time() if now is None else now
+        limit = None if maxchunks is None else maxchunks * self.CHUNK
+        mids = []
+        with self.lock:
+            heap = self.heap
+            while heap and len(mids) != limit:
+                (due, mid) = heap[0]
+                if self.due.get(mid) != due:
+                    heapq.heappop(heap)
+                    continue
+                if due > now:
+                    if len(mids) % self.CHUNK == 0:
+                        break
+                    if due - now > self.prefetch * self.intervals[mid]:
+                        break
+                heapq.heappop(heap)
+                del self.due[mid]
+                mids.append(mid)
+        return mids
+
+    def poll(self, now=None):
+        """
+        Poll the markets that are due (as many as the rate limit
+        allows now, see maxchunks); return number polled.
+        """
+
+        mids = self.take_due(now, self.maxchunks())
+        if not mids:
+            return 0
+        states = {}
+        try:
+            self.calls += (len(mids) + self.CHUNK - 1) // self.CHUNK
+            prices = api.GetPrices(mids, self.workers, True, self.output,
+                                   states)
+        except Exception, e:
+            apilog.error('polling GetPrices failed: {0}'.format(e))
+            prices = [None] * len(mids)
+        done = time.time()
+        with self.lock:
+            for mid in mids:
+                if mid in self.markets and mid not in self.due:
+                    if mid in states:
+                        self._update_market(states[mid])
+                    # the interval from the market as it is now.
+                    interval = self.interval(mid)
+                    self._schedule(mid, done + interval, interval)
+            subscribers = list(self.subscribers)
+        for (mid, sels) in zip(mids, prices):
+            if sels is None:
+                continue
+            self.polled += 1
+            for (target, smids) in subscribers:
+                if smids is not None and mid not in smids:
+                    continue
+                try:
+                    if isinstance(target, Queue.Queue):
+                        target.put((mid, sels))
+                    else:
+                        target(mid, sels)
+                except Exception, e:
+                    apilog.error('price subscriber failed for market id '
+                                 '{0}: {1}'.format(mid, e))
+        return len(mids)
+
+    def run(self):
+        """Poll markets as they become due, until stop is called."""
+
+        while not self.stopped.is_set():
+            due = self.next_due()
+            wait = None if due is None else due - time.time()
+            if wait is None or wait > 0:
+                self.wake.wait(wait)
+                self.wake.clear()
+                continue
+            try:
+                self.poll()
+            except Exception, e:
+                # keep polling: the markets are rescheduled by poll.
+                apilog.error('polling failed: {0}'.format(e))
+
+    def start(self):
+        """Start polling in a (daemon) thread."""
+
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name='poller')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop polling, and wait for the polling thread to finish."""
+
+        self.stopped.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,165 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Changes to prices between successive calls to GetPrices.
+
+Most selections don't change from one poll to the next, so rather
+than every consumer going through every ladder, a PriceDiffer keeps
+the last ladders seen for each selection and returns only what has
+changed: exchange.LevelChange for each price whose stake changed (or
+that appeared or disappeared), and exchange.MatchedChange when the
+matched amounts or last match changed.
+
+The ladders are kept as the flat arrays of doubles that Selection
+objects store them in (see exchange.py), so that an unchanged
+selection costs a single array comparison.  A selection missing from
+the latest poll of its market (e.g. one that has been withdrawn) is
+forgotten, so that the state only holds selections still polled.
+"""
+
+import threading
+import api
+from exchange import Selection, LevelChange, MatchedChange, _ladder
+
+# ladder of a selection we haven't seen before.
+_EMPTY = _ladder([])
+
+def _levels(sid, mid, side, old, new, changes):
+    """Add LevelChange for each difference between ladders old and new."""
+
+    oldstakes = dict(zip(old[0::2], old[1::2]))
+    for (price, stake) in zip(new[0::2], new[1::2]):
+        ostake = oldstakes.pop(price, 0.0)
+        if stake != ostake:
+            changes.append(LevelChange(sid, mid, side, price, ostake, stake))
+    for (price, ostake) in oldstakes.iteritems():
+        changes.append(LevelChange(sid, mid, side, price, ostake, 0.0))
+
+class PriceDiffer(object):
+    """Previous prices by selection id, and the changes from them."""
+
+    def __init__(self):
+        # (back ladder, lay ladder, matched details) by selection id,
+        # and set of the selection ids in the last poll by market id.
+        self.state = {}
+        self.markets = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.state)
+
+    def diff(self, allselections, mids=None):
+        """
+        Return list of the changes (LevelChange and MatchedChange) in
+        allselections, as returned by api.GetPrices (with output
+        'selections' or 'tuples'), since the last call.  Every price
+        of a selection we haven't seen before is a LevelChange.  mids
+        are the market ids of allselections; without them, a market
+        with no selections at all can't be told apart from one that
+        wasn't polled, so its selections are not forgotten.
+        """
+
+        changes = []
+        with self.lock:
+            state = self.state
+            for (i, sels) in enumerate(allselections):
+                # markets that could not be fetched are None.
+                if sels is None:
+                    continue
+                # have we seen a selection of this market that we
+                # didn't know about?
+                added = False
+                for sel in sels:
+                    if type(sel) is Selection:
+                        back = sel._back
+                        lay = sel._lay
+                    else:
+                        back = _ladder(sel.backprices)
+                        lay = _ladder(sel.layprices)
+                    matched = (sel.matchedback, sel.matchedlay,
+                               sel.lastmatched, sel.lastmatchedprice,
+                               sel.lastmatchedamount)
+                    old = state.get(sel.id)
+                    state[sel.id] = (back, lay, matched)
+                    if old is None:
+                        added = True
+                        old = (_EMPTY, _EMPTY, None)
+                    elif old[0] == back and old[1] == lay and \
+                         old[2] == matched:
+                        continue
+                    if old[0] != back:
+                        _levels(sel.id, sel.mid, 'back', old[0], back,
+                                changes)
+                    if old[1] != lay:
+                        _levels(sel.id, sel.mid, 'lay', old[1], lay,
+                                changes)
+                    if old[2] != matched:
+                        changes.append(MatchedChange(sel.id, sel.mid,
+                                                     *matched))
+                if mids is not None:
+                    mid = mids[i]
+                else:
+                    mid = sels[0].mid if sels else None
+                if mid is None:
+                    continue
+                # if no selection is new and there are as many as last
+                # time, the market has the same selections.
+                known = self.markets.get(mid)
+                if added or known is None or len(known) != len(sels):
+                    self._prune(mid, set([sel.id for sel in sels]))
+        return changes
+
+    def _prune(self, mid, sids):
+        """
+        Forget the selections of market id mid that are not in sids,
+        the selection ids of its latest poll.
+        """
+
+        old = self.markets.get(mid)
+        if old is not None and old != sids:
+            for sid in old - sids:
+                self.state.pop(sid, None)
+        self.markets[mid] = sids
+
+    def poll(self, mids, **kwargs):
+        """
+        Call api.GetPrices(mids, **kwargs), and return (the result,
+        list of changes since the last call).  output can't be
+        'columns', since the changes are found selection by selection.
+        """
+
+        if kwargs.get('output') == 'columns':
+            raise ValueError("PriceDiffer can't use output 'columns', use "
+                             "'selections' or 'tuples'")
+        allselections = api.GetPrices(mids, **kwargs)
+        return (allselections, self.diff(allselections, mids))
+
+    def remove(self, sids):
+        """Forget the prices of selection ids sids."""
+
+        with self.lock:
+            for sid in sids:
+                self.state.pop(sid, None)
+            for msids in self.markets.itervalues():
+                msids.difference_update(sids)
+
+    def clear(self):
+        """Forget all prices, so that the next diff reports everything."""
+
+        with self.lock:
+            self.state.clear()
+            self.markets.clear()
@@ -0,0 +1,146 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Rate limiting for calls to the Betdaq API.  Each API method has its
+own token bucket, and the buckets are shared by every caller in the
+process (i.e. by both the 'readonly' and the 'secure' clients), so
+that we only block when the exchange limits would be exceeded.
+"""
+
+import time
+import threading
+import const
+
+class TokenBucket(object):
+    """
+    Token bucket allowing bursts of up to 'calls' calls, refilled at
+    an average rate of 'calls' per 'period' seconds.
+    """
+
+    def __init__(self, calls, period):
+        if calls <= 0 or period <= 0:
+            raise ValueError('calls and period must be positive')
+        self.capacity = float(calls)
+        # tokens added per second
+        self.rate = self.capacity / period
+        self.tokens = self.capacity
+        self.last = time.time()
+        self.lock = threading.Lock()
+        # statistics: number of calls and total time spent waiting
+        self.ncalls = 0
+        self.waited = 0.0
+
+    def reserve(self, tokens=1):
+        """
+        Take tokens from the bucket and return the time in seconds the
+        caller must wait before making the call.  The tokens are taken
+        immediately, so that concurrent callers queue up behind each
+        other rather than all waking at the same time.
+        """
+
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                wait = 0.0
+            else:
+                wait = -self.tokens / self.rate
+            self.ncalls += 1
+            self.waited += wait
+        return wait
+
+    def available(self):
+        """Return number of calls that can be made now without waiting."""
+
+        with self.lock:
+            tokens = min(self.capacity, self.tokens +
+                         (time.time() - self.last) * self.rate)
+        return max(0, int(tokens))
+
+    def acquire(self, tokens=1):
+        """Block until the call is allowed, return time waited."""
+
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+class RateLimiter(object):
+    """Collection of token buckets, keyed by API method name."""
+
+    def __init__(self, limits=None):
+        """limits is a dict mapping method name to (calls, period)."""
+
+        self.buckets = {}
+        self.lock = threading.Lock()
+        if limits:
+            for (name, (calls, period)) in limits.items():
+                self.set_limit(name, calls, period)
+
+    def set_limit(self, name, calls, period):
+        """Allow 'calls' calls to method name every 'period' seconds."""
+
+        with self.lock:
+            self.buckets[name] = TokenBucket(calls, period)
+
+    def remove_limit(self, name):
+        """Stop rate limiting calls to method name."""
+
+        with self.lock:
+            self.buckets.pop(name, None)
+
+    def reserve(self, name):
+        """
+        Reserve a call to method name and return the time in seconds
+        to wait before making it (see TokenBucket.reserve).
+        """
+
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            return 0.0
+        return bucket.reserve()
+
+    def available(self, name):
+        """
+        Return number of calls to method name that can be made now
+        without waiting, or None if there is no limit.
+        """
+
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            return None
+        return bucket.available()
+
+    def acquire(self, name):
+        """Block until a call to method name is allowed, return time waited."""
+
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            return 0.0
+        return bucket.acquire()
+
+    def stats(self):
+        """Return dict of method name -> (number of calls, total wait)."""
+
+        return dict((name, (b.ncalls, b.waited))
+                    for (name, b) in self.buckets.items())
+
+# the limiter used by all of the Api methods (see apimethod.py).
+limiter = RateLimiter(const.RATELIMITS)
@@ -0,0 +1,151 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Moving the unmatched orders on some selections to a target set of
+orders with as few changes as possible.
+
+For each selection and polarity, the unmatched orders in the order
+store are matched against the target orders:
+
+* an order at the target price with the target stake is left alone;
+* an order at the target price with a different stake has its stake
+  updated;
+* any other orders are paired with the remaining targets (in order of
+  price) and have their price (and stake) updated, which is one call
+  rather than a cancel and a place;
+* targets left over are placed, and orders left over are cancelled.
+
+The changes are then sent batched by type: CancelOrders,
+UpdateOrdersNoReceipt and PlaceOrdersNoReceipt calls of up to 50
+orders each.  Planning doesn't change the orders in the store; they
+are only changed by the Api functions once the changes are made.
+"""
+
+from collections import namedtuple
+import api
+from exchange import O_UNMATCHED
+
+# the changes needed: list of Order objects to place, list of (order,
+# new price, change in stake, expected reset count, expected
+# withdrawal sequence number) to update, and list of Order objects to
+# cancel.
+Plan = namedtuple('Plan', ['place', 'update', 'cancel'])
+
+def _pkey(price):
+    return int(round(price * 100))
+
+def _skey(stake):
+    return int(round(stake * 100))
+
+def _ustake(o):
+    return getattr(o, 'unmatchedstake', o.stake)
+
+def _match(want, have, plan):
+    """
+    Add the changes needed to move orders have to orders want, all
+    on the same selection and with the same polarity, to plan.
+    """
+
+    # orders exactly as we want them.
+    exact = {}
+    for o in have:
+        exact.setdefault((_pkey(o.price), _skey(_ustake(o))), []).append(o)
+    rest = []
+    for t in want:
+        same = exact.get((_pkey(t.price), _skey(t.stake)))
+        if same:
+            same.pop()
+        else:
+            rest.append(t)
+    have = [o for orders in exact.itervalues() for o in orders]
+    want = rest
+
+    # orders at the price we want, but with the wrong stake.
+    byprice = {}
+    for o in have:
+        byprice.setdefault(_pkey(o.price), []).append(o)
+    rest = []
+    for t in want:
+        same = byprice.get(_pkey(t.price))
+        if same:
+            o = same.pop()
+            plan.update.append((o, t.price, t.stake - _ustake(o),
+                                t.src, t.wsn))
+        else:
+            rest.append(t)
+    have = sorted([o for orders in byprice.itervalues() for o in orders],
+                  key=lambda o: o.price)
+    want = sorted(rest, key=lambda t: t.price)
+
+    # everything else: move orders to the remaining prices, then place
+    # or cancel what is left.
+    for (o, t) in zip(have, want):
+        plan.update.append((o, t.price, t.stake - _ustake(o), t.src,
+                            t.wsn))
+    n = min(len(have), len(want))
+    plan.place.extend(want[n:])
+    plan.cancel.extend(have[n:])
+
+def plan_orders(targets, store=None):
+    """
+    Return Plan of the changes needed so that the unmatched orders in
+    the order store (by default that of the api module) on each
+    selection are the target orders.  targets is a dict from selection
+    id to list of Order objects; selections not in targets are left
+    alone, and an empty list means cancel all orders on the selection.
+
+    Orders that are to be updated expect the reset count and
+    withdrawal sequence number of their targets, which are in the
+    update entries of the plan (see UpdateOrdersNoReceipt).
+    """
+
+    if store is None:
+        store = api.orders()
+    plan = Plan([], [], [])
+    with store.lock:
+        for (sid, wanted) in targets.iteritems():
+            live = [o for o in store.by_selection(sid)
+                    if o.status == O_UNMATCHED]
+            for pol in set([o.polarity for o in wanted + live]):
+                _match([t for t in wanted if t.polarity == pol],
+                       [o for o in live if o.polarity == pol], plan)
+    return plan
+
+def execute(plan, workers=1):
+    """
+    Send the changes in plan: first the cancels, then the updates,
+    then the new orders (using up to workers threads, see
+    api.PlaceOrdersNoReceipt).  Return dict with keys 'cancel',
+    'update' and 'place' of the results of the Api functions.
+    """
+
+    result = {'cancel': [], 'update': {}, 'place': {}}
+    if plan.cancel:
+        result['cancel'] = api.CancelOrders(plan.cancel)
+    if plan.update:
+        result['update'] = api.UpdateOrdersNoReceipt(plan.update)
+    if plan.place:
+        result['place'] = api.PlaceOrdersNoReceipt(plan.place, workers)
+    return result
+
+def reconcile(targets, workers=1):
+    """
+    Move the unmatched orders of the api module's session to targets
+    (see plan_orders), and return the result of execute.
+    """
+
+    return execute(plan_orders(targets), workers)
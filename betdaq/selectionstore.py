@@ -0,0 +1,218 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+A local store of the selections for a set of markets, whose details
+(name, status, reset count, display order and withdrawal factor) are
+kept up to date from the changes returned by
+ListSelectionsChangedSince, rather than by calling GetPrices for every
+market every time.
+
+ListSelectionsChangedSince says nothing about prices, so the prices,
+matched amounts and last matched price of a selection are only as
+fresh as the last GetPrices of its market: when the market was
+fetched as stale (see below), or when it was last fetched because its
+prices were older than maxage seconds, if given.  For prices that are
+always current, poll them (see poller.py) instead.
+
+Every change to a selection on the exchange is given the next
+selection sequence number.  The store remembers the sequence number it
+is up to date with, and each update asks the Api only for the changes
+since then.  Changes that don't affect prices (e.g. the name or
+display order) are applied to the stored Selection objects directly;
+a change of reset count or status (e.g. a withdrawal, which also
+changes the market withdrawal sequence number) means the market is
+stale, and only stale markets are fetched again with GetPrices.
+
+If the changes we get back are not numbered consecutively from our
+sequence number, we have missed some, and the store bootstraps again.
+"""
+
+import time
+import threading
+import api
+import marketinfo
+from exchange import _name
+from apiexception import ApiError
+from apilog import apilog
+
+class SelectionStore(object):
+    """
+    Selection objects for the markets in self.mids, by selection
+    id.  Call update() to bring the store up to date.
+    """
+
+    # should selection sequence numbers of consecutive changes differ
+    # by exactly one?  If so, anything else is treated as a gap.
+    CONTIGUOUS = True
+
+    def __init__(self, mids=None, maxage=None):
+        """
+        mids is the list of market ids to keep selections for, and
+        maxage the age in seconds at which the prices of a market are
+        fetched again by update (by default, never).
+        """
+
+        self.mids = []
+        # selections by selection id, and list of selection ids (in
+        # the order given by GetPrices) by market id.
+        self.selections = {}
+        self.markets = {}
+        # selection sequence number we are up to date with, None until
+        # we have bootstrapped.
+        self.seqnum = None
+        # market ids that need to be fetched again with GetPrices, and
+        # the time each market was last fetched.
+        self.stale = set()
+        self.maxage = maxage
+        self.fetched = {}
+        # number of times we bootstrapped because of a gap.
+        self.resyncs = 0
+        self.lock = threading.RLock()
+        self.add_markets(mids or [])
+
+    def __len__(self):
+        return len(self.selections)
+
+    def __contains__(self, sid):
+        return sid in self.selections
+
+    def __getitem__(self, sid):
+        return self.selections[sid]
+
+    def market(self, mid):
+        """Return list of Selection objects for market id mid."""
+
+        return [self.selections[sid] for sid in self.markets.get(mid, [])]
+
+    def add_markets(self, mids):
+        """Track market ids mids; these are fetched on the next update."""
+
+        with self.lock:
+            for mid in mids:
+                if mid not in self.markets:
+                    self.mids.append(mid)
+                    self.markets[mid] = []
+                    self.stale.add(mid)
+
+    def remove_markets(self, mids):
+        """Stop tracking market ids mids."""
+
+        with self.lock:
+            for mid in mids:
+                if mid in self.markets:
+                    self.mids.remove(mid)
+                    for sid in self.markets.pop(mid):
+                        del self.selections[sid]
+                    self.stale.discard(mid)
+                    self.fetched.pop(mid, None)
+
+    def bootstrap(self):
+        """Fetch all of the markets, and the current sequence number."""
+
+        with self.lock:
+            # we get the sequence number before the prices, so that
+            # any change made while we get the prices is in the next
+            # update.
+            self.seqnum = api.GetCurrentSelectionSequenceNumber()
+            self.stale.update(self.mids)
+            self.refresh()
+
+    def refresh(self, mids=None):
+        """
+        Fetch the selections for market ids mids with GetPrices, by
+        default for all stale markets.
+        """
+
+        with self.lock:
+            if mids is None:
+                mids = [m for m in self.mids if m in self.stale]
+            if not mids:
+                return
+            now = time.time()
+            for (mid, sels) in zip(mids, api.GetPrices(mids)):
+                self.fetched[mid] = now
+                for sid in self.markets.get(mid, []):
+                    self.selections.pop(sid, None)
+                self.markets[mid] = [s.id for s in sels]
+                for s in sels:
+                    self.selections[s.id] = s
+                self.stale.discard(mid)
+
+    def resync(self, reason):
+        """Bootstrap again after missing some changes."""
+
+        apilog.warning('resyncing selection store: {0}'.format(reason))
+        self.resyncs += 1
+        self.bootstrap()
+
+    def update(self):
+        """
+        Bring the store up to date, and return the set of selection
+        ids that changed or whose prices were fetched again (all of
+        them, if we had to bootstrap).
+        """
+
+        with self.lock:
+            if self.seqnum is None:
+                self.bootstrap()
+                return set(self.selections)
+
+            try:
+                changes = api.ListSelectionsChangedSince(self.seqnum)
+            except ApiError, e:
+                self.resync(e)
+                return set(self.selections)
+
+            expected = self.seqnum + 1
+            for ch in changes:
+                if ch.seqnum < expected or (self.CONTIGUOUS and
+                                            ch.seqnum != expected):
+                    self.resync('expected selection sequence number {0}, '
+                                'got {1}'.format(expected, ch.seqnum))
+                    return set(self.selections)
+                expected = ch.seqnum + 1
+
+            changed = set()
+            stale = set(self.stale)
+            for ch in changes:
+                self.seqnum = ch.seqnum
+                if ch.mid not in self.markets:
+                    continue
+                sel = self.selections.get(ch.id)
+                if sel is None or ch.src != sel.src \
+                   or ch.status != sel.status:
+                    # new selection, reset or withdrawal: the prices
+                    # and withdrawal sequence number have changed, and
+                    # so has the market information.
+                    self.stale.add(ch.mid)
+                    marketinfo.marketcache.invalidate([ch.mid])
+                    continue
+                sel.name = _name(ch.name)
+                sel.properties['_DisplayOrder'] = ch.displayorder
+                sel.properties['_WithdrawalFactor'] = ch.withdrawalfactor
+                changed.add(ch.id)
+
+            if self.maxage is not None:
+                old = time.time() - self.maxage
+                self.stale.update(m for m in self.mids
+                                  if self.fetched.get(m, 0.0) <= old)
+            newstale = [m for m in self.mids
+                        if m in self.stale and m not in stale]
+            self.refresh()
+            for mid in newstale:
+                changed.update(self.markets[mid])
+            return changed
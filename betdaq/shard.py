@@ -0,0 +1,137 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Polling the prices of many markets from several processes, so that
+parsing the responses is not limited to one CPU by the GIL.
+
+The market ids are split between the worker processes.  Each worker
+has its own ApiClient, polls its markets with GetPrices every
+interval seconds, and writes the prices to a board.PriceBoard in
+shared memory, from which any process can read them.  The GetPrices
+rate limit of the process that starts the workers is split into equal
+shares, one for each worker and one for the process itself (whose
+limit is cut to its share until the workers are stopped), so that
+between them they stay within it.
+"""
+
+import time
+import multiprocessing
+import api
+import apiclient
+import apimethod
+import ratelimit
+import util
+from board import PriceBoard
+from apilog import apilog
+
+def _worker(board, mids, interval, output, limit, stop):
+    """Poll mids every interval seconds, writing prices to board."""
+
+    if limit is not None:
+        ratelimit.limiter.set_limit('GetPrices', *limit)
+    # a client of our own: we don't want to share the parent's
+    # connections (or SUDS client) after forking.
+    client = apiclient.ApiClient('readonly')
+    client.set_headers(api._rcl.name, api._rcl.password)
+    method = apimethod.ApiGetPrices(client)
+    while not stop.is_set():
+        start = time.time()
+        try:
+            prices = method.call(mids, partial=True, output=output)
+        except Exception, e:
+            apilog.error('shard GetPrices failed: {0}'.format(e))
+        else:
+            for (mid, sels) in zip(mids, prices):
+                if sels is not None:
+                    board.write_market(mid, sels)
+        stop.wait(max(0.0, interval - (time.time() - start)))
+
+class ShardPool(object):
+    """Worker processes polling prices into a shared PriceBoard."""
+
+    def __init__(self, mids, processes=None, interval=1.0, maxsel=40,
+                 depth=3, output='tuples'):
+        """
+        Poll market ids mids (each once, if given more than once)
+        every interval seconds from processes worker processes (by
+        default, one per CPU).  maxsel and depth give the size of the
+        board (see board.PriceBoard), and output is passed to
+        GetPrices ('tuples' is the quickest to parse, and 'columns'
+        can't be used, since the board is written market by market).
+        """
+
+        if output == 'columns':
+            raise ValueError("ShardPool can't use output 'columns', use "
+                             "'selections' or 'tuples'")
+        # each market once, so that it has one block on the board and
+        # is polled by one worker.
+        self.mids = util.unique(mids)
+        self.processes = processes or multiprocessing.cpu_count()
+        self.interval = interval
+        self.output = output
+        self.board = PriceBoard(self.mids, maxsel, depth)
+        self.stop_event = multiprocessing.Event()
+        self.workers = []
+        # our GetPrices limit (calls, period) from before the workers
+        # were started, given back when they are stopped.
+        self.saved_limit = None
+
+    def shards(self):
+        """Return list of the market ids of each worker."""
+
+        n = min(self.processes, len(self.mids)) or 1
+        return [self.mids[i::n] for i in range(n)]
+
+    def start(self):
+        """
+        Start the worker processes, cutting our GetPrices rate limit
+        to a share of it until stop is called.
+        """
+
+        shards = self.shards()
+        bucket = ratelimit.limiter.buckets.get('GetPrices')
+        limit = None
+        if bucket is not None:
+            period = bucket.capacity / bucket.rate
+            if self.saved_limit is None:
+                self.saved_limit = (bucket.capacity, period)
+            # (calls, period) for each worker and for this process.
+            limit = (self.saved_limit[0] / (len(shards) + 1), period)
+            ratelimit.limiter.set_limit('GetPrices', *limit)
+        self.stop_event.clear()
+        for mids in shards:
+            p = multiprocessing.Process(target=_worker,
+                                        args=(self.board, mids,
+                                              self.interval, self.output,
+                                              limit, self.stop_event))
+            p.daemon = True
+            p.start()
+            self.workers.append(p)
+
+    def stop(self):
+        """
+        Stop the worker processes, wait for them to finish, and give
+        us back our GetPrices rate limit.
+        """
+
+        self.stop_event.set()
+        for p in self.workers:
+            p.join()
+        self.workers = []
+        if self.saved_limit is not None:
+            ratelimit.limiter.set_limit('GetPrices', *self.saved_limit)
+            self.saved_limit = None
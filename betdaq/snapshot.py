@@ -0,0 +1,173 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Prices for many markets as numpy arrays, with one row per selection,
+as returned by api.GetPrices(mids, output='columns').  Computing
+e.g. the best prices or the overround of every market is then a
+handful of array operations, rather than a loop over thousands of
+Selection objects.
+
+The selections are in the same order as GetPrices would return them
+(market by market), and the ladders are two dimensional, with one
+column per price level (best price first), padded with NaN prices
+and zero stakes.
+"""
+
+try:
+    import numpy
+except ImportError:
+    raise ImportError('betdaq.snapshot requires the numpy package')
+
+import exchangedata
+
+# columns with one item per selection, and the ladder columns.
+_COLUMNS = ('mid', 'sid', 'status', 'src', 'wsn', 'matchedback',
+            'matchedlay', 'lastmatchedprice')
+_LADDERS = ('backprice', 'backstake', 'layprice', 'laystake')
+
+# BDAQ selection status of an active selection.
+S_ACTIVE = 1
+
+def _asarray(arr):
+    """Return numpy array sharing the memory of array.array arr."""
+
+    if len(arr) == 0:
+        return numpy.empty(0, dtype=arr.typecode)
+    return numpy.frombuffer(arr, dtype=arr.typecode)
+
+def _pad(arr, depth, fill):
+    """Return 2d array arr padded to depth columns with fill."""
+
+    if arr.shape[1] == depth:
+        return arr
+    out = numpy.empty((arr.shape[0], depth))
+    out.fill(fill)
+    out[:, :arr.shape[1]] = arr
+    return out
+
+class PriceSnapshot(object):
+    """Prices of the selections of some markets, as numpy arrays."""
+
+    def __init__(self, chunks):
+        """
+        chunks is a list of dicts of columns, as returned by
+        apiparse.ParseGetPricesColumns, which are joined in order.
+        """
+
+        # market ids, and number of selections in each market.
+        self.markets = numpy.array([m for c in chunks for m in c['markets']],
+                                   dtype=numpy.int64)
+        self.nsel = numpy.array([n for c in chunks for n in c['nsel']],
+                                dtype=numpy.int64)
+        # index of the first selection of each market.
+        self.offsets = numpy.cumsum(self.nsel) - self.nsel
+        # index (into self.markets) of the market of each selection.
+        self.mindex = numpy.repeat(numpy.arange(len(self.markets)),
+                                   self.nsel)
+        self.depth = max([c['depth'] for c in chunks] or [0])
+        for col in _COLUMNS:
+            arrs = [_asarray(c[col]) for c in chunks]
+            setattr(self, col, numpy.concatenate(arrs) if arrs
+                    else numpy.empty(0))
+        for col in _LADDERS:
+            fill = numpy.nan if col.endswith('price') else 0.0
+            arrs = [_pad(_asarray(c[col]).reshape(len(c['sid']),
+                                                  c['depth']),
+                         self.depth, fill) for c in chunks]
+            setattr(self, col, numpy.concatenate(arrs) if arrs
+                    else numpy.empty((0, 0)))
+
+    def __len__(self):
+        return len(self.sid)
+
+    def market(self, mid):
+        """Return slice of the selections of market id mid."""
+
+        i = numpy.flatnonzero(self.markets == mid)[0]
+        return slice(self.offsets[i], self.offsets[i] + self.nsel[i])
+
+    def _side(self, side):
+        if side == 'back':
+            return (self.backprice, self.backstake)
+        if side == 'lay':
+            return (self.layprice, self.laystake)
+        raise ValueError("side must be 'back' or 'lay'")
+
+    def best(self, side='back'):
+        """
+        Return (prices, stakes) of the best price on side ('back' or
+        'lay') for each selection, NaN and zero if there is none.
+        """
+
+        (prices, stakes) = self._side(side)
+        if self.depth == 0:
+            return (numpy.nan * numpy.ones(len(self)), numpy.zeros(len(self)))
+        return (prices[:, 0], stakes[:, 0])
+
+    def spread(self):
+        """Return best lay price minus best back price for each selection."""
+
+        return self.best('lay')[0] - self.best('back')[0]
+
+    def spread_ticks(self, ladder=None):
+        """
+        Return number of ticks of the odds ladder (by default
+        exchangedata.LADDER) between the best back and lay prices of
+        each selection, -1 where either is missing.
+        """
+
+        ladder = ladder or exchangedata.LADDER
+        back = self.best('back')[0]
+        lay = self.best('lay')[0]
+        ok = ~(numpy.isnan(back) | numpy.isnan(lay))
+        ticks = -numpy.ones(len(self), dtype=numpy.int64)
+        ticks[ok] = (ladder.ticks(lay[ok], 'nearest')
+                     - ladder.ticks(back[ok], 'nearest'))
+        return ticks
+
+    def levels(self, side='back'):
+        """Return number of price levels on side for each selection."""
+
+        return (~numpy.isnan(self._side(side)[0])).sum(axis=1)
+
+    def stake_depth(self, side='back', levels=None):
+        """
+        Return the total stake available on side for each selection,
+        in the best levels price levels (by default, all of them).
+        """
+
+        stakes = self._side(side)[1]
+        return stakes[:, :levels].sum(axis=1)
+
+    def per_market(self, values):
+        """Return sum of values (one per selection) for each market."""
+
+        return numpy.bincount(self.mindex, weights=values,
+                              minlength=len(self.markets))
+
+    def overround(self, side='back'):
+        """
+        Return the book percentage of each market on side, i.e. the
+        sum of 100 / best price over the active selections with a
+        price.  Markets with no such selections have 0.
+        """
+
+        prices = self.best(side)[0]
+        ok = (self.status == S_ACTIVE) & ~numpy.isnan(prices)
+        pct = numpy.zeros(len(self))
+        pct[ok] = 100.0 / prices[ok]
+        return self.per_market(pct)
@@ -0,0 +1,249 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+SUDS transport that keeps HTTP connections alive between requests.
+The default SUDS transport (urllib2) opens a new TCP connection, and
+for the secure service a new TLS session, for every API call.  This
+module imports SUDS, so should only be imported once a SUDS client is
+needed.
+"""
+
+import sys
+import time
+import errno
+import socket
+import httplib
+import urlparse
+import threading
+from StringIO import StringIO
+
+from suds.transport import Reply, TransportError
+from suds.transport.http import HttpTransport
+
+import const
+
+# errors sending a request on a pooled connection which mean that the
+# server had closed the connection while it was idle.
+_STALEERRORS = (errno.ECONNRESET, errno.EPIPE)
+
+def _no_status_line(e):
+    """Is httplib.BadStatusLine e for an empty status line?"""
+
+    # older versions of httplib give the (repr of the) empty line.
+    return (e.line in ('', repr('')) or
+            e.line.startswith('No status line received'))
+
+class _StaleConnection(Exception):
+    """
+    A pooled connection failed before any of the response arrived,
+    because the server had closed it, so the request was not acted
+    on.  exc_info is that of the original error.
+    """
+
+    def __init__(self, exc_info):
+        Exception.__init__(self, str(exc_info[1]))
+        self.exc_info = exc_info
+
+class ConnectionPool(object):
+    """
+    Idle keep-alive connections by (scheme, host), and statistics.
+    This is the part of a PooledTransport that is shared with its
+    copies, and is thread safe.
+    """
+
+    def __init__(self, poolsize, idletimeout):
+        self.poolsize = poolsize
+        self.idletimeout = idletimeout
+        # (scheme, host) -> list of (connection, time last used)
+        self.idle = {}
+        self.lock = threading.Lock()
+        # statistics
+        self.nrequests = 0
+        self.nconnects = 0
+        self.nreused = 0
+
+    def stats(self):
+        """Return dict of connection statistics."""
+
+        with self.lock:
+            nidle = sum(len(c) for c in self.idle.values())
+            return {'requests': self.nrequests,
+                    'connections': self.nconnects,
+                    'reused': self.nreused,
+                    'idle': nidle}
+
+    def get(self, key):
+        """
+        Return an idle connection for key that has not timed out, or
+        None if there is none.
+        """
+
+        now = time.time()
+        with self.lock:
+            self.nrequests += 1
+            conns = self.idle.get(key, [])
+            while conns:
+                (conn, last) = conns.pop()
+                if now - last < self.idletimeout:
+                    self.nreused += 1
+                    return conn
+                conn.close()
+        return None
+
+    def connected(self):
+        """Count a new connection."""
+
+        with self.lock:
+            self.nconnects += 1
+
+    def put(self, key, conn):
+        """Return connection to the pool, or close it if the pool is full."""
+
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.poolsize:
+                conns.append((conn, time.time()))
+                return
+        conn.close()
+
+class PooledTransport(HttpTransport):
+    """
+    Transport with a pool of keep-alive connections per host.  The
+    pool is thread safe, and is shared by clones of the SUDS client
+    that uses it.
+    """
+
+    def __init__(self, poolsize=None, idletimeout=None, nodelay=None,
+                 sockopts=None, **kwargs):
+        """
+        poolsize is the maximum number of idle connections to keep per
+        host, idletimeout the time in seconds after which an idle
+        connection is not reused, nodelay whether to set TCP_NODELAY,
+        and sockopts a list of (level, option, value) arguments for
+        socket.setsockopt.  Defaults for these are in const.py.
+        kwargs are SUDS transport options (e.g. timeout).
+        """
+
+        HttpTransport.__init__(self, **kwargs)
+        self.pool = ConnectionPool(
+            const.HTTPPOOLSIZE if poolsize is None else poolsize,
+            const.HTTPIDLETIMEOUT if idletimeout is None else idletimeout)
+        self.nodelay = const.TCPNODELAY if nodelay is None else nodelay
+        self.sockopts = const.SOCKOPTS if sockopts is None else sockopts
+
+    def __deepcopy__(self, memo={}):
+        # SUDS deep copies the options (including the transport) when
+        # cloning a client.  The copy needs options of its own, since
+        # SUDS links them to the options of the cloned client, but
+        # should share the connection pool.
+        cp = HttpTransport.__deepcopy__(self, memo)
+        cp.pool = self.pool
+        cp.nodelay = self.nodelay
+        cp.sockopts = self.sockopts
+        return cp
+
+    def stats(self):
+        """Return dict of connection statistics."""
+
+        return self.pool.stats()
+
+    def _connect(self, key):
+        """Return new connection for key."""
+
+        self.pool.connected()
+        (scheme, host) = key
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, timeout=self.options.timeout)
+        else:
+            conn = httplib.HTTPConnection(host, timeout=self.options.timeout)
+        conn.connect()
+        if self.nodelay:
+            conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        for (level, opt, value) in self.sockopts:
+            conn.sock.setsockopt(level, opt, value)
+        return conn
+
+    def _post(self, conn, path, request):
+        """
+        POST request on conn, and return (response, body).  Raises
+        _StaleConnection if conn turns out to have been closed by the
+        server: the request could not be written (connection reset
+        or broken pipe), or the server closed the connection without
+        sending a status line.  Any other error, in particular a
+        timeout, may come after the server has acted on the request.
+        """
+
+        try:
+            conn.request('POST', path, request.message, request.headers)
+        except socket.error, e:
+            if e.errno in _STALEERRORS:
+                raise _StaleConnection(sys.exc_info())
+            raise
+        try:
+            resp = conn.getresponse()
+        except httplib.BadStatusLine, e:
+            if _no_status_line(e):
+                raise _StaleConnection(sys.exc_info())
+            raise
+        return (resp, resp.read())
+
+    def send(self, request):
+        if self.options.proxy:
+            # we don't pool connections through a proxy.
+            return HttpTransport.send(self, request)
+
+        parts = urlparse.urlsplit(request.url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or '/'
+        if parts.query:
+            path = path + '?' + parts.query
+
+        conn = self.pool.get(key)
+        try:
+            if conn is None:
+                conn = self._connect(key)
+                (resp, body) = self._post(conn, path, request)
+            else:
+                try:
+                    (resp, body) = self._post(conn, path, request)
+                except _StaleConnection:
+                    # the server closed the idle connection before
+                    # reading our request, so it is safe to send it
+                    # again, once, on a new connection (not on
+                    # another pooled one, which may be stale too).
+                    conn.close()
+                    conn = self._connect(key)
+                    (resp, body) = self._post(conn, path, request)
+        except _StaleConnection, e:
+            conn.close()
+            (etype, evalue, tb) = e.exc_info
+            raise etype, evalue, tb
+        except:
+            if conn is not None:
+                conn.close()
+            raise
+
+        if resp.will_close:
+            conn.close()
+        else:
+            self.pool.put(key, conn)
+
+        if resp.status in (202, 204):
+            return None
+        if resp.status >= 300:
+            raise TransportError(resp.reason, resp.status, StringIO(body))
+        return Reply(resp.status, dict(resp.getheaders()), body)
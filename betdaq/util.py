@@ -16,6 +16,7 @@
 
 """Some utility functions."""
 
+import datetime
 from itertools import izip
 
 def chunks(li, n):
@@ -42,3 +43,37 @@ def unique(seq):
        result.append(item)
    return result
 
+def update_fields(update):
+    """
+    Return (order, new price, change in stake, expected selection
+    reset count, expected withdrawal sequence number) for an item of
+    UpdateOrdersNoReceipt.  update is either (order, new price, change
+    in stake), in which case the order's own src and wsn are
+    expected, or has the expected values as two more items.
+    """
+
+    if len(update) == 3:
+        (o, price, delta) = update
+        return (o, price, delta, o.src, o.wsn)
+    return tuple(update)
+
+def suds_utc(value):
+    """
+    Return xs:dateTime value as unmarshalled by SUDS (or None) as a
+    naive UTC datetime.  Newer versions of SUDS give an aware
+    datetime; SUDS 0.4 gives a naive one, shifted from the timezone
+    of the XML to its idea of local time (the standard time offset in
+    whole hours, ignoring daylight saving time), which we undo here.
+    BDAQ always sends the timezone.
+    """
+
+    if value is None:
+        return None
+    if value.tzinfo is not None:
+        return (value - value.utcoffset()).replace(tzinfo=None)
+    try:
+        from suds.sax.date import Timezone
+    except ImportError:
+        return value
+    return value - datetime.timedelta(hours=Timezone.LOCAL)
+
@@ -0,0 +1,24 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the betdaq package.  These need SUDS (and numpy and
+trollius for the tests of snapshot.py and aio.py, which are skipped
+otherwise), but no Betdaq account: requests go to a local HTTP server
+(see server.py).  Run them from the top directory with
+
+python -m unittest discover tests
+"""
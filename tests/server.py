@@ -0,0 +1,162 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+A local HTTP/1.1 server for the tests, which keeps connections alive
+like the Betdaq servers do, and answers every POST with a reply
+given by the test.
+"""
+
+import re
+import socket
+import threading
+import BaseHTTPServer
+import SocketServer
+
+_NS = 'http://www.GlobalBettingExchange.com/ExternalAPI/'
+
+def envelope(body):
+    """Return SOAP envelope of a reply with XML body."""
+
+    return ('<?xml version="1.0" encoding="utf-8"?>'
+            '<soap:Envelope '
+            'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">'
+            '<soap:Body>{0}</soap:Body></soap:Envelope>'.format(body))
+
+def market_ids(request):
+    """Return list of the market ids in the envelope of a request."""
+
+    return [int(m) for m in re.findall(r'<MarketIds>(\d+)</MarketIds>',
+                                       request)]
+
+def prices_reply(request, nsel=2):
+    """
+    Return (200, GetPrices reply) for the market ids in request, with
+    nsel selections in each market.  Selection s of market mid has id
+    100 * mid + s, and its best back price is 3.0 + s.
+    """
+
+    parts = ['<GetPricesResponse xmlns="{0}"><GetPricesResult>'
+             '<ReturnStatus Code="0" Description="Success" CallId="x"/>'
+             '<Timestamp>2013-08-04T14:30:00Z</Timestamp>'.format(_NS)]
+    for mid in market_ids(request):
+        parts.append('<MarketPrices Id="{0}" Name="Market {0}" Type="1" '
+                     'IsPlayMarket="false" Status="2" '
+                     'NumberOfWinningSelections="1" '
+                     'StartTime="2013-08-04T15:00:00Z" '
+                     'WithdrawalSequenceNumber="1" DisplayOrder="0" '
+                     'IsEnabledForMultiples="false" '
+                     'IsInRunningAllowed="true" '
+                     'IsManagedWhenInRunning="true" '
+                     'IsCurrentlyInRunning="false" '
+                     'InRunningDelaySeconds="5">'.format(mid))
+        for sel in range(nsel):
+            parts.append('<Selections Id="{0}" Name="Selection {1}" '
+                         'Status="1" ResetCount="0" DeductionFactor="0" '
+                         'MatchedSelectionForStake="100.0" '
+                         'MatchedSelectionAgainstStake="50.0" '
+                         'LastMatchedOccurredAt="2013-08-04T14:29:59Z" '
+                         'LastMatchedPrice="3.05" '
+                         'LastMatchedForSideAmount="12.5">'
+                         '<ForSidePrices Price="{2}" Stake="10.0"/>'
+                         '<AgainstSidePrices Price="{3}" Stake="20.0"/>'
+                         '</Selections>'.format(100 * mid + sel, sel,
+                                                3.0 + sel, 3.1 + sel))
+        parts.append('</MarketPrices>')
+    parts.append('</GetPricesResult></GetPricesResponse>')
+    return (200, envelope(''.join(parts)))
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.stub.lock:
+            self.server.stub.connections += 1
+            self.server.stub.sockets.append(self.connection)
+            self.server.stub.threads.append(threading.current_thread())
+
+    def do_POST(self):
+        stub = self.server.stub
+        body = self.rfile.read(int(self.headers['content-length']))
+        with stub.lock:
+            stub.requests.append(body)
+        result = stub.reply(body)
+        (status, reply) = result[:2]
+        length = result[2] if len(result) > 2 else len(reply)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml; charset=utf-8')
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        self.wfile.write(reply)
+        if stub.drop or length != len(reply):
+            # close the connection without saying so, as a server
+            # does with a connection that has been idle too long.
+            self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # e.g. the client timed out and closed the connection.
+        pass
+
+class StubServer(object):
+    """
+    Server on a free port of localhost, running in a thread.  reply
+    is a function of the request body returning (status, reply body),
+    or (status, reply body, content length) to send the body with a
+    different Content-Length and then close the connection, as a
+    server that fails part way through a reply does.
+    The bodies of the requests received are in self.requests, and
+    the number of connections made to the server in self.connections.
+    If drop is True, the server closes each connection after one
+    request, although the reply doesn't say that it will.
+    """
+
+    def __init__(self, reply, drop=False):
+        self.reply = reply
+        self.drop = drop
+        self.requests = []
+        self.connections = 0
+        self.sockets = []
+        self.threads = []
+        self.lock = threading.Lock()
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.stub = self
+        self.url = 'http://127.0.0.1:{0}/'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        # end the connections the clients keep open, and wait for their
+        # threads, so that they finish now rather than at interpreter
+        # shutdown.
+        with self.lock:
+            for sock in self.sockets:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+            threads = list(self.threads)
+        for thread in threads:
+            thread.join(5)
@@ -0,0 +1,140 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for aio.py, the coroutine versions of the api functions."""
+
+import time
+import unittest
+
+try:
+    import trollius
+except ImportError:
+    trollius = None
+
+from betdaq import api
+from server import StubServer, market_ids, prices_reply
+
+if trollius is not None:
+    from betdaq import aio
+
+@unittest.skipIf(trollius is None, 'aio needs trollius')
+class TestAio(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(prices_reply)
+        api.set_user('username', 'password')
+        for cl in (api._rcl, api._scl):
+            cl.client.set_options(location=self.server.url)
+        # the aio method objects are clones of the api clients.
+        aio._methods.clear()
+        # aio uses the default event loop.
+        self.loop = trollius.new_event_loop()
+        trollius.set_event_loop(self.loop)
+        aio.set_http_pool(aio.HttpConnectionPool(self.loop))
+
+    def tearDown(self):
+        for cl in (api._rcl, api._scl):
+            cl.client.set_options(location=None)
+        aio._methods.clear()
+        aio.set_http_pool(None)
+        trollius.set_event_loop(None)
+        self.loop.close()
+        self.server.close()
+
+    def run_coroutine(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_get_prices(self):
+        mids = [101, 102, 103]
+        allselections = self.run_coroutine(aio.GetPrices(mids))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(market_ids(self.server.requests[0]), mids)
+        # the header from api.set_user is in the envelope.
+        self.assertIn('username="username"', self.server.requests[0])
+        self.assertEqual([[s.id for s in sels] for sels in allselections],
+                         [[100 * m, 100 * m + 1] for m in mids])
+        self.assertEqual(allselections[0][1].backprices[0], (4.0, 10.0))
+
+    def test_get_prices_chunks_in_parallel(self):
+        # three chunks, all in flight at once.
+        mids = range(1000, 1120)
+        allselections = self.run_coroutine(aio.GetPrices(mids))
+        self.assertEqual(sorted(market_ids(r) for r in self.server.requests),
+                         [mids[:50], mids[50:100], mids[100:]])
+        self.assertEqual([sels[0].id for sels in allselections],
+                         [100 * m for m in mids])
+
+    def test_concurrent_calls(self):
+        calls = [aio.GetPrices([1, 2]), aio.GetPrices([3]),
+                 aio.GetPrices([4, 5, 6])]
+        results = self.run_coroutine(trollius.gather(*calls))
+        self.assertEqual(sorted(market_ids(r) for r in self.server.requests),
+                         [[1, 2], [3], [4, 5, 6]])
+        self.assertEqual([[sels[0].mid for sels in r] for r in results],
+                         [[1, 2], [3], [4, 5, 6]])
+
+    def use_server(self, reply, drop=False):
+        """Replace the stub server with one answering with reply."""
+
+        self.server.close()
+        self.server = StubServer(reply, drop)
+        for cl in (api._rcl, api._scl):
+            cl.client.set_options(location=self.server.url)
+
+    def test_stale_connection_sent_again(self):
+        # the server closes each connection after replying, so the
+        # second call finds its pooled connection closed.
+        self.use_server(prices_reply, drop=True)
+        for mid in (1, 2):
+            allselections = self.run_coroutine(aio.GetPrices([mid]))
+            self.assertEqual(allselections[0][0].id, 100 * mid)
+        # the request on the closed connection never arrived.
+        self.assertEqual([market_ids(r) for r in self.server.requests],
+                         [[1], [2]])
+        self.assertEqual(self.server.connections, 2)
+
+    def test_partial_reply_not_sent_again(self):
+        def reply(request):
+            (status, body) = prices_reply(request)
+            if len(self.server.requests) == 1:
+                return (status, body)
+            # the server fails part way through the reply.
+            return (status, body[:100], len(body))
+        self.use_server(reply)
+        self.run_coroutine(aio.GetPrices([1]))
+        self.assertRaises(trollius.IncompleteReadError, self.run_coroutine,
+                          aio.GetPrices([2]))
+        self.assertEqual([market_ids(r) for r in self.server.requests],
+                         [[1], [2]])
+
+    def test_timeout(self):
+        def reply(request):
+            time.sleep(1.0)
+            return prices_reply(request)
+        self.use_server(reply)
+        timeout = api._rcl.client.options.timeout
+        api._rcl.client.set_options(timeout=0.2)
+        try:
+            start = time.time()
+            self.assertRaises(trollius.TimeoutError, self.run_coroutine,
+                              aio.GetPrices([1]))
+            self.assertLess(time.time() - start, 0.9)
+        finally:
+            api._rcl.client.set_options(timeout=timeout)
+        self.assertEqual(len(self.server.requests), 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Tests for apimethod.py: calls from several threads at once through
+one ApiMethod instance (see ApiMethod.checkout), and the rate limit
+wait of PlaceOrdersNoReceipt.
+"""
+
+import re
+import itertools
+import threading
+import unittest
+
+from betdaq import api, apimethod, const
+from betdaq.exchange import Order, O_BACK
+from server import StubServer, envelope, market_ids, prices_reply
+
+class TestThreads(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(self.reply)
+        api.set_user('username', 'password')
+        self.cl = api._rcl.clone()
+        self.cl.client.set_options(location=self.server.url)
+        self.fastserialize = const.FASTSERIALIZE
+
+    def tearDown(self):
+        const.FASTSERIALIZE = self.fastserialize
+        self.server.close()
+
+    def reply(self, body):
+        # each reply waits until both requests have arrived, so that
+        # the calls must be in flight together.
+        with self.server.lock:
+            both = len(self.server.requests) >= 2
+        if not both and not self.together.wait(5.0):
+            self.serial = True
+        self.together.set()
+        return prices_reply(body)
+
+    def call_in_threads(self, method, args, **kwargs):
+        """Call method with each of args in its own thread at once."""
+
+        self.together = threading.Event()
+        self.serial = False
+        results = [None] * len(args)
+        def call(i):
+            results[i] = method.call(args[i], **kwargs)
+        threads = [threading.Thread(target=call, args=(i,))
+                   for i in range(len(args))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(10.0)
+        self.assertFalse(self.serial, 'calls were not made at once')
+        return results
+
+    def check_get_prices(self, **kwargs):
+        m = apimethod.ApiGetPrices(self.cl)
+        args = [[1, 2], [3, 4, 5]]
+        results = self.call_in_threads(m, args, **kwargs)
+        self.assertEqual(sorted(market_ids(r) for r in self.server.requests),
+                         args)
+        self.assertEqual([[sels[0].mid for sels in r] for r in results],
+                         args)
+        # the first call used the method's own client and request,
+        # the second a new (client, request) pair, and both are kept.
+        self.assertEqual(m.spares.qsize(), 2)
+        (c1, r1) = m.spares.get()
+        (c2, r2) = m.spares.get()
+        self.assertIsNot(c1, c2)
+        self.assertIsNot(r1, r2)
+
+    def test_get_prices_suds(self):
+        const.FASTSERIALIZE = False
+        self.check_get_prices()
+
+    def test_get_prices_fastserialize(self):
+        const.FASTSERIALIZE = True
+        self.check_get_prices()
+
+    def test_get_prices_tuples(self):
+        self.check_get_prices(output='tuples')
+
+    def test_nested_checkout(self):
+        m = apimethod.ApiGetPrices(self.cl)
+        with m.checkout() as (c1, r1):
+            with m.checkout() as (c2, r2):
+                self.assertIsNot(c1, c2)
+                self.assertIsNot(r1, r2)
+        self.assertEqual(m.spares.qsize(), 2)
+
+_NS = 'http://www.GlobalBettingExchange.com/ExternalAPI/'
+# order refs given to the orders placed.
+_orefs = itertools.count(1000)
+
+def place_reply(request):
+    """Return (200, PlaceOrdersNoReceipt reply) for the orders sent."""
+
+    sids = re.findall(r'SelectionId="(\d+)"', request)
+    body = ('<PlaceOrdersNoReceiptResponse xmlns="{0}">'
+            '<PlaceOrdersNoReceiptResult>'
+            '<ReturnStatus Code="0" Description="Success" CallId="x"/>'
+            '<Timestamp>2013-08-04T14:30:00Z</Timestamp>'
+            '<OrderHandles>{1}</OrderHandles>'
+            '</PlaceOrdersNoReceiptResult>'
+            '</PlaceOrdersNoReceiptResponse>').format(
+        _NS, ''.join('<OrderHandle>{0}</OrderHandle>'.format(_orefs.next())
+                     for sid in sids))
+    return (200, envelope(body))
+
+class TestPlaceOrders(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(place_reply)
+        api.set_user('username', 'password')
+        self.cl = api._scl.clone()
+        self.cl.client.set_options(location=self.server.url)
+
+    def tearDown(self):
+        api.set_rate_limit('PlaceOrdersNoReceipt',
+                           *const.RATELIMITS['PlaceOrdersNoReceipt'])
+        self.server.close()
+
+    def test_rate_limit_wait_recorded(self):
+        api.set_rate_limit('PlaceOrdersNoReceipt', 1, 0.3)
+        m = apimethod.ApiPlaceOrdersNoReceipt(self.cl)
+        orders = [Order(101, 2.0, 3.0, O_BACK) for i in range(60)]
+        placed = m.call(orders)
+        self.assertEqual(len(placed), 60)
+        self.assertEqual([t[0] for t in m.timings], [50, 10])
+        # the second chunk waited for the rate limit, and the wait is
+        # also that of the last call.
+        self.assertGreater(m.timings[1][1], 0.1)
+        self.assertEqual(m.waited, m.timings[1][1])
+
+if __name__ == '__main__':
+    unittest.main()
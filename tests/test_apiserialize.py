@@ -0,0 +1,117 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Tests for apiserialize.py: each envelope we write ourselves must be
+the same XML (ignoring namespace prefixes) as the envelope SUDS
+writes for the same request, since const.FASTSERIALIZE sends ours
+instead.
+"""
+
+import unittest
+from xml.etree import cElementTree as ElementTree
+
+from betdaq import api, apimethod, apiserialize, exchange
+
+def canonical(xml):
+    """Return nested tuple representation of XML string."""
+
+    def canon(e):
+        return (e.tag, sorted(e.attrib.items()), (e.text or '').strip(),
+                [canon(c) for c in e])
+    return canon(ElementTree.fromstring(xml))
+
+def make_orders():
+    """Return list of placed Order objects, with awkward values."""
+
+    orders = [exchange.Order(100, 2.0, 3.05, exchange.O_BACK, src=1, wsn=2),
+              exchange.Order(101, 0.5, 990.0, exchange.O_LAY,
+                             cancelrunning=False),
+              exchange.Order(2 ** 40, 0.1 + 0.2, 1.01, exchange.O_BACK,
+                             cancelreset=False),
+              exchange.Order(102, 1234.56789, 2, exchange.O_LAY,
+                             cancelrunning=False, cancelreset=False)]
+    for (i, o) in enumerate(orders):
+        o.oref = 5551 + i * 10 ** 9
+    return orders
+
+class TestSerialize(unittest.TestCase):
+
+    def setUp(self):
+        api.set_user('username', 'password')
+        self.rcl = api._rcl
+        self.scl = api._scl
+        self.orders = make_orders()
+
+    def assertSameXml(self, method, req, ours):
+        suds = method.make_envelope(method.client, req)
+        self.assertEqual(canonical(suds), canonical(ours))
+
+    def test_get_prices(self):
+        m = apimethod.ApiGetPrices(self.rcl)
+        for mids in ([1234567], [1234567, 1234568, 2 ** 33]):
+            req = m.make_req(m.client)
+            req.MarketIds = mids
+            self.assertSameXml(m, req, apiserialize.SerializeGetPrices(
+                self.rcl.headerattrs, mids))
+
+    def test_place_orders(self):
+        m = apimethod.ApiPlaceOrdersNoReceipt(self.scl)
+        for (orders, allornothing) in ((self.orders, True),
+                                       (self.orders[1:2], False)):
+            req = m.make_req(m.client)
+            req.Orders.Order = m.makeorderlist(orders)
+            req.WantAllOrNothingBehaviour = allornothing
+            self.assertSameXml(m, req,
+                               apiserialize.SerializePlaceOrdersNoReceipt(
+                                   self.scl.headerattrs, orders,
+                                   allornothing))
+
+    def test_update_orders(self):
+        m = apimethod.ApiUpdateOrdersNoReceipt(self.scl)
+        o = self.orders
+        for updates in ([(o[0], 3.1, 1.5), (o[1], 980.0, -0.25),
+                         (o[2], 1.02, 0.1 + 0.2), (o[3], 3, 0)],
+                        [(o[1], 1.5, -1)],
+                        # with the expected reset count and withdrawal
+                        # sequence number.
+                        [(o[0], 3.1, 1.5, 7, 8), (o[1], 1.5, -1)]):
+            req = m.make_req(m.client)
+            req.Orders.Order = m.makeorderlist(updates)
+            self.assertSameXml(m, req,
+                               apiserialize.SerializeUpdateOrdersNoReceipt(
+                                   self.scl.headerattrs, updates))
+
+    def test_cancel_orders(self):
+        m = apimethod.ApiCancelOrders(self.scl)
+        for orders in (self.orders, self.orders[:1]):
+            orefs = [o.oref for o in orders]
+            req = m.make_req(m.client)
+            req.OrderHandle = orefs
+            self.assertSameXml(m, req, apiserialize.SerializeCancelOrders(
+                self.scl.headerattrs, orefs))
+
+    def test_list_orders_changed_since(self):
+        m = apimethod.ApiListOrdersChangedSince(self.scl)
+        for seqnum in (0, 42, 2 ** 40):
+            req = m.make_req(m.client)
+            req.SequenceNumber = seqnum
+            self.assertSameXml(m, req,
+                               apiserialize.SerializeListOrdersChangedSince(
+                                   self.scl.headerattrs, seqnum))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for board.py and shard.py, prices in shared memory."""
+
+import time
+import unittest
+
+from betdaq import board as boardmod, ratelimit, shard
+from betdaq.board import PriceBoard
+from betdaq.exchange import SelectionTuple
+from betdaq.shard import ShardPool
+
+class FakeLog(object):
+    """Replaces the apilog of a module, recording the warnings."""
+
+    def __init__(self, module):
+        self.module = module
+        self.saved = module.apilog
+        module.apilog = self
+        self.warnings = []
+
+    def warning(self, msg):
+        self.warnings.append(msg)
+
+    def restore(self):
+        self.module.apilog = self.saved
+
+class FakeProcess(object):
+    """Replaces multiprocessing.Process, recording the arguments."""
+
+    started = []
+
+    def __init__(self, target, args):
+        self.args = args
+
+    def start(self):
+        FakeProcess.started.append(self)
+
+    def join(self):
+        pass
+
+def selection(mid, sid):
+    return SelectionTuple('Selection', sid, mid, 10.0, 5.0, None, 3.05,
+                          2.0, [(3.0, 10.0), (2.98, 4.0)], [(3.1, 8.0)],
+                          1, 2)
+
+class TestBoard(unittest.TestCase):
+
+    def test_write_and_read(self):
+        board = PriceBoard([1, 2], maxsel=3, depth=2)
+        board.write_market(2, [selection(2, 200), selection(2, 201)])
+        sels = board.market(2)
+        self.assertEqual([s.sid for s in sels], [200, 201])
+        self.assertEqual(sels[0].backprices, [(3.0, 10.0), (2.98, 4.0)])
+        self.assertEqual(sels[0].layprices, [(3.1, 8.0)])
+        self.assertEqual(board.market(1), [])
+
+    def test_read_gives_up_on_dead_writer(self):
+        board = PriceBoard([1], maxsel=2, timeout=0.1)
+        board.write_market(1, [selection(1, 100)])
+        # as if a writer died in the middle of writing the slot.
+        board.seqs[0] += 1
+        start = time.time()
+        self.assertRaises(RuntimeError, board.market, 1)
+        self.assertLess(time.time() - start, 1.0)
+        # the next write leaves the slot readable again.
+        board.write_market(1, [selection(1, 101)])
+        self.assertEqual(board.seqs[0] % 2, 0)
+        self.assertEqual([s.sid for s in board.market(1)], [101])
+
+    def test_truncated_market_warns(self):
+        log = FakeLog(boardmod)
+        try:
+            board = PriceBoard([1], maxsel=2)
+            board.write_market(1, [selection(1, 100), selection(1, 101)])
+            self.assertEqual(log.warnings, [])
+            board.write_market(1, [selection(1, 100 + i) for i in range(3)])
+        finally:
+            log.restore()
+        self.assertEqual(len(log.warnings), 1)
+        self.assertEqual([s.sid for s in board.market(1)], [100, 101])
+
+    def test_duplicate_market_ids(self):
+        board = PriceBoard([1, 2, 1, 3, 2], maxsel=2)
+        self.assertEqual(board.mids, [1, 2, 3])
+        self.assertEqual(board.blocks, {1: 0, 2: 2, 3: 4})
+        pool = ShardPool([5, 6, 5, 7, 6, 8], processes=2)
+        self.assertEqual(pool.mids, [5, 6, 7, 8])
+        self.assertEqual(pool.shards(), [[5, 7], [6, 8]])
+        self.assertEqual(pool.board.mids, [5, 6, 7, 8])
+
+class TestShardPoolLimit(unittest.TestCase):
+    """The GetPrices rate limit is shared by the workers and us."""
+
+    def setUp(self):
+        self.saved = shard.multiprocessing.Process
+        shard.multiprocessing.Process = FakeProcess
+        FakeProcess.started = []
+        bucket = ratelimit.limiter.buckets.get('GetPrices')
+        self.limit = (bucket.capacity, bucket.capacity / bucket.rate)
+        ratelimit.limiter.set_limit('GetPrices', 60, 60.0)
+
+    def tearDown(self):
+        shard.multiprocessing.Process = self.saved
+        ratelimit.limiter.set_limit('GetPrices', *self.limit)
+
+    def getprices_limit(self):
+        bucket = ratelimit.limiter.buckets['GetPrices']
+        return (bucket.capacity, bucket.capacity / bucket.rate)
+
+    def test_limit_shared_until_stopped(self):
+        pool = ShardPool([1, 2, 3, 4], processes=2)
+        pool.start()
+        # a third each for the two workers, and for us.
+        self.assertEqual([p.args[4] for p in FakeProcess.started],
+                         [(20.0, 60.0)] * 2)
+        self.assertEqual(self.getprices_limit(), (20.0, 60.0))
+        pool.stop()
+        self.assertEqual(self.getprices_limit(), (60.0, 60.0))
+
+if __name__ == '__main__':
+    unittest.main()
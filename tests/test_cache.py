@@ -0,0 +1,169 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for cache.py, and for ApiMethod.cached_call."""
+
+import time
+import threading
+import unittest
+
+from betdaq import api, apimethod
+from betdaq.cache import TTLCache, SingleFlight
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_expiry(self):
+        c = TTLCache(10, 0.1)
+        c.put('a', 1)
+        c.put('b', 2, ttl=60.0)
+        self.assertEqual(c.get('a'), 1)
+        self.assertIn('a', c)
+        time.sleep(0.2)
+        self.assertNotIn('a', c)
+        self.assertEqual(c.get('a', 'gone'), 'gone')
+        # an entry given its own time to live is still there.
+        self.assertEqual(c.get('b'), 2)
+        self.assertEqual(c.stats()['hits'], 2)
+        self.assertEqual(c.stats()['misses'], 1)
+
+    def test_lru_eviction_by_count(self):
+        c = TTLCache(3, 60.0)
+        # entries count the same whatever their size.
+        c.put('big', range(100000))
+        c.put('a', 1)
+        c.put('b', 2)
+        # using 'big' makes 'a' the least recently used.
+        c.get('big')
+        c.put('c', 3)
+        self.assertEqual(sorted(c.data), ['b', 'big', 'c'])
+        c.put('b', 4)
+        c.put('d', 5)
+        self.assertEqual(sorted(c.data), ['b', 'c', 'd'])
+        self.assertEqual(c.stats()['evictions'], 2)
+        self.assertEqual(c.stats()['entries'], 3)
+        c.invalidate(['b', 'x'])
+        self.assertEqual(len(c), 2)
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.flights = SingleFlight()
+        self.release = threading.Event()
+        self.calls = []
+
+    def slow(self, value):
+        self.calls.append(value)
+        self.release.wait(5.0)
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def run_threads(self, key, value, nthreads=4):
+        """Call self.slow(value) for key from nthreads threads."""
+
+        results = []
+        def do():
+            try:
+                results.append(self.flights.do(key, self.slow, value))
+            except Exception, e:
+                results.append(e)
+        threads = [threading.Thread(target=do) for i in range(nthreads)]
+        for t in threads:
+            t.start()
+        # wait until the others are waiting for the first.
+        deadline = time.time() + 5.0
+        while (self.flights.shared < nthreads - 1 and
+               time.time() < deadline):
+            time.sleep(0.01)
+        self.release.set()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_one_call_shared(self):
+        self.assertEqual(self.run_threads('k', 7), [7] * 4)
+        self.assertEqual(self.calls, [7])
+        self.assertEqual(self.flights.shared, 3)
+        # once done, the next call for the key is made again.
+        self.assertEqual(self.flights.do('k', self.slow, 8), 8)
+        self.assertEqual(self.calls, [7, 8])
+
+    def test_exception_shared(self):
+        error = ValueError('failed')
+        self.assertEqual(self.run_threads('k', error), [error] * 4)
+        self.assertEqual(self.calls, [error])
+
+class TestCachedCall(unittest.TestCase):
+
+    def setUp(self):
+        self.method = apimethod.ApiGetMarketInformation(api._rcl.clone())
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+        self.method.call = self.call
+
+    def call(self, mids):
+        self.calls.append(mids)
+        self.release.wait(5.0)
+        return ['info {0}'.format(m) for m in mids]
+
+    def test_not_cached_by_default(self):
+        self.method.cached_call((1, 2))
+        self.method.cached_call((1, 2))
+        self.assertEqual(len(self.calls), 2)
+        self.assertIsNone(self.method.cache_stats())
+
+    def test_cached_until_expiry(self):
+        self.method.set_cache(0.1, 10)
+        first = self.method.cached_call([1, 2])
+        # a list argument is the same as an equal tuple.
+        self.assertIs(self.method.cached_call((1, 2)), first)
+        self.method.cached_call([3])
+        self.assertEqual(self.calls, [[1, 2], [3]])
+        time.sleep(0.2)
+        self.method.cached_call([1, 2])
+        self.assertEqual(self.calls, [[1, 2], [3], [1, 2]])
+        stats = self.method.cache_stats()
+        self.assertEqual((stats['hits'], stats['entries']), (1, 2))
+
+    def test_eviction(self):
+        self.method.set_cache(60.0, 2)
+        for mids in ([1], [2], [1], [3], [1], [2]):
+            self.method.cached_call(mids)
+        self.assertEqual(self.calls, [[1], [2], [3], [2]])
+        self.assertEqual(self.method.cache_stats()['evictions'], 2)
+
+    def test_concurrent_calls_shared(self):
+        self.method.set_cache(60.0, 10)
+        self.release.clear()
+        results = []
+        def call():
+            results.append(self.method.cached_call([1]))
+        threads = [threading.Thread(target=call) for i in range(4)]
+        for t in threads:
+            t.start()
+        deadline = time.time() + 5.0
+        while self.method.flights.shared < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.release.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(self.calls, [[1]])
+        self.assertEqual(results, [['info 1']] * 4)
+        self.assertEqual(self.method.cache_stats()['shared'], 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Tests for cancelling orders: CancelOrders and CancelAllOrdersOnMarket
+against a stub server, and the order store they update.
+"""
+
+import unittest
+
+from betdaq import api
+from betdaq.apiexception import ApiError
+from betdaq.exchange import Order, O_BACK, O_UNMATCHED, O_MATCHED, \
+     O_CANCELLED
+from server import StubServer, envelope
+
+_NS = 'http://www.GlobalBettingExchange.com/ExternalAPI/'
+
+def status(code=0):
+    return ('<ReturnStatus Code="{0}" Description="Failed" CallId="x"/>'
+            '<Timestamp>2013-08-04T14:30:00Z</Timestamp>'.format(code))
+
+def cancel_items(orefs):
+    return ''.join('<Order OrderHandle="{0}" cancelledForSideStake="2.0" '
+                   'PunterReferenceNumber="0"/>'.format(o) for o in orefs)
+
+def unmatched(oref, mid):
+    return Order(10 * mid, 2.0, 3.0, O_BACK, oref=oref, mid=mid,
+                 status=O_UNMATCHED, unmatchedstake=2.0)
+
+class TestCancel(unittest.TestCase):
+    """
+    The stub server cancels the orders in self.cancelled, or fails
+    with return code self.code if it is not 0.
+    """
+
+    def setUp(self):
+        self.server = StubServer(self.reply)
+        api.set_user('username', 'password')
+        api._scl.client.set_options(location=self.server.url)
+        self.store = api.orders()
+        self.store.clear()
+        self.orders = [unmatched(1, 1), unmatched(2, 1), unmatched(3, 1),
+                       unmatched(4, 2), unmatched(5, 3)]
+        self.store.update(self.orders)
+        # order 2 was matched before we cancelled.
+        self.store.set_status([2], O_MATCHED)
+        self.cancelled = []
+        self.code = 0
+
+    def tearDown(self):
+        self.store.clear()
+        api._scl.client.set_options(location=None)
+        self.server.close()
+
+    def reply(self, request):
+        if 'CancelAllOrdersOnMarket' in request:
+            body = ('<CancelAllOrdersOnMarketResponse xmlns="{0}">'
+                    '<CancelAllOrdersOnMarketResult>{1}{2}'
+                    '</CancelAllOrdersOnMarketResult>'
+                    '</CancelAllOrdersOnMarketResponse>')
+        else:
+            body = ('<CancelOrdersResponse xmlns="{0}">'
+                    '<CancelOrdersResult>{1}<Orders>{2}</Orders>'
+                    '</CancelOrdersResult></CancelOrdersResponse>')
+        items = '' if self.code else cancel_items(self.cancelled)
+        return (200, envelope(body.format(_NS, status(self.code), items)))
+
+    def statuses(self):
+        return [o.status for o in self.orders]
+
+    def test_cancel_orders_one_cancelled(self):
+        self.cancelled = [1]
+        result = api.CancelOrders([self.orders[0], self.orders[2]])
+        self.assertEqual([o.oref for o in result], [1, 3])
+        self.assertEqual(self.statuses(), [O_CANCELLED, O_MATCHED,
+                                           O_UNMATCHED, O_UNMATCHED,
+                                           O_UNMATCHED])
+        self.assertEqual([o.oref for o in self.store.by_status(O_CANCELLED)],
+                         [1])
+
+    def test_cancel_all_on_markets_partly(self):
+        # of the orders on markets 1 and 2, 2 was already matched and
+        # BDAQ did not cancel 3.
+        self.cancelled = [1, 4]
+        self.assertEqual(sorted(api.CancelAllOrdersOnMarket([1, 2])),
+                         [1, 4])
+        self.assertEqual(self.statuses(), [O_CANCELLED, O_MATCHED,
+                                           O_UNMATCHED, O_CANCELLED,
+                                           O_UNMATCHED])
+        self.assertEqual(sorted(o.oref for o
+                                in self.store.by_status(O_UNMATCHED)),
+                         [3, 5])
+        self.assertEqual(self.store.unmatched_stake(10, O_BACK), 2.0)
+        self.assertEqual(self.store.unmatched_stake(20, O_BACK), 0.0)
+
+    def test_cancel_all_on_market_single_order(self):
+        self.cancelled = [3]
+        self.assertEqual(api.CancelAllOrdersOnMarket([1]), [3])
+        self.assertEqual(self.store[3].status, O_CANCELLED)
+
+    def test_cancel_all_on_market_none(self):
+        self.assertEqual(api.CancelAllOrdersOnMarket([1]), [])
+        self.assertEqual(self.statuses()[0], O_UNMATCHED)
+
+    def test_cancel_all_on_market_fails(self):
+        self.code = 5
+        self.assertRaises(ApiError, api.CancelAllOrdersOnMarket, [1, 2])
+        # the store is left as it was.
+        self.assertEqual(self.statuses(), [O_UNMATCHED, O_MATCHED,
+                                           O_UNMATCHED, O_UNMATCHED,
+                                           O_UNMATCHED])
+
+if __name__ == '__main__':
+    unittest.main()
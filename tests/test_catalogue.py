@@ -0,0 +1,95 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for catalogue.py, the catalogue of markets under some events."""
+
+import threading
+import unittest
+
+from betdaq import api
+from betdaq.catalogue import Catalogue
+from betdaq.exchange import Market
+
+def markets(eid):
+    """Return the two Market objects under event id eid."""
+
+    return [Market('|Racing|Event {0}|Market {1}'.format(eid, mid),
+                   mid, eid, False) for mid in (10 * eid, 10 * eid + 1)]
+
+class TestRefresh(unittest.TestCase):
+
+    def setUp(self):
+        self.get = api.GetEventSubTreeNoSelections
+        api.GetEventSubTreeNoSelections = self.fetch
+        self.catalogue = Catalogue([1, 2])
+        self.calls = []
+        # called with the event id during each fetch.
+        self.during = None
+
+    def tearDown(self):
+        api.GetEventSubTreeNoSelections = self.get
+
+    def fetch(self, eids):
+        self.calls.append(eids)
+        if self.during is not None:
+            self.during(eids[0])
+        return markets(eids[0])
+
+    def in_thread(self, func):
+        """Return True if func returned within a second in a thread."""
+
+        thread = threading.Thread(target=func)
+        thread.daemon = True
+        thread.start()
+        thread.join(1)
+        return not thread.is_alive()
+
+    def test_readable_while_fetching(self):
+        results = []
+        def during(eid):
+            self.assertTrue(self.in_thread(
+                lambda: results.append(self.catalogue.event_markets(1))))
+            # an event being fetched isn't fetched again.
+            self.assertTrue(self.in_thread(
+                lambda: results.append(self.catalogue.refresh([eid]))))
+        self.during = during
+        (added, removed) = self.catalogue.refresh()
+        self.assertEqual(sorted(m.id for m in added), [10, 11, 20, 21])
+        self.assertEqual(removed, [])
+        self.assertEqual(sorted(self.calls), [[1], [2]])
+        self.assertIn(([], []), results)
+        self.assertEqual(self.catalogue.due(), [])
+        self.assertEqual(self.catalogue.market_id('|Racing|Event 2|Market 21'),
+                         21)
+
+    def test_removed_while_fetching(self):
+        self.during = lambda eid: self.catalogue.remove_events([eid])
+        self.assertEqual(self.catalogue.refresh([1]), ([], []))
+        self.assertNotIn(10, self.catalogue)
+        self.assertEqual(self.catalogue.due(), [2])
+
+    def test_failed_fetch_still_due(self):
+        def during(eid):
+            raise IOError('no connection')
+        self.during = during
+        self.assertRaises(IOError, self.catalogue.refresh)
+        self.assertEqual(sorted(self.catalogue.due()), [1, 2])
+        self.during = None
+        self.catalogue.refresh()
+        self.assertEqual(len(self.catalogue), 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for coalesce.py, GetPrices shared between threads."""
+
+import time
+import threading
+import unittest
+
+from betdaq import api
+from betdaq.coalesce import PriceCoalescer
+from server import StubServer, market_ids, prices_reply
+
+class TestCoalescer(unittest.TestCase):
+
+    def setUp(self):
+        # the stub holds the reply to market 1 until self.first is
+        # set, and the reply to any other request until self.second.
+        self.first = threading.Event()
+        self.second = threading.Event()
+        self.server = StubServer(self.reply)
+        api.set_user('username', 'password')
+        api._rcl.client.set_options(location=self.server.url)
+        self.coalescer = PriceCoalescer(window=0)
+
+    def tearDown(self):
+        self.first.set()
+        self.second.set()
+        api._rcl.client.set_options(location=None)
+        self.server.close()
+
+    def reply(self, request):
+        if market_ids(request) == [1]:
+            self.first.wait(5)
+        else:
+            self.second.wait(5)
+        return prices_reply(request)
+
+    def get(self, mids, results):
+        """Start a thread putting the result of get(mids) in results."""
+
+        def run():
+            results[tuple(mids)] = self.coalescer.get(mids)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def wait_for(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail('timed out')
+
+    def test_leader_returns_after_own_batch(self):
+        results = {}
+        leader = self.get([1], results)
+        self.wait_for(lambda: len(self.server.requests) == 1)
+        # these two wait for the fetch of market 1 to finish.
+        others = [self.get([2, 3], results), self.get([3, 4], results)]
+        self.wait_for(lambda: len(self.coalescer.queue) == 2)
+        self.first.set()
+        # the first of the others fetches their batch, which is held
+        # by the stub, while the leader has already returned.
+        self.wait_for(lambda: len(self.server.requests) == 2)
+        leader.join(5)
+        self.assertFalse(leader.is_alive())
+        self.assertEqual([s.id for s in results[(1,)][0]], [100, 101])
+        self.assertTrue(self.coalescer.fetching)
+        self.second.set()
+        for thread in others:
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(sorted(market_ids(self.server.requests[1])),
+                         [2, 3, 4])
+        self.assertEqual([[s.id for s in sels] for sels in results[(3, 4)]],
+                         [[300, 301], [400, 401]])
+        self.assertEqual(self.coalescer.stats(),
+                         {'calls': 2, 'requested': 5, 'fetched': 4})
+        self.assertFalse(self.coalescer.fetching)
+
+    def test_fetching_reset_after_error(self):
+        def fail(reqs, output):
+            raise RuntimeError('failed')
+        self.coalescer._fetch_requests = fail
+        self.assertRaises(RuntimeError, self.coalescer.get, [1])
+        self.assertFalse(self.coalescer.fetching)
+        # the next thread asking fetches again.
+        del self.coalescer._fetch_requests
+        self.first.set()
+        allselections = self.coalescer.get([1])
+        self.assertEqual([s.id for s in allselections[0]], [100, 101])
+        self.assertFalse(self.coalescer.fetching)
+
+if __name__ == '__main__':
+    unittest.main()
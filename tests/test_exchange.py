@@ -0,0 +1,80 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for the Selection and Order objects of exchange.py."""
+
+import pickle
+import unittest
+from array import array
+
+from betdaq import exchange
+from betdaq.exchange import Selection, Order, O_BACK
+
+class TestSelection(unittest.TestCase):
+
+    def test_prices_as_lists_or_arrays(self):
+        back = [(3.0, 10.0), (2.98, 5.5)]
+        lay = [(3.05, 2.0)]
+        fromlists = Selection(u'Selection \xe9', 101, 1, 0.0, 0.0, None,
+                              None, None, back, lay, 1, 2, _Status=1)
+        fromarrays = Selection(u'Selection \xe9', 101, 1, 0.0, 0.0, None,
+                               None, None, array('d', [3.0, 10.0, 2.98, 5.5]),
+                               array('d', [3.05, 2.0]), 1, 2)
+        for sel in (fromlists, fromarrays):
+            self.assertEqual(sel.name, 'Selection ')
+            self.assertEqual(sel.backprices, back)
+            self.assertEqual(sel.layprices, lay)
+        # the names are shared.
+        self.assertIs(fromlists.name, fromarrays.name)
+        self.assertEqual(fromlists.status, 1)
+        fromarrays.backprices = []
+        self.assertEqual(fromarrays.backprices, [])
+        copy = pickle.loads(pickle.dumps(fromlists, 2))
+        self.assertEqual((copy.id, copy.backprices), (101, back))
+
+    def test_names_bounded(self):
+        saved = exchange._MAXNAMES
+        exchange._MAXNAMES = 3
+        try:
+            names = [exchange._name(u'Name {0}'.format(i))
+                     for i in range(10)]
+            self.assertLessEqual(len(exchange._names), 3)
+            # names dropped from the dict are still shared.
+            self.assertIs(exchange._name(u'Name 0'), names[0])
+        finally:
+            exchange._MAXNAMES = saved
+
+    def test_ladder_lists_are_copies(self):
+        sel = Selection(u'Selection', 101, 1, 0.0, 0.0, None, None, None,
+                        [(3.0, 10.0)], [], 1, 2)
+        sel.backprices.append((2.98, 5.5))
+        self.assertEqual(sel.backprices, [(3.0, 10.0)])
+        sel.backprices = sel.backprices + [(2.98, 5.5)]
+        self.assertEqual(sel.backprices, [(3.0, 10.0), (2.98, 5.5)])
+
+class TestOrder(unittest.TestCase):
+
+    def test_kwargs(self):
+        o = Order(101, 2.0, 3.0, O_BACK, oref=5, mid=1, src=3)
+        self.assertEqual((o.oref, o.mid, o.src, o.wsn), (5, 1, 3, 0))
+        with self.assertRaises(TypeError) as cm:
+            Order(101, 2.0, 3.0, O_BACK, oref=5, note='mine')
+        self.assertIn('note', str(cm.exception))
+        self.assertIn('unmatchedstake', str(cm.exception))
+        self.assertRaises(AttributeError, setattr, o, 'note', 'mine')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for the OddsLadder of exchangedata.py."""
+
+import unittest
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from betdaq import exchangedata
+from betdaq.exchangedata import OddsLadder
+
+# (price, next shorter, next longer) at the ends and at each change of
+# increment of the ladder.
+_BOUNDARIES = [(1.01, None, 1.02), (2.0, 1.99, 2.01), (3.0, 2.99, 3.05),
+               (4.0, 3.95, 4.1), (6.0, 5.9, 6.2), (10.0, 9.8, 10.5),
+               (20.0, 19.5, 21.0), (50.0, 49.0, 52.0),
+               (200.0, 198.0, 205.0), (1000.0, 995.0, None)]
+
+class TestOddsLadder(unittest.TestCase):
+
+    def setUp(self):
+        self.ladder = OddsLadder.from_increments()
+
+    def test_ends(self):
+        ladder = self.ladder
+        self.assertEqual((ladder.minprice, ladder.maxprice), (1.01, 1000.0))
+        self.assertEqual(len(ladder), 545)
+        self.assertEqual(ladder.tick(1.01), 0)
+        self.assertEqual(ladder.tick(1000.0), len(ladder) - 1)
+        self.assertRaises(IndexError, ladder.price, -1)
+        self.assertRaises(IndexError, ladder.price, len(ladder))
+
+    def test_band_boundaries(self):
+        ladder = self.ladder
+        for (price, shorter, longer) in _BOUNDARIES:
+            self.assertIn(price, ladder)
+            self.assertEqual(ladder.offset(price, -1), shorter)
+            self.assertEqual(ladder.offset(price, 1), longer)
+            tick = ladder.tick(price)
+            self.assertEqual(ladder.price(tick), price)
+            if longer is not None:
+                self.assertEqual(ladder.price(tick + 1), longer)
+                self.assertEqual(ladder.distance(price, longer), 1)
+        # ticks are counted across the changes of increment.
+        self.assertEqual(ladder.distance(2.98, 3.1), 4)
+        self.assertEqual(ladder.distance(3.1, 2.98), -4)
+        self.assertEqual(ladder.offset(9.8, 3), 11.0)
+        self.assertEqual(ladder.offset(990.0, 3), None)
+        self.assertEqual(exchangedata.next_shorter_odds(1.01),
+                         exchangedata.MINODDS)
+
+    def test_exact_floats(self):
+        # prices are the floats of the ladder, whatever the arithmetic
+        # that gave them.
+        self.assertIs(self.ladder.round(3.0499999), self.ladder.prices[
+            self.ladder.tick(3.05)])
+        self.assertEqual(self.ladder.offset(0.1 + 0.2 + 2.7, 1), 3.05)
+
+    def test_rounding(self):
+        ladder = self.ladder
+        for (price, down, up, nearest) in [(3.02, 3.0, 3.05, 3.0),
+                                           (3.03, 3.0, 3.05, 3.05),
+                                           (4.05, 4.0, 4.1, 4.0),
+                                           (9.9, 9.8, 10.0, 9.8),
+                                           (997.0, 995.0, 1000.0, 995.0)]:
+            self.assertNotIn(price, ladder)
+            self.assertEqual(ladder.round(price, 'down'), down)
+            self.assertEqual(ladder.round(price, 'up'), up)
+            self.assertEqual(ladder.round(price), nearest)
+            self.assertRaises(ValueError, ladder.tick, price)
+        # off the ends of the ladder, to the end.
+        for rounding in ('down', 'up', 'nearest'):
+            self.assertEqual(ladder.round(1.0, rounding), 1.01)
+            self.assertEqual(ladder.round(1500.0, rounding), 1000.0)
+        self.assertRaises(ValueError, ladder.round, 3.02, 'sideways')
+        # offsets from off the ladder count from the next price in
+        # the direction we move.
+        self.assertEqual(ladder.offset(3.02, 1), 3.05)
+        self.assertEqual(ladder.offset(3.02, -1), 3.0)
+
+    @unittest.skipIf(numpy is None, 'vectorized ticks need numpy')
+    def test_ticks_vectorized(self):
+        prices = [1.0, 1.01, 2.995, 3.02, 3.03, 10.0, 997.0, 1500.0]
+        for rounding in ('down', 'up', 'nearest'):
+            self.assertEqual(
+                list(self.ladder.ticks(numpy.array(prices), rounding)),
+                self.ladder.ticks(prices, rounding))
+        self.assertRaises(ValueError, self.ladder.ticks,
+                          numpy.array([3.0, 3.02]))
+        ticks = self.ladder.ticks(numpy.array([3.0, 3.05]))
+        self.assertEqual(list(self.ladder.prices_of(ticks)), [3.0, 3.05])
+
+if __name__ == '__main__':
+    unittest.main()
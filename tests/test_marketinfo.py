@@ -0,0 +1,187 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for marketinfo.py, the cache of market information."""
+
+import time
+import threading
+import unittest
+
+from betdaq import api, marketinfo
+from betdaq.exchange import MarketInfo
+from server import StubServer, prices_reply
+
+def market_info(mid, status=2, wsn=1):
+    return MarketInfo(mid, 'Market', 1, status, None, False, True, 5, wsn,
+                      1, None, ())
+
+class FakeMarketInformation(object):
+    """
+    Replaces api.GetMarketInformation, recording the market ids of
+    each call.  Market ids of 1000 or more are not found.  If block
+    is True, calls wait until release is set.
+    """
+
+    def __init__(self, block=False):
+        self.saved = api.GetMarketInformation
+        api.GetMarketInformation = self
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+
+    def __call__(self, mids):
+        self.calls.append(list(mids))
+        self.started.set()
+        self.release.wait()
+        return [market_info(m) for m in mids if m < 1000]
+
+    def restore(self):
+        api.GetMarketInformation = self.saved
+
+class TestMarketInfoCache(unittest.TestCase):
+
+    def setUp(self):
+        self.fake = FakeMarketInformation()
+
+    def tearDown(self):
+        self.fake.release.set()
+        self.fake.restore()
+
+    def test_cached(self):
+        mc = marketinfo.MarketInfoCache()
+        self.assertEqual(mc.get([1, 2]), [market_info(1), market_info(2)])
+        self.assertEqual(mc.get([2, 1]), [market_info(2), market_info(1)])
+        self.assertEqual(self.fake.calls, [[1, 2]])
+
+    def test_ttl_expiry(self):
+        mc = marketinfo.MarketInfoCache(ttl=0.1)
+        mc.get([1])
+        mc.get([1])
+        self.assertEqual(self.fake.calls, [[1]])
+        time.sleep(0.2)
+        self.assertEqual(mc.get([1]), [market_info(1)])
+        self.assertEqual(self.fake.calls, [[1], [1]])
+
+    def test_lru_eviction(self):
+        mc = marketinfo.MarketInfoCache(maxentries=2)
+        mc.get([1])
+        mc.get([2])
+        # 1 is now more recently used than 2, which is evicted.
+        mc.get([1])
+        mc.get([3])
+        mc.get([1])
+        self.assertEqual(self.fake.calls, [[1], [2], [3]])
+        mc.get([2])
+        self.assertEqual(self.fake.calls, [[1], [2], [3], [2]])
+        self.assertEqual(mc.stats()['evictions'], 2)
+
+    def test_not_found_cached(self):
+        mc = marketinfo.MarketInfoCache(ttl=0.1)
+        self.assertEqual(mc.get([1, 1001]), [market_info(1), None])
+        self.assertEqual(mc.get([1001]), [None])
+        self.assertEqual(self.fake.calls, [[1, 1001]])
+        # until the time to live is up.
+        time.sleep(0.2)
+        self.assertEqual(mc.get([1001]), [None])
+        self.assertEqual(self.fake.calls, [[1, 1001], [1001]])
+
+    def test_failure_not_cached(self):
+        def fail(mids):
+            raise RuntimeError('failed')
+        api.GetMarketInformation = fail
+        mc = marketinfo.MarketInfoCache()
+        self.assertEqual(mc.get([1]), [None])
+        api.GetMarketInformation = self.fake
+        self.assertEqual(mc.get([1]), [market_info(1)])
+
+    def test_concurrent_lookups_batched(self):
+        self.fake.release.clear()
+        mc = marketinfo.MarketInfoCache()
+        results = {}
+
+        def lookup(name, mids):
+            results[name] = mc.get(mids)
+
+        first = threading.Thread(target=lookup, args=('a', [1]))
+        first.start()
+        self.fake.started.wait()
+        # while 1 is being fetched, two more threads ask for it, and
+        # for markets 2 and 3 between them.
+        others = [threading.Thread(target=lookup, args=('b', [1, 2])),
+                  threading.Thread(target=lookup, args=('c', [2, 3]))]
+        for t in others:
+            t.start()
+        deadline = time.time() + 5.0
+        while len(mc.inflight) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+        self.fake.release.set()
+        for t in [first] + others:
+            t.join()
+        # 1 is fetched once, and 2 and 3 in a single batch.
+        self.assertEqual([sorted(c) for c in self.fake.calls],
+                         [[1], [2, 3]])
+        self.assertEqual(results, {'a': [market_info(1)],
+                                   'b': [market_info(1), market_info(2)],
+                                   'c': [market_info(2), market_info(3)]})
+
+    def test_check(self):
+        mc = marketinfo.MarketInfoCache()
+        mc.get([1])
+        # matching state (or none given) keeps the entry.
+        mc.check(1, 2, False, 1)
+        mc.check(1)
+        mc.get([1])
+        self.assertEqual(self.fake.calls, [[1]])
+        for state in ({'status': 3}, {'inrunning': True}, {'wsn': 2}):
+            mc.check(1, **state)
+            mc.get([1])
+        self.assertEqual(self.fake.calls, [[1]] * 4)
+        # a market not cached is left alone.
+        mc.check(2, 3)
+        self.assertEqual(mc.get([2]), [market_info(2)])
+
+class TestGetPricesCheck(unittest.TestCase):
+    """GetPrices invalidates market information that is out of date."""
+
+    def setUp(self):
+        self.server = StubServer(prices_reply)
+        api._rcl.client.set_options(location=self.server.url)
+        self.cache = marketinfo.marketcache.cache
+
+    def tearDown(self):
+        api._rcl.client.set_options(location=None)
+        self.cache.clear()
+        self.server.close()
+
+    def test_check_from_getprices(self):
+        # the stub server's markets are active (status 2), not in
+        # running, and have withdrawal sequence number 1.
+        for output in ('selections', 'tuples'):
+            self.cache.put(1, market_info(1))
+            self.cache.put(2, market_info(2, wsn=0))
+            self.cache.put(3, market_info(3, status=3))
+            states = {}
+            api.GetPrices([1, 2, 3], output=output, states=states)
+            self.assertEqual(sorted(states), [1, 2, 3])
+            self.assertEqual(tuple(states[1]), (1, 2, False, 1))
+            self.assertIn(1, self.cache)
+            self.assertNotIn(2, self.cache)
+            self.assertNotIn(3, self.cache)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""
+Tests for orderstore.py, and for the order store being kept up to
+date by ListOrdersChangedSince and bootstrap.py.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+from betdaq import api, apiparse, bootstrap
+from betdaq.exchange import Order, O_BACK, O_LAY, O_UNMATCHED, O_MATCHED
+from betdaq.orderstore import OrderStore
+from server import StubServer, envelope
+
+_NS = 'http://www.GlobalBettingExchange.com/ExternalAPI/'
+_STATUS = ('<ReturnStatus Code="0" Description="Success" CallId="x"/>'
+           '<Timestamp>2013-08-04T14:30:00Z</Timestamp>')
+
+def order_xml(oref, sid, status, ustake, mstake, seqnum):
+    """Return Order element of a back order on market 1 at 3.0."""
+
+    return ('<Order Id="{0}" MarketId="1" SelectionId="{1}" '
+            'SequenceNumber="{2}" IssuedAt="2013-08-04T14:00:00Z" '
+            'Polarity="1" UnmatchedStake="{3}" RequestedPrice="3.0" '
+            'MatchedStake="{4}" TotalForSideMakeStake="0" '
+            'TotalForSideTakeStake="0" Status="{5}" '
+            'CancelOnInRunning="true" CancelIfSelectionReset="false" '
+            'IsCurrentlyInRunning="false" PunterCommissionBasis="1" '
+            'MakeCommissionRate="0" TakeCommissionRate="0"/>'
+            .format(oref, sid, seqnum, ustake, mstake, status))
+
+def unmatched(oref, sid, stake, polarity=O_BACK, mid=1):
+    return Order(sid, stake, 3.0, polarity, oref=oref, mid=mid,
+                 status=O_UNMATCHED, matchedstake=0.0, unmatchedstake=stake)
+
+class TestOrderStore(unittest.TestCase):
+
+    def setUp(self):
+        self.store = OrderStore()
+        self.orders = [unmatched(1, 10, 2.0), unmatched(2, 10, 3.0),
+                       unmatched(3, 11, 4.0, O_LAY, mid=2)]
+        self.store.update(self.orders)
+
+    def check_indexes(self):
+        """Check the indexes against a scan of the orders."""
+
+        store = self.store
+        for (index, attr) in ((store.bysid, 'sid'), (store.bymid, 'mid'),
+                              (store.bystatus, 'status')):
+            expected = {}
+            for o in store:
+                expected.setdefault(getattr(o, attr), {})[o.oref] = o
+            self.assertEqual(index, expected)
+        unmatched = {}
+        for o in store.by_status(O_UNMATCHED):
+            key = (o.sid, o.polarity)
+            unmatched[key] = unmatched.get(key, 0.0) + o.unmatchedstake
+        self.assertEqual(store.unmatched, unmatched)
+
+    def test_lookups(self):
+        self.check_indexes()
+        self.assertEqual(sorted(o.oref for o in self.store.by_selection(10)),
+                         [1, 2])
+        self.assertEqual([o.oref for o in self.store.by_market(2)], [3])
+        self.assertEqual(self.store.unmatched_stake(10, O_BACK), 5.0)
+        self.assertEqual(self.store.unmatched_stake(10, O_LAY), 0.0)
+
+    def test_update_in_place(self):
+        o = Order(10, 2.0, 3.0, O_BACK, oref=1, mid=1, status=O_MATCHED,
+                  matchedstake=2.0, unmatchedstake=0.0)
+        updated = self.store.update({1: o})
+        # the order we had is updated, not replaced.
+        self.assertIs(updated[1], self.orders[0])
+        self.assertEqual(self.orders[0].status, O_MATCHED)
+        self.check_indexes()
+        self.assertEqual([o.oref for o in self.store.by_status(O_MATCHED)],
+                         [1])
+        self.assertEqual(self.store.unmatched_stake(10, O_BACK), 3.0)
+
+    def test_set_status_and_remove(self):
+        self.store.set_status([2, 3, 99], O_MATCHED)
+        self.check_indexes()
+        self.assertEqual(self.store.unmatched_stake(11, O_LAY), 0.0)
+        self.store.remove([1, 3, 99])
+        self.check_indexes()
+        self.assertEqual(self.store.bymid.keys(), [1])
+        self.assertEqual(self.store.bystatus.keys(), [O_MATCHED])
+        self.assertEqual(self.store.unmatched, {})
+
+class TestParseSingleOrder(unittest.TestCase):
+    """A single order given as the order itself, rather than a list."""
+
+    def response(self, name):
+        """Return Api response name with a single order in it."""
+
+        factory = api._scl.client.factory
+        # factory.create gives the element, which holds the response.
+        resp = getattr(factory.create(name + 'Response'), name + 'Result')
+        resp.ReturnStatus._Code = 0
+        resp._MaximumSequenceNumber = 6
+        o = factory.create('Order')
+        for (attr, value) in (('Id', 1), ('MarketId', 1),
+                              ('SelectionId', 10), ('SequenceNumber', 6),
+                              ('Polarity', O_BACK), ('Status', O_MATCHED),
+                              ('RequestedPrice', 3.0),
+                              ('UnmatchedStake', 0.0),
+                              ('MatchedStake', 2.0)):
+            setattr(o, '_' + attr, value)
+        resp.Orders.Order = o
+        return resp
+
+    def check_order(self, orders):
+        self.assertEqual(orders.keys(), [1])
+        o = orders[1]
+        self.assertEqual((o.sid, o.mid, o.stake, o.status, o.matchedstake),
+                         (10, 1, 2.0, O_MATCHED, 2.0))
+
+    def test_orders_changed(self):
+        (orders, seqnum) = apiparse.ParseListOrdersChangedSince(
+            self.response('ListOrdersChangedSince'))
+        self.check_order(orders)
+        self.assertEqual(seqnum, 6)
+
+    def test_bootstrap(self):
+        self.check_order(apiparse.ParseListBootstrapOrders(
+            self.response('ListBootstrapOrders')))
+
+class TestOrdersFromApi(unittest.TestCase):
+    """
+    ListOrdersChangedSince and ListBootstrapOrders against a stub
+    server, which replies with the batches in self.batches in turn
+    (and no orders once they have run out).
+    """
+
+    def setUp(self):
+        self.server = StubServer(self.reply)
+        api.set_user('username', 'password')
+        api._scl.client.set_options(location=self.server.url)
+        self.store = api.orders()
+        self.store.clear()
+        self.store.seqnum = -1
+        self.batches = []
+        self.seqnum = 0
+        self.tmpdir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.tmpdir, 'orders')
+
+    def tearDown(self):
+        self.store.clear()
+        self.store.seqnum = -1
+        api._scl.client.set_options(location=None)
+        self.server.close()
+        shutil.rmtree(self.tmpdir)
+
+    def reply(self, request):
+        orders = ''
+        if self.batches:
+            batch = self.batches.pop(0)
+            orders = '<Orders>{0}</Orders>'.format(
+                ''.join(order_xml(*o) for o in batch))
+            self.seqnum = max(o[-1] for o in batch)
+        if 'ListBootstrapOrders' in request:
+            body = ('<ListBootstrapOrdersResponse xmlns="{0}">'
+                    '<ListBootstrapOrdersResult MaximumSequenceNumber="{1}">'
+                    '{2}{3}</ListBootstrapOrdersResult>'
+                    '</ListBootstrapOrdersResponse>')
+        else:
+            body = ('<ListOrdersChangedSinceResponse xmlns="{0}">'
+                    '<ListOrdersChangedSinceResult>{2}{3}'
+                    '</ListOrdersChangedSinceResult>'
+                    '</ListOrdersChangedSinceResponse>')
+        return (200, envelope(body.format(_NS, self.seqnum, _STATUS, orders)))
+
+    def requested_seqnums(self):
+        return [int(s) for r in self.server.requests
+                for s in re.findall(r'SequenceNumber>(-?\d+)<', r)]
+
+    def test_single_order_changed(self):
+        orders = [unmatched(1, 10, 2.0), unmatched(2, 10, 3.0)]
+        self.store.update(orders)
+        self.store.seqnum = 5
+        # a delta of a single order.
+        self.batches = [[(1, 10, O_MATCHED, 0.0, 2.0, 6)]]
+        changed = api.ListOrdersChangedSince()
+        self.assertEqual(changed.keys(), [1])
+        self.assertIs(changed[1], orders[0])
+        self.assertEqual((orders[0].status, orders[0].matchedstake),
+                         (O_MATCHED, 2.0))
+        self.assertEqual(self.store.seqnum, 6)
+        self.assertEqual([o.oref for o in self.store.by_status(O_UNMATCHED)],
+                         [2])
+        self.assertEqual([o.oref for o in self.store.by_status(O_MATCHED)],
+                         [1])
+        self.assertEqual(sorted(o.oref for o in self.store.by_selection(10)),
+                         [1, 2])
+        self.assertEqual(len(self.store.by_market(1)), 2)
+        self.assertEqual(self.store.unmatched_stake(10, O_BACK), 3.0)
+        # nothing more has changed.
+        self.assertEqual(api.ListOrdersChangedSince(), {})
+        self.assertEqual(self.requested_seqnums(), [5, 6])
+
+    def test_bootstrap_checkpoint(self):
+        self.batches = [[(1, 10, O_UNMATCHED, 2.0, 0.0, 1)],
+                        [(2, 11, O_UNMATCHED, 3.0, 0.0, 2),
+                         (3, 11, O_MATCHED, 0.0, 4.0, 3)]]
+        gen = bootstrap.bootstrap_orders(checkpoint=self.checkpoint)
+        self.assertEqual(gen.next().keys(), [1])
+        # the process stops after the first batch.
+        gen.close()
+        self.store.clear()
+        self.store.seqnum = -1
+
+        # restarting carries on from the checkpoint.
+        batches = list(bootstrap.bootstrap_orders(
+            checkpoint=self.checkpoint))
+        self.assertEqual([sorted(b) for b in batches], [[1], [2, 3]])
+        self.assertEqual(sorted(o.oref for o in self.store), [1, 2, 3])
+        self.assertEqual(self.store.seqnum, 3)
+        self.assertEqual(self.requested_seqnums(), [-1, 1, 3])
+        self.assertEqual(self.store.unmatched_stake(11, O_BACK), 3.0)
+
+        # once complete, a restart only asks for the changes since.
+        self.store.clear()
+        self.batches = [[(2, 11, O_MATCHED, 0.0, 3.0, 4)]]
+        batches = list(bootstrap.bootstrap_orders(
+            checkpoint=self.checkpoint))
+        self.assertEqual([sorted(b) for b in batches], [[1, 2, 3], [2]])
+        self.assertEqual(self.requested_seqnums(), [-1, 1, 3, 3, 4])
+        self.assertEqual(self.store[2].status, O_MATCHED)
+        self.assertEqual(self.store.unmatched_stake(11, O_BACK), 0.0)
+        self.assertEqual(bootstrap.load_checkpoint(self.checkpoint), True)
+        self.assertEqual(self.store.seqnum, 4)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for poller.py, the adaptive market polling scheduler."""
+
+import time
+import datetime
+import unittest
+from suds.sax.date import DateTime, Timezone
+
+from betdaq import api, const, poller, ratelimit, util
+from betdaq.exchange import Market, MarketInfo
+from server import StubServer, market_ids, prices_reply
+
+def suds_datetime(value):
+    """Return xs:dateTime string value as SUDS unmarshals it."""
+
+    return DateTime(value).datetime
+
+class TestStartTime(unittest.TestCase):
+
+    def setUp(self):
+        self.local = Timezone.LOCAL
+
+    def tearDown(self):
+        Timezone.LOCAL = self.local
+
+    def test_suds_utc(self):
+        for local in (0, 1, -5):
+            # as if SUDS had been imported in another timezone.
+            Timezone.LOCAL = local
+            for value in ('2013-08-04T15:00:00Z',
+                          '2013-08-04T16:00:00+01:00',
+                          '2013-08-04T10:00:00-05:00'):
+                self.assertEqual(util.suds_utc(suds_datetime(value)),
+                                 datetime.datetime(2013, 8, 4, 15, 0))
+        self.assertIsNone(util.suds_utc(None))
+
+    def test_policy_for_market_starting_soon(self):
+        Timezone.LOCAL = 1
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        start = (now + datetime.timedelta(minutes=5)).isoformat() + 'Z'
+        market = Market('Racing|Race|Win', 1, 0, False,
+                        _StartTime=suds_datetime(start))
+        self.assertEqual(poller.default_policy(market, now),
+                         poller.INRUNNING_INTERVAL)
+        start = (now + datetime.timedelta(minutes=50)).isoformat() + 'Z'
+        market = Market('Racing|Race|Win', 1, 0, False,
+                        _StartTime=suds_datetime(start))
+        self.assertEqual(poller.default_policy(market, now), 5.0)
+
+def market_info(mid):
+    """Return MarketInfo of a market with the default interval."""
+
+    return MarketInfo(mid, 'Market', 1, 2, None, False, True, 5, 1, 1,
+                      None, ())
+
+class TestScheduling(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(prices_reply)
+        api._rcl.client.set_options(location=self.server.url)
+        self.poller = poller.Poller(workers=4, output='tuples')
+        self.mids = range(1000, 1230)
+        self.poller.add_markets([market_info(m) for m in self.mids])
+
+    def tearDown(self):
+        api._rcl.client.set_options(location=None)
+        api.set_rate_limit('GetPrices', *const.RATELIMITS['GetPrices'])
+        self.server.close()
+
+    def test_maxchunks(self):
+        api.set_rate_limit('GetPrices', 2, 60.0)
+        self.assertEqual(self.poller.maxchunks(), 2)
+        ratelimit.limiter.reserve('GetPrices')
+        ratelimit.limiter.reserve('GetPrices')
+        # even with the bucket empty, we make progress.
+        self.assertEqual(self.poller.maxchunks(), 1)
+        api.set_rate_limit('GetPrices', 60, 60.0)
+        self.assertEqual(self.poller.maxchunks(), 4)
+
+    def test_take_due_limited(self):
+        now = time.time()
+        self.assertEqual(self.poller.take_due(now, 2), self.mids[:100])
+        # the rest are picked on the next call.
+        self.assertEqual(self.poller.take_due(now, 2), self.mids[100:200])
+        self.assertEqual(self.poller.take_due(now, 2), self.mids[200:])
+        self.assertEqual(self.poller.take_due(now, 2), [])
+
+    def test_poll_takes_what_rate_limit_allows(self):
+        api.set_rate_limit('GetPrices', 1, 60.0)
+        got = []
+        self.poller.subscribe(lambda mid, sels: got.append(mid))
+        start = time.time()
+        self.assertEqual(self.poller.poll(), 50)
+        self.assertLess(time.time() - start, 5.0)
+        self.assertEqual([market_ids(r) for r in self.server.requests],
+                         [self.mids[:50]])
+        self.assertEqual(got, self.mids[:50])
+        self.assertEqual(len(self.poller.due), len(self.mids))
+
+def inrunning_reply(request):
+    """Return (200, GetPrices reply) with the markets in running."""
+
+    (status, body) = prices_reply(request)
+    return (status, body.replace('IsCurrentlyInRunning="false"',
+                                 'IsCurrentlyInRunning="true"'))
+
+class TestMarketState(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(inrunning_reply)
+        api._rcl.client.set_options(location=self.server.url)
+        self.poller = poller.Poller()
+
+    def tearDown(self):
+        api._rcl.client.set_options(location=None)
+        self.server.close()
+
+    def test_goes_in_running(self):
+        market = Market('Racing|Race|Win', 1000, 0, False)
+        self.poller.add_markets([market_info(1001), market])
+        self.assertEqual(self.poller.intervals,
+                         {1000: poller.DEFAULT_INTERVAL,
+                          1001: poller.DEFAULT_INTERVAL})
+        self.assertEqual(self.poller.poll(), 2)
+        done = time.time()
+        self.assertTrue(market.inrunning)
+        self.assertTrue(self.poller.markets[1001].inrunning)
+        # both are next due at the in running interval.
+        for mid in (1000, 1001):
+            self.assertEqual(self.poller.intervals[mid],
+                             poller.INRUNNING_INTERVAL)
+            self.assertLessEqual(self.poller.due[mid],
+                                 done + poller.INRUNNING_INTERVAL)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for pricediff.py, the changes between successive polls."""
+
+import unittest
+
+from betdaq.exchange import Selection, LevelChange
+from betdaq.pricediff import PriceDiffer
+
+def selection(sid, mid, stake=10.0):
+    return Selection(u'Selection', sid, mid, 0.0, 0.0, None, None, None,
+                     [(3.0, stake)], [], 1, 0, _Status=1)
+
+def market(mid, sids, stake=10.0):
+    return [selection(sid, mid, stake) for sid in sids]
+
+class TestPriceDiffer(unittest.TestCase):
+
+    def setUp(self):
+        self.differ = PriceDiffer()
+        self.differ.diff([market(1, [10, 11, 12]), market(2, [20, 21])])
+
+    def test_changes(self):
+        # an unchanged poll has no changes.
+        self.assertEqual(self.differ.diff([market(1, [10, 11, 12]),
+                                           market(2, [20, 21])]), [])
+        changes = self.differ.diff([market(1, [10, 11, 12], 12.0)])
+        self.assertEqual(sorted(c.sid for c in changes), [10, 11, 12])
+        self.assertEqual(changes[0], LevelChange(changes[0].sid, 1, 'back',
+                                                 3.0, 10.0, 12.0))
+
+    def test_missing_selections_forgotten(self):
+        self.differ.diff([market(1, [10, 12]), market(2, [20, 21])])
+        self.assertEqual(sorted(self.differ.state), [10, 12, 20, 21])
+        self.assertEqual(self.differ.markets[1], set([10, 12]))
+        # a selection that comes back is new again.
+        changes = self.differ.diff([market(1, [10, 11, 12])])
+        self.assertEqual(set(c.sid for c in changes), set([11]))
+        # as many selections as before, but one of them new.
+        self.differ.diff([market(1, [10, 11, 13])])
+        self.assertEqual(sorted(self.differ.state), [10, 11, 13, 20, 21])
+
+    def test_empty_and_failed_markets(self):
+        # without market ids, an empty market can't be pruned.
+        self.differ.diff([[], market(2, [20, 21])])
+        self.assertEqual(len(self.differ), 5)
+        # a market that could not be fetched keeps its selections.
+        self.differ.diff([None, market(2, [20, 21])], [1, 2])
+        self.assertEqual(len(self.differ), 5)
+        self.differ.diff([[], market(2, [20])], [1, 2])
+        self.assertEqual(sorted(self.differ.state), [20])
+
+    def test_remove_and_clear(self):
+        self.differ.remove([11, 20])
+        self.assertEqual(self.differ.markets[1], set([10, 12]))
+        self.assertEqual(sorted(self.differ.state), [10, 12, 21])
+        changes = self.differ.diff([market(1, [10, 11, 12])])
+        self.assertEqual(set(c.sid for c in changes), set([11]))
+        self.differ.clear()
+        self.assertEqual((len(self.differ), self.differ.markets), (0, {}))
+
+    def test_poll_columns(self):
+        self.assertRaises(ValueError, self.differ.poll, [1, 2],
+                          output='columns')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for ratelimit.py, the token buckets, with a fake clock."""
+
+import threading
+import unittest
+
+from betdaq import ratelimit
+
+class FakeClock(object):
+    """
+    Stands in for the time module in ratelimit.py.  The time only
+    moves when the test advances it; sleep records how long the
+    caller would have slept.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+        self.lock = threading.Lock()
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        with self.lock:
+            self.slept.append(secs)
+
+    def advance(self, secs):
+        self.now += secs
+
+class TestTokenBucket(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.saved = ratelimit.time
+        ratelimit.time = self.clock
+
+    def tearDown(self):
+        ratelimit.time = self.saved
+
+    def test_burst_capacity(self):
+        bucket = ratelimit.TokenBucket(3, 6.0)
+        self.assertEqual(bucket.available(), 3)
+        # a burst of up to 3 calls doesn't wait.
+        self.assertEqual([bucket.acquire() for i in range(3)], [0.0] * 3)
+        self.assertEqual(bucket.available(), 0)
+        # the next waits for a token, at one every 2 seconds.
+        self.assertAlmostEqual(bucket.acquire(), 2.0)
+        self.assertEqual(self.clock.slept, [2.0])
+        self.assertEqual(bucket.ncalls, 4)
+        self.assertAlmostEqual(bucket.waited, 2.0)
+
+    def test_refill(self):
+        bucket = ratelimit.TokenBucket(3, 6.0)
+        for i in range(3):
+            bucket.reserve()
+        self.clock.advance(3.0)
+        self.assertEqual(bucket.available(), 1)
+        self.assertEqual(bucket.reserve(), 0.0)
+        # half a token was left over.
+        self.assertAlmostEqual(bucket.reserve(), 1.0)
+        # the bucket refills to its capacity and no further.
+        self.clock.advance(100.0)
+        self.assertEqual(bucket.available(), 3)
+
+    def test_bad_limit(self):
+        self.assertRaises(ValueError, ratelimit.TokenBucket, 0, 1.0)
+        self.assertRaises(ValueError, ratelimit.TokenBucket, 1, 0.0)
+
+    def test_waiting_across_threads(self):
+        bucket = ratelimit.TokenBucket(2, 2.0)
+        start = threading.Event()
+        waits = []
+        def call():
+            start.wait()
+            waits.append(bucket.acquire())
+        threads = [threading.Thread(target=call) for i in range(6)]
+        for t in threads:
+            t.start()
+        start.set()
+        for t in threads:
+            t.join()
+        # each call queues up behind the others, rather than all
+        # waiting for the same token.
+        self.assertEqual(sorted(round(w, 6) for w in waits),
+                         [0.0, 0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(sorted(round(s, 6) for s in self.clock.slept),
+                         [1.0, 2.0, 3.0, 4.0])
+
+class TestRateLimiter(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.saved = ratelimit.time
+        ratelimit.time = self.clock
+        self.limiter = ratelimit.RateLimiter({'GetPrices': (2, 1.0)})
+
+    def tearDown(self):
+        ratelimit.time = self.saved
+
+    def test_set_limit(self):
+        self.limiter.acquire('GetPrices')
+        self.limiter.acquire('GetPrices')
+        self.assertAlmostEqual(self.limiter.reserve('GetPrices'), 0.5)
+        # a new limit starts with a full bucket.
+        self.limiter.set_limit('GetPrices', 10, 1.0)
+        self.assertEqual(self.limiter.available('GetPrices'), 10)
+        self.assertEqual(self.limiter.stats(), {'GetPrices': (0, 0.0)})
+        self.limiter.remove_limit('GetPrices')
+        self.assertIsNone(self.limiter.available('GetPrices'))
+        self.assertEqual(self.limiter.acquire('GetPrices'), 0.0)
+
+    def test_unlimited_method(self):
+        self.assertIsNone(self.limiter.available('ListTopLevelEvents'))
+        for i in range(100):
+            self.assertEqual(self.limiter.acquire('ListTopLevelEvents'), 0.0)
+        self.assertEqual(self.clock.slept, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for reconcile.py, moving orders to a target set of orders."""
+
+import re
+import unittest
+
+from betdaq import api, reconcile
+from betdaq.exchange import Order, O_BACK, O_UNMATCHED, O_CANCELLED
+from server import StubServer, envelope
+
+_NS = 'http://www.GlobalBettingExchange.com/ExternalAPI/'
+_STATUS = ('<ReturnStatus Code="0" Description="Success" CallId="x"/>'
+           '<Timestamp>2013-08-04T14:30:00Z</Timestamp>')
+
+def reply(request):
+    """Return (200, reply) to CancelOrders or UpdateOrdersNoReceipt."""
+
+    if '<CancelOrders ' in request:
+        orefs = re.findall(r'<OrderHandle>(\d+)</OrderHandle>', request)
+        body = ('<CancelOrdersResponse xmlns="{0}"><CancelOrdersResult>'
+                '{1}<CancelledOrdersHandles>{2}</CancelledOrdersHandles>'
+                '<Orders>{3}</Orders></CancelOrdersResult>'
+                '</CancelOrdersResponse>').format(
+            _NS, _STATUS,
+            ''.join('<OrderHandle>{0}</OrderHandle>'.format(o)
+                    for o in orefs),
+            ''.join('<Order OrderHandle="{0}" cancelledForSideStake="2.0" '
+                    'PunterReferenceNumber="0"/>'.format(o) for o in orefs))
+    else:
+        orefs = re.findall(r'BetId="(\d+)"', request)
+        body = ('<UpdateOrdersNoReceiptResponse xmlns="{0}">'
+                '<UpdateOrdersNoReceiptResult>{1}<Orders>{2}</Orders>'
+                '</UpdateOrdersNoReceiptResult>'
+                '</UpdateOrdersNoReceiptResponse>').format(
+            _NS, _STATUS,
+            ''.join('<Order BetId="{0}" ReturnCode="0"/>'.format(o)
+                    for o in orefs))
+    return (200, envelope(body))
+
+def live(oref, sid, stake, price):
+    """Return unmatched back order oref, with reset count 1."""
+
+    return Order(sid, stake, price, O_BACK, oref=oref, status=O_UNMATCHED,
+                 unmatchedstake=stake, src=1, wsn=1)
+
+class TestReconcile(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(reply)
+        api.set_user('username', 'password')
+        api._scl.client.set_options(location=self.server.url)
+        self.store = api.orders()
+        self.store.clear()
+
+    def tearDown(self):
+        self.store.clear()
+        api._scl.client.set_options(location=None)
+        self.server.close()
+
+    def test_plan_leaves_orders_alone(self):
+        orders = [live(1, 10, 2.0, 3.0), live(2, 10, 2.0, 4.0),
+                  live(3, 10, 2.0, 5.0), live(4, 11, 2.0, 3.0)]
+        self.store.update(orders)
+        targets = {10: [Order(10, 2.0, 3.0, O_BACK, src=2, wsn=3),
+                        Order(10, 5.0, 4.0, O_BACK, src=2, wsn=3),
+                        Order(10, 1.0, 6.0, O_BACK, src=2, wsn=3)],
+                   11: []}
+        plan = reconcile.plan_orders(targets, self.store)
+        self.assertEqual(plan.place, [])
+        self.assertEqual([o.oref for o in plan.cancel], [4])
+        self.assertEqual(sorted((o.oref, price, delta, src, wsn)
+                                for (o, price, delta, src, wsn)
+                                in plan.update),
+                         [(2, 4.0, 3.0, 2, 3), (3, 6.0, -1.0, 2, 3)])
+        # until the plan is executed, the orders are as they were.
+        self.assertEqual([(o.src, o.wsn) for o in orders], [(1, 1)] * 4)
+
+    def test_execute(self):
+        orders = [live(oref, 10, 2.0, 3.0) for oref in range(1, 121)]
+        orders.append(live(200, 11, 2.0, 3.0))
+        self.store.update(orders)
+        targets = {10: [], 11: [Order(11, 3.0, 3.5, O_BACK, src=2, wsn=3)]}
+        result = reconcile.execute(reconcile.plan_orders(targets,
+                                                         self.store))
+        # the cancels in chunks of 50, then the update.
+        requests = self.server.requests
+        self.assertEqual([len(re.findall('<OrderHandle>', r))
+                          for r in requests[:3]], [50, 50, 20])
+        self.assertIn('ExpectedSelectionResetCount="2" '
+                      'ExpectedWithdrawalSequenceNumber="3"', requests[3])
+        self.assertEqual(len(requests), 4)
+        self.assertEqual(len(result['cancel']), 120)
+        self.assertEqual(sorted(o.oref for o
+                                in self.store.by_status(O_CANCELLED)),
+                         range(1, 121))
+        self.assertEqual(result['update'], {200: 0})
+        o = orders[-1]
+        self.assertEqual((o.price, o.stake, o.src, o.wsn), (3.5, 3.0, 2, 3))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for selectionstore.py, selections kept up to date by changes."""
+
+import unittest
+
+from betdaq import api
+from betdaq.exchange import Selection, SelectionChange, _name
+from betdaq.selectionstore import SelectionStore
+
+class FakeApi(object):
+    """
+    Replaces the api functions the store uses.  Market mid has
+    selections 10 * mid and 10 * mid + 1, whose reset counts are in
+    self.src, and whose matched amount is the number of GetPrices
+    calls so far.
+    """
+
+    NAMES = ('GetPrices', 'ListSelectionsChangedSince',
+             'GetCurrentSelectionSequenceNumber')
+
+    def __init__(self):
+        self.saved = dict((n, getattr(api, n)) for n in FakeApi.NAMES)
+        for n in FakeApi.NAMES:
+            setattr(api, n, getattr(self, n))
+        self.seqnum = 100
+        self.changes = []
+        self.src = {}
+        self.prices = []
+
+    def restore(self):
+        for (n, f) in self.saved.iteritems():
+            setattr(api, n, f)
+
+    def GetPrices(self, mids):
+        self.prices.append(list(mids))
+        n = float(len(self.prices))
+        return [[Selection(u'Selection {0}'.format(sid), sid, mid, n, n,
+                           None, None, None, [(3.0, 10.0)], [],
+                           self.src.get(sid, 1), 0, _Status=1)
+                 for sid in (10 * mid, 10 * mid + 1)] for mid in mids]
+
+    def ListSelectionsChangedSince(self, seqnum):
+        return [c for c in self.changes if c.seqnum > seqnum]
+
+    def GetCurrentSelectionSequenceNumber(self):
+        return self.seqnum
+
+def change(sid, seqnum, name=None, src=1, status=1):
+    name = name or u'Selection {0}'.format(sid)
+    return SelectionChange(sid, sid // 10, name, status, src, 0.0, 3, False,
+                           seqnum)
+
+class TestSelectionStore(unittest.TestCase):
+
+    def setUp(self):
+        self.api = FakeApi()
+        self.store = SelectionStore([1, 2])
+
+    def tearDown(self):
+        self.api.restore()
+
+    def test_bootstrap(self):
+        self.assertEqual(self.store.update(), set([10, 11, 20, 21]))
+        self.assertEqual(self.store.seqnum, 100)
+        self.assertEqual(self.api.prices, [[1, 2]])
+        self.assertEqual([s.id for s in self.store.market(2)], [20, 21])
+
+    def test_apply_changes(self):
+        self.store.update()
+        old = self.store[11]
+        self.api.changes = [change(11, 101, name=u'New name \xe9'),
+                            change(20, 102, src=2)]
+        self.api.src[20] = 2
+        changed = self.store.update()
+        self.assertEqual(self.store.seqnum, 102)
+        # a new name is applied in place; a reset fetches the market.
+        self.assertIs(self.store[11], old)
+        self.assertEqual(self.store[11].name, 'New name ')
+        self.assertIs(self.store[11].name, _name(u'New name \xe9'))
+        self.assertEqual(self.store[11].properties['_DisplayOrder'], 3)
+        self.assertEqual(self.api.prices, [[1, 2], [2]])
+        self.assertEqual(self.store[20].src, 2)
+        self.assertEqual(changed, set([11, 20, 21]))
+        # nothing new.
+        self.assertEqual(self.store.update(), set())
+        self.assertEqual(self.store.resyncs, 0)
+
+    def test_gap_resyncs(self):
+        self.store.update()
+        self.api.seqnum = 105
+        # 101 is missing.
+        self.api.changes = [change(11, 102), change(20, 103)]
+        self.assertEqual(self.store.update(), set([10, 11, 20, 21]))
+        self.assertEqual(self.store.resyncs, 1)
+        self.assertEqual(self.store.seqnum, 105)
+        self.assertEqual(self.api.prices, [[1, 2], [1, 2]])
+
+    def test_maxage(self):
+        store = SelectionStore([1, 2], maxage=60.0)
+        store.update()
+        self.assertEqual(store.update(), set())
+        # as if market 1 was fetched over a minute ago.
+        store.fetched[1] -= 61.0
+        self.assertEqual(store.update(), set([10, 11]))
+        self.assertEqual(self.api.prices, [[1, 2], [1]])
+        self.assertEqual(store[10].matchedback, 2.0)
+        self.assertEqual(store[20].matchedback, 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
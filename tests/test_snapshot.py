@@ -0,0 +1,130 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for snapshot.py, the prices of GetPrices as numpy arrays."""
+
+import unittest
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from betdaq import api, coalesce, poller, shard
+from server import StubServer, market_ids, prices_reply
+
+if numpy is not None:
+    from betdaq import snapshot
+
+def reply(request):
+    """
+    As prices_reply, but with 3 selections in each market of a request
+    for market 2, and status 500 for a request for market 9.
+    """
+
+    mids = market_ids(request)
+    if 9 in mids:
+        return (500, 'server error')
+    return prices_reply(request, 3 if 2 in mids else 2)
+
+@unittest.skipIf(numpy is None, 'snapshot needs numpy')
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(reply)
+        api.set_user('username', 'password')
+        api._rcl.client.set_options(location=self.server.url)
+
+    def tearDown(self):
+        api._rcl.client.set_options(location=None)
+        self.server.close()
+
+    def test_columns(self):
+        mids = [1, 3, 4]
+        snap = api.GetPrices(mids, output='columns')
+        self.assertEqual(len(snap), 6)
+        self.assertEqual(list(snap.markets), mids)
+        self.assertEqual(list(snap.nsel), [2, 2, 2])
+        self.assertEqual(list(snap.sid), [100, 101, 300, 301, 400, 401])
+        self.assertEqual(list(snap.mid), [1, 1, 3, 3, 4, 4])
+        self.assertEqual(snap.sid[snap.market(3)].tolist(), [300, 301])
+        (prices, stakes) = snap.best('back')
+        self.assertEqual(prices.tolist(), [3.0, 4.0] * 3)
+        self.assertEqual(stakes.tolist(), [10.0] * 6)
+        self.assertEqual(snap.best('lay')[0].tolist(), [3.1, 4.1] * 3)
+        self.assertEqual(snap.levels('back').tolist(), [1] * 6)
+        self.assertEqual(snap.stake_depth('lay').tolist(), [20.0] * 6)
+        numpy.testing.assert_allclose(snap.overround(),
+                                      [100 / 3.0 + 100 / 4.0] * 3)
+        self.assertRaises(ValueError, snap.best, 'middle')
+
+    def test_same_as_selections(self):
+        mids = [1, 2, 3]
+        snap = api.GetPrices(mids, output='columns')
+        allselections = api.GetPrices(mids)
+        sels = [s for ss in allselections for s in ss]
+        self.assertEqual(snap.sid.tolist(), [s.id for s in sels])
+        self.assertEqual(snap.best('back')[0].tolist(),
+                         [s.backprices[0][0] for s in sels])
+        self.assertEqual(snap.best('lay')[0].tolist(),
+                         [s.layprices[0][0] for s in sels])
+        self.assertEqual(snap.lastmatchedprice.tolist(),
+                         [s.lastmatchedprice for s in sels])
+        # 3.0 to 3.1 is two ticks of the ladder, 4.0 to 4.1 and 5.0
+        # to 5.1 one.
+        self.assertEqual(snap.spread_ticks().tolist(), [2, 1, 1] * 3)
+
+    def test_chunks_joined(self):
+        # the markets of the chunk with market 2 have more selections
+        # than the others, and the chunk with market 9 fails.
+        mids = range(100, 250)
+        mids[0] = 2
+        mids[60] = 9
+        snap = api.GetPrices(mids, partial=True, output='columns')
+        self.assertEqual(len(self.server.requests), 3)
+        expected = mids[:50] + mids[100:]
+        self.assertEqual(snap.markets.tolist(), expected)
+        self.assertEqual(snap.depth, 1)
+        self.assertEqual(snap.sid[snap.market(2)].tolist(),
+                         [200, 201, 202])
+        self.assertEqual(snap.sid[snap.market(249)].tolist(),
+                         [24900, 24901])
+        self.assertEqual(snap.per_market(numpy.ones(len(snap))).tolist(),
+                         [3] * 50 + [2] * 50)
+        self.assertRaises(Exception, api.GetPrices, mids, output='columns')
+
+    def test_empty(self):
+        snap = snapshot.PriceSnapshot([])
+        self.assertEqual(len(snap), 0)
+        self.assertEqual(snap.overround().tolist(), [])
+        self.assertEqual(snap.best('back')[0].tolist(), [])
+
+class TestColumnsRejected(unittest.TestCase):
+    """The front-ends that give prices market by market."""
+
+    def test_coalescer(self):
+        self.assertRaises(ValueError, coalesce.GetPrices, [1],
+                          output='columns')
+
+    def test_poller(self):
+        self.assertRaises(ValueError, poller.Poller, output='columns')
+
+    def test_shard_pool(self):
+        self.assertRaises(ValueError, shard.ShardPool, [1],
+                          output='columns')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# Copyright (c) James Mithen 2013.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Tests for transport.py, the keep-alive SUDS transport."""
+
+import time
+import socket
+import unittest
+from suds.transport import Request
+
+from betdaq import apiclient
+from server import StubServer
+
+class TestPooledTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer(lambda body: (200, '<ok>' + body + '</ok>'))
+        self.cl = apiclient.ApiClient('readonly')
+
+    def tearDown(self):
+        self.server.close()
+
+    def send(self, cl, message):
+        request = Request(self.server.url, message)
+        request.headers = {'Content-Type': 'text/xml; charset=utf-8'}
+        return cl.client.options.transport.send(request)
+
+    def test_clone_has_own_transport_sharing_pool(self):
+        clone = self.cl.clone()
+        tp = self.cl.client.options.transport
+        ctp = clone.client.options.transport
+        self.assertIsNot(tp, ctp)
+        self.assertIsNot(tp.options, ctp.options)
+        self.assertIs(tp.pool, ctp.pool)
+        # options set on the clone don't change the original.
+        clone.client.set_options(timeout=5)
+        self.assertEqual(ctp.options.timeout, 5)
+        self.assertNotEqual(tp.options.timeout, 5)
+        self.assertIs(clone.clone().client.options.transport.pool, tp.pool)
+
+    def test_send_through_clone(self):
+        clone = self.cl.clone()
+        reply = self.send(clone, '<a/>')
+        self.assertEqual(reply.code, 200)
+        self.assertEqual(reply.message, '<ok><a/></ok>')
+        # the connection the clone used is reused by the original.
+        reply = self.send(self.cl, '<b/>')
+        self.assertEqual(reply.message, '<ok><b/></ok>')
+        self.assertEqual(self.server.requests, ['<a/>', '<b/>'])
+        self.assertEqual(self.server.connections, 1)
+        stats = self.cl.transport_stats()
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['reused'], 1)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_stale_connection_retried_once(self):
+        self.server.drop = True
+        self.send(self.cl, '<a/>')
+        # the pooled connection has been closed by the server, so the
+        # request is sent again on a new connection.
+        reply = self.send(self.cl, '<b/>')
+        self.assertEqual(reply.message, '<ok><b/></ok>')
+        self.assertEqual(self.server.requests, ['<a/>', '<b/>'])
+        self.assertEqual(self.server.connections, 2)
+
+    def test_timeout_not_retried(self):
+        def reply(body):
+            if body == '<slow/>':
+                time.sleep(1.0)
+            return (200, '<ok/>')
+        self.server.reply = reply
+        self.cl.client.set_options(timeout=0.2)
+        self.send(self.cl, '<a/>')
+        self.assertRaises(socket.timeout, self.send, self.cl, '<slow/>')
+        time.sleep(1.0)
+        # the server may have acted on the request, so it must not
+        # have been sent again.
+        self.assertEqual(self.server.requests, ['<a/>', '<slow/>'])
+
+if __name__ == '__main__':
+    unittest.main()